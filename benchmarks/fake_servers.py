@@ -0,0 +1,329 @@
+#Local stand-ins for Exa search, the Anthropic API and Gmail, so runs can be exercised and benchmarked
+#without spending credits or sending email. Replies are canned but shaped like the real ones.
+#   Exa        POST /search
+#   Anthropic  POST /v1/messages (plain, streamed and forced tool use) and the Message Batches endpoints
+#   Gmail      POST /gmail/v1/users/me/messages/send and the /batch endpoint
+#Each service gets a profile with a latency distribution and error and 429 rates, and GET /stats
+#reports what was served. Point the services at it with environment variables:
+#   python -m benchmarks.fake_servers --port 8100 --anthropic "latency=1.5,jitter=0.4,rate_limits=0.02"
+#   EXA_URL=http://127.0.0.1:8100/search ANTHROPIC_BASE_URL=http://127.0.0.1:8100 \
+#   GMAIL_ROOT_URL=http://127.0.0.1:8100/ BATCH_POLL_INTERVAL=1 python campaign.py --team-member Nico --bulk
+
+import re
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import argparse
+from dataclasses import dataclass
+from email.parser import BytesParser
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+#Seconds a fake batch stays in_progress before it ends
+FAKE_BATCH_DURATION = 2.0
+#Characters per streamed text delta, and the pause between deltas in seconds
+FAKE_STREAM_CHUNK = 8
+FAKE_STREAM_DELAY = 0.02
+#Seconds clients are asked to wait after a 429
+FAKE_RETRY_AFTER = 1
+#Input tokens the API adds for the tool use system prompt when a tool is forced
+FAKE_TOOL_PROMPT_TOKENS = 313
+
+
+@dataclass
+class Profile:
+    #Median latency in seconds, with a log-normal spread (sigma) around it. 0 jitter is a fixed delay
+    latency: float = 0.0
+    jitter: float = 0.0
+    #Fractions of requests answered with a 500 and with a 429
+    errors: float = 0.0
+    rate_limits: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "Profile":
+        #"latency=0.3,jitter=0.5,errors=0.01,rate_limits=0.02", any subset
+        values = {}
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            key, _, value = item.partition("=")
+            if key not in cls.__dataclass_fields__:
+                raise ValueError(f"Unknown profile setting '{key}'")
+            values[key] = float(value)
+        return cls(**values)
+
+    def delay(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.latency), self.jitter) if self.jitter else self.latency
+
+    def fault(self):
+        #Status code to fail this request with, or None
+        roll = random.random()
+        if roll < self.rate_limits:
+            return 429
+        if roll < self.rate_limits + self.errors:
+            return 500
+        return None
+
+
+def _prompt_text(params: dict) -> str:
+    system = params.get("system") or []
+    parts = [system] if isinstance(system, str) else [block.get("text", "") for block in system]
+    for message in params.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content)
+    return "\n".join(parts)
+
+
+def fake_message(params: dict) -> dict:
+    prompt = _prompt_text(params)
+    #Drafter and strategy prompts ask for a JSON object, the validator for plain text or a forced tool call.
+    #The digest keeps replies to different prompts different, as they would be for real
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    choice = params.get("tool_choice") or {}
+    tool = next((t for t in params.get("tools", []) if t["name"] == choice.get("name")), None)
+    if choice.get("type") == "tool" and tool is not None:
+        return _fake_tool_use(params, prompt, tool, digest)
+    if '"subject"' in prompt:
+        text = json.dumps({
+            "subject": f"Fake subject line {digest}",
+            "body": f"Fake email body {digest}.\n\nBest,\nFake"
+        })
+    else:
+        text = f"Fake validated summary of the research {digest}."
+    return {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "fake"),
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4}
+    }
+
+
+def _fake_tool_use(params: dict, prompt: str, tool: dict, digest: str) -> dict:
+    #One string per property of the tool's schema. Tool definitions count as input like the real API,
+    #plus the system prompt it adds for forced tool use
+    tool_input = {
+        name: f"Fake validated {name} {digest}." for name in tool["input_schema"].get("properties", {})
+    }
+    input_tokens = (len(prompt) + len(json.dumps(params["tools"]))) // 4 + FAKE_TOOL_PROMPT_TOKENS
+    return {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "fake"),
+        "content": [{"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}", "name": tool["name"],
+                     "input": tool_input}],
+        "stop_reason": "tool_use",
+        "stop_sequence": None,
+        "usage": {"input_tokens": input_tokens, "output_tokens": len(json.dumps(tool_input)) // 4}
+    }
+
+
+async def fake_stream(message: dict):
+    #The server-sent event sequence of a streamed reply with a single text block
+    def event(name: str, data: dict) -> str:
+        return f"event: {name}\ndata: {json.dumps({'type': name, **data})}\n\n"
+
+    text = message["content"][0]["text"]
+    yield event("message_start", {"message": {
+        **message, "content": [], "stop_reason": None,
+        "usage": {**message["usage"], "output_tokens": 0}
+    }})
+    yield event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+    for i in range(0, len(text), FAKE_STREAM_CHUNK):
+        await asyncio.sleep(FAKE_STREAM_DELAY)
+        yield event("content_block_delta", {
+            "index": 0, "delta": {"type": "text_delta", "text": text[i:i + FAKE_STREAM_CHUNK]}
+        })
+    yield event("content_block_stop", {"index": 0})
+    yield event("message_delta", {
+        "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+        "usage": {"output_tokens": message["usage"]["output_tokens"]}
+    })
+    yield event("message_stop", {})
+
+
+def fake_search(payload: dict) -> dict:
+    #Quoted terms in the query are the contact and company. Results are stable per query,
+    #so repeated queries return the same pages like the real index would
+    query = payload.get("query", "")
+    terms = re.findall(r'"([^"]+)"', query) or [query]
+    seed = hashlib.sha256(query.encode("utf-8")).hexdigest()
+    domains = payload.get("includeDomains") or ["example.com"]
+    subject = " at ".join(terms[:2])
+    results = []
+    for i in range(payload.get("numResults", 3)):
+        text = "\n".join([
+            f"{subject} profile and recent news, page {i + 1}.",
+            f"{terms[0]} founded the company after several years in the industry and leads its product work.",
+            f"The team announced a new product release and a funding round this year ({seed[i * 4:i * 4 + 8]}).",
+            "Subscribe to our newsletter"
+        ])
+        results.append({
+            "id": f"{seed[:12]}-{i}",
+            "url": f"https://{domains[i % len(domains)]}/{seed[:12]}/{i}",
+            "title": f"{subject} ({i + 1})",
+            "publishedDate": "2025-01-01T00:00:00.000Z",
+            "text": text
+        })
+    return {"requestId": seed[:16], "results": results}
+
+
+def _gmail_sent() -> dict:
+    message_id = uuid.uuid4().hex[:16]
+    return {"id": message_id, "threadId": message_id, "labelIds": ["SENT"]}
+
+
+def create_app(exa: Profile = None, anthropic: Profile = None, gmail: Profile = None) -> FastAPI:
+    app = FastAPI(title="Fake Exa, Anthropic and Gmail")
+    profiles = {"exa": exa or Profile(), "anthropic": anthropic or Profile(), "gmail": gmail or Profile()}
+    stats = {name: {"requests": 0, "errors": 0, "rate_limited": 0} for name in profiles}
+    batches = {}
+
+    def roll_fault(service: str):
+        status = profiles[service].fault()
+        stats[service]["requests"] += 1
+        if status == 429:
+            stats[service]["rate_limited"] += 1
+        elif status:
+            stats[service]["errors"] += 1
+        return status
+
+    async def admit(service: str):
+        #Waits out the latency and returns the status code to fail with, or None
+        await asyncio.sleep(profiles[service].delay())
+        return roll_fault(service)
+
+    def fault_response(status: int, body: dict) -> JSONResponse:
+        headers = {"retry-after": str(FAKE_RETRY_AFTER)} if status == 429 else {}
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    def batch_object(batch: dict, base_url: str) -> dict:
+        ended = time.time() - batch["created"] >= FAKE_BATCH_DURATION
+        count = len(batch["requests"])
+        created = datetime.fromtimestamp(batch["created"], tz=timezone.utc)
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else count,
+                "succeeded": count if ended else 0,
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0
+            },
+            "created_at": created.isoformat(),
+            "expires_at": (created + timedelta(hours=24)).isoformat(),
+            "ended_at": datetime.now(timezone.utc).isoformat() if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{base_url}v1/messages/batches/{batch['id']}/results" if ended else None
+        }
+
+    # ---------- Exa ----------
+
+    @app.post("/search")
+    async def search(request: Request):
+        payload = await request.json()
+        status = await admit("exa")
+        if status:
+            return fault_response(status, {"error": "rate limited" if status == 429 else "internal error"})
+        return fake_search(payload)
+
+    # ---------- Anthropic ----------
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        params = await request.json()
+        status = await admit("anthropic")
+        if status:
+            kind = "rate_limit_error" if status == 429 else "api_error"
+            return fault_response(status, {"type": "error", "error": {"type": kind, "message": "Fake failure"}})
+        if params.get("stream"):
+            return StreamingResponse(fake_stream(fake_message(params)), media_type="text/event-stream")
+        return fake_message(params)
+
+    @app.post("/v1/messages/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        batch = {"id": f"msgbatch_{uuid.uuid4().hex}", "created": time.time(), "requests": body["requests"]}
+        batches[batch["id"]] = batch
+        return batch_object(batch, str(request.base_url))
+
+    @app.get("/v1/messages/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str, request: Request):
+        return batch_object(batches[batch_id], str(request.base_url))
+
+    @app.get("/v1/messages/batches/{batch_id}/results")
+    async def batch_results(batch_id: str):
+        lines = [
+            json.dumps({
+                "custom_id": item["custom_id"],
+                "result": {"type": "succeeded", "message": fake_message(item["params"])}
+            })
+            for item in batches[batch_id]["requests"]
+        ]
+        return Response("\n".join(lines) + "\n", media_type="application/x-jsonl")
+
+    # ---------- Gmail ----------
+
+    @app.post("/gmail/v1/users/me/messages/send")
+    async def gmail_send():
+        status = await admit("gmail")
+        if status:
+            return fault_response(status, {"error": {"code": status, "message": "Fake failure"}})
+        return _gmail_sent()
+
+    @app.post("/batch")
+    async def gmail_batch(request: Request):
+        #multipart/mixed in, one application/http part per call; multipart/mixed out with a
+        #response-<Content-ID> part per call. Latency applies to the batch, faults to each call
+        envelope = BytesParser().parsebytes(
+            f"Content-Type: {request.headers['content-type']}\r\n\r\n".encode("utf-8") + await request.body()
+        )
+        await asyncio.sleep(profiles["gmail"].delay())
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in envelope.get_payload():
+            status = roll_fault("gmail")
+            body = {"error": {"code": status, "message": "Fake failure"}} if status else _gmail_sent()
+            reason = {None: "OK", 429: "Too Many Requests", 500: "Internal Server Error"}[status]
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'].strip('<>')}>\r\n\r\n"
+                f"HTTP/1.1 {status or 200} {reason}\r\nContent-Type: application/json\r\n\r\n"
+                f"{json.dumps(body)}\r\n"
+            )
+        return Response("".join(parts) + f"--{boundary}--\r\n",
+                        media_type=f"multipart/mixed; boundary={boundary}")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Run local fake Exa, Anthropic and Gmail APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    for service in ("exa", "anthropic", "gmail"):
+        parser.add_argument(f"--{service}", type=Profile.parse, default=Profile(),
+                            help="latency=SECONDS,jitter=SIGMA,errors=FRACTION,rate_limits=FRACTION")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.exa, args.anthropic, args.gmail),
+                host=args.host, port=args.port, log_level="warning")
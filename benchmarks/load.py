@@ -0,0 +1,253 @@
+#End-to-end load benchmark. Starts the fake Exa/Anthropic/Gmail server and the real API (uvicorn)
+#pointed at it, then drives POST /generate-outreach/stream at a fixed concurrency with synthetic
+#contacts. Stage timings come from the stream's stage events, so they are what a client observes.
+#Reports p50/p95/p99 per stage, time to the first draft token, end-to-end latency, requests per
+#second and the API process' peak memory. Nothing leaves the machine, so it can run in CI.
+#   python -m benchmarks.load --requests 200 --concurrency 20
+#   python -m benchmarks.load --workers 4 --contacts 10
+#   python -m benchmarks.load --anthropic "latency=1.2,jitter=0.4,rate_limits=0.05" --output run.json
+
+import os
+import sys
+import json
+import math
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#Seconds to wait for the fake server and the API to accept requests
+STARTUP_TIMEOUT = 30.0
+#Seconds a single outreach run may take before it counts as failed
+REQUEST_TIMEOUT = 120.0
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _write_fixtures(directory: str, contacts: int) -> tuple:
+    contacts_path = os.path.join(directory, "contacts.csv")
+    team_path = os.path.join(directory, "team.csv")
+    with open(contacts_path, "w", encoding="utf-8") as f:
+        f.write("first_name;last_name;company;notes\n")
+        for i in range(contacts):
+            f.write(f"Founder{i};Bench;Company {i};Raised a seed round and likes cycling.\n")
+    with open(team_path, "w", encoding="utf-8") as f:
+        f.write("name;email;role\nBench;bench@example.com;Partner\n")
+    return contacts_path, team_path
+
+
+def _peak_memory_mb(pid: int):
+    #High-water mark of resident memory, Linux only
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values: list, pct: float) -> float:
+    #Nearest-rank percentile
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def _wait_ready(url: str):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {STARTUP_TIMEOUT:.0f}s")
+
+
+async def _one_run(client: httpx.AsyncClient, payload: dict) -> dict:
+    #Stage durations, first draft token and total time of one streamed run
+    start = time.perf_counter()
+    started, sample = {}, {"stages": {}, "failed_stages": [], "first_token": None, "error": None}
+    event = None
+    async with client.stream("POST", "/generate-outreach/stream", json=payload) as response:
+        if response.status_code != 200:
+            sample["error"] = f"HTTP {response.status_code}"
+            return sample
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+                continue
+            if not line.startswith("data: "):
+                continue
+            now = time.perf_counter() - start
+            data = json.loads(line[6:])
+            if event == "stage":
+                if data["status"] == "started":
+                    started[data["stage"]] = now
+                elif data["status"] == "done" and data["stage"] in started:
+                    sample["stages"][data["stage"]] = now - started[data["stage"]]
+                elif data["status"] == "failed":
+                    sample["failed_stages"].append(data["stage"])
+            elif event == "draft" and sample["first_token"] is None:
+                sample["first_token"] = now
+            elif event == "error":
+                sample["error"] = f"{data['status_code']}: {data['detail']}"
+    sample["total"] = time.perf_counter() - start
+    return sample
+
+
+async def _drive(base_url: str, requests: int, concurrency: int, contacts: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=REQUEST_TIMEOUT, limits=limits) as client:
+        async def run(i: int) -> dict:
+            payload = {"first_name": f"Founder{i % contacts}", "last_name": "Bench",
+                       "company": f"Company {i % contacts}", "team_member": "Bench"}
+            async with semaphore:
+                try:
+                    return await _one_run(client, payload)
+                except Exception as e:
+                    return {"stages": {}, "failed_stages": [], "first_token": None, "error": repr(e)}
+
+        start = time.perf_counter()
+        samples = await asyncio.gather(*[run(i) for i in range(requests)])
+        return samples, time.perf_counter() - start
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    ok = [s for s in samples if s["error"] is None]
+    rows = {}
+    #In the order stages finish, which follows the pipeline
+    for stage in dict.fromkeys(name for s in ok for name in s["stages"]):
+        rows[stage] = [s["stages"][stage] for s in ok if stage in s["stages"]]
+    rows["first draft token"] = [s["first_token"] for s in ok if s["first_token"] is not None]
+    rows["end to end"] = [s["total"] for s in ok]
+
+    errors = {}
+    for s in samples:
+        if s["error"] is not None:
+            errors[s["error"]] = errors.get(s["error"], 0) + 1
+    return {
+        "requests": len(samples),
+        "succeeded": len(ok),
+        "elapsed_seconds": elapsed,
+        "requests_per_second": len(ok) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            name: {
+                "count": len(values),
+                "p50": percentile(values, 50) * 1000,
+                "p95": percentile(values, 95) * 1000,
+                "p99": percentile(values, 99) * 1000
+            }
+            for name, values in rows.items() if values
+        },
+        "optional_stage_failures": sum(len(s["failed_stages"]) for s in ok),
+        "errors": errors
+    }
+
+
+def _print_report(report: dict):
+    print(f"{report['succeeded']}/{report['requests']} succeeded in {report['elapsed_seconds']:.1f}s, "
+          f"{report['requests_per_second']:.2f} requests/s")
+    print(f"{'stage':<20}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in report["latency_ms"].items():
+        print(f"{name:<20}{row['count']:>7}{row['p50']:>10.0f}{row['p95']:>10.0f}{row['p99']:>10.0f}")
+    memory = report["peak_memory_mb"]
+    print(f"peak API memory: {f'{memory:.0f} MB' if memory is not None else 'n/a'}")
+    if report["optional_stage_failures"]:
+        print(f"optional stage failures: {report['optional_stage_failures']}")
+    for error, count in report["errors"].items():
+        print(f"error x{count}: {error}")
+    for service, counts in report["fake_servers"].items():
+        print(f"fake {service}: {counts['requests']} requests, {counts['errors']} errors, "
+              f"{counts['rate_limited']} rate limited")
+
+
+async def main(args) -> int:
+    contacts = args.contacts or args.requests
+    fake_port, app_port = _free_port(), _free_port()
+    fake_url, app_url = f"http://127.0.0.1:{fake_port}", f"http://127.0.0.1:{app_port}"
+
+    with tempfile.TemporaryDirectory() as directory:
+        contacts_path, team_path = _write_fixtures(directory, contacts)
+        env = {
+            **os.environ,
+            "ANTHROPIC_API_KEY": "benchmark",
+            "EXA_API_KEY": "benchmark",
+            "EXA_URL": f"{fake_url}/search",
+            "ANTHROPIC_BASE_URL": fake_url,
+            "GMAIL_ROOT_URL": f"{fake_url}/",
+            "CONTACTS_PATH": contacts_path,
+            "TEAM_PATH": team_path,
+            "RESEARCH_CACHE_PATH": os.path.join(directory, "research.db"),
+            "VALIDATION_CACHE_PATH": os.path.join(directory, "validation.db"),
+            "JOBS_DB_PATH": os.path.join(directory, "jobs.db"),
+            "IDEMPOTENCY_DB_PATH": os.path.join(directory, "idempotency.db"),
+            "OUTBOX_DB_PATH": os.path.join(directory, "outbox.db"),
+            "SHARED_STATE_PATH": os.path.join(directory, "shared_state.db"),
+            "PREWARM_DB_PATH": os.path.join(directory, "prewarm.db"),
+            #Background research would skew the measured runs
+            "PREWARM_CONTACTS_PER_DAY": "0"
+        }
+        #The API logs every stage at INFO, only shown with --verbose
+        output = None if args.verbose else subprocess.DEVNULL
+        fake = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.fake_servers", "--port", str(fake_port),
+             "--exa", args.exa, "--anthropic", args.anthropic, "--gmail", args.gmail],
+            cwd=ROOT, env=env
+        )
+        api = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning",
+             "--workers", str(args.workers)],
+            cwd=ROOT, env=env, stdout=output, stderr=output
+        )
+        try:
+            await _wait_ready(f"{fake_url}/stats")
+            await _wait_ready(f"{app_url}/openapi.json")
+            samples, elapsed = await _drive(app_url, args.requests, args.concurrency, contacts)
+            report = summarize(samples, elapsed)
+            report["peak_memory_mb"] = _peak_memory_mb(api.pid)
+            async with httpx.AsyncClient() as client:
+                report["fake_servers"] = (await client.get(f"{fake_url}/stats")).json()
+        finally:
+            for process in (api, fake):
+                process.terminate()
+            for process in (api, fake):
+                process.wait(timeout=10)
+
+    report["config"] = vars(args)
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["succeeded"] == report["requests"] else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the outreach API against local fake services")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--contacts", type=int, default=0,
+                        help="distinct contacts to cycle through, default one per request (no cache hits)")
+    profile_help = "fake service profile: latency=SECONDS,jitter=SIGMA,errors=FRACTION,rate_limits=FRACTION"
+    parser.add_argument("--exa", default="latency=0.8,jitter=0.3", help=profile_help)
+    parser.add_argument("--anthropic", default="latency=1.0,jitter=0.3", help=profile_help)
+    parser.add_argument("--gmail", default="latency=0.3,jitter=0.2", help=profile_help)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="uvicorn worker processes, peak memory is then the supervisor's only")
+    parser.add_argument("--output", help="also write the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the API's log output")
+    sys.exit(asyncio.run(main(parser.parse_args())))
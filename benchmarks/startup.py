@@ -0,0 +1,85 @@
+#Cold start benchmark for the API: how long a fresh worker takes to import main.py and run the
+#FastAPI lifespan (building the orchestrator, starting the outbox sender and job workers).
+#Every run is a new interpreter with outbound connections blocked, so any network access during
+#startup fails the run instead of being timed. Caches and stores go to a temporary directory.
+#   python -m benchmarks.startup --runs 10
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+#Runs inside each child interpreter
+CHILD = r"""
+import json, time, socket, asyncio
+attempts = []
+def blocked(self, address):
+    attempts.append(str(address))
+    raise OSError("network access during startup")
+socket.socket.connect = blocked
+
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def boot():
+    async with main.app.router.lifespan_context(main.app):
+        ready = time.perf_counter()
+    return ready, time.perf_counter()
+
+ready, stopped = asyncio.run(boot())
+print(json.dumps({
+    "import": imported - start,
+    "startup": ready - imported,
+    "shutdown": stopped - ready,
+    "ready": ready - start,
+    "network": attempts
+}))
+"""
+
+
+def _run_once(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(runs: int) -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            "ANTHROPIC_API_KEY": os.getenv("ANTHROPIC_API_KEY") or "benchmark",
+            "EXA_API_KEY": os.getenv("EXA_API_KEY") or "benchmark",
+            "RESEARCH_CACHE_PATH": os.path.join(directory, "research.db"),
+            "VALIDATION_CACHE_PATH": os.path.join(directory, "validation.db"),
+            "JOBS_DB_PATH": os.path.join(directory, "jobs.db"),
+            "IDEMPOTENCY_DB_PATH": os.path.join(directory, "idempotency.db"),
+            "OUTBOX_DB_PATH": os.path.join(directory, "outbox.db"),
+            "SHARED_STATE_PATH": os.path.join(directory, "shared_state.db"),
+            "PREWARM_DB_PATH": os.path.join(directory, "prewarm.db")
+        }
+        samples = [_run_once(env) for _ in range(runs)]
+
+    print(f"{runs} cold starts (seconds)")
+    print(f"{'phase':<10}{'median':>10}{'max':>10}")
+    for phase in ("import", "startup", "shutdown", "ready"):
+        values = [s[phase] for s in samples]
+        print(f"{phase:<10}{statistics.median(values):>10.3f}{max(values):>10.3f}")
+
+    network = sorted({a for s in samples for a in s["network"]})
+    if network:
+        print(f"network access during startup: {', '.join(network)}")
+        return 1
+    print("network access during startup: none")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure API cold start time")
+    parser.add_argument("--runs", type=int, default=5)
+    sys.exit(main(parser.parse_args().runs))
@@ -0,0 +1,162 @@
+#Research validation benchmark: the combined structured-output call against one call per section.
+#Runs the same synthetic research through ResearchValidatorService in both modes and reports latency
+#per contact and Haiku tokens and cost per contact. By default it talks to the local fake Anthropic
+#API, whose token counts follow the prompt size, so the token comparison holds but latencies are only
+#round trips. --live uses the real API (ANTHROPIC_API_KEY) for real latencies, at real cost.
+#   python -m benchmarks.validation --contacts 20
+#   python -m benchmarks.validation --live --contacts 5 --output validation.json
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from benchmarks.load import ROOT, percentile, _free_port, _wait_ready
+
+#USD per million Haiku 4.5 tokens
+HAIKU_INPUT_PRICE = 1.0
+HAIKU_OUTPUT_PRICE = 5.0
+MODES = ("sections", "combined")
+
+WORDS = ("founder product launch funding round seed series team hiring growth customers platform "
+         "partnership europe market engineering revenue investors startup announced platform users").split()
+
+
+def _text(rng: random.Random, chars: int) -> str:
+    sentences = []
+    while sum(len(s) for s in sentences) < chars:
+        sentences.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + ".")
+    return " ".join(sentences)[:chars]
+
+
+def synthetic_contacts(count: int, scale: float, seed: int = 7) -> list:
+    #Research sized like packed Exa results, scale 1.0 fills each section's budget
+    from services.research import PERSON_CONTEXT_BUDGET, ACTIVITY_CONTEXT_BUDGET, COMPANY_CONTEXT_BUDGET
+    rng = random.Random(seed)
+    contacts = []
+    for i in range(count):
+        name, company = f"Founder{i} Bench", f"Company {i}"
+        contacts.append({
+            "full_name": name,
+            "company": company,
+            "notes": f"Met {name} at a demo day. " + _text(rng, 300),
+            "research": {
+                "person_context": _text(rng, int(PERSON_CONTEXT_BUDGET * scale)),
+                "activity_context": _text(rng, int(ACTIVITY_CONTEXT_BUDGET * scale)),
+                "company_context": _text(rng, int(COMPANY_CONTEXT_BUDGET * scale))
+            }
+        })
+    return contacts
+
+
+def _tokens(kind: str) -> float:
+    from services.metrics import LLM_TOKENS
+    from services.research_validator import VALIDATION_MODEL
+    return LLM_TOKENS.value(model=VALIDATION_MODEL, type=kind, mode="interactive")
+
+
+async def run_mode(mode: str, contacts: list, concurrency: int, directory: str) -> dict:
+    from services.llm import LLMClient
+    import services.research_validator as validation
+
+    #A fresh client and an empty validation cache per mode: combined mode falls back to the
+    #per-section prompts for long research, and must not find the other mode's results
+    validation.VALIDATION_CACHE_PATH = os.path.join(directory, f"validation-{mode}.db")
+    llm = LLMClient()
+    validator = validation.ResearchValidatorService(llm, mode=mode)
+    semaphore = asyncio.Semaphore(concurrency)
+    before = {kind: _tokens(kind) for kind in ("input", "output")}
+
+    async def one(contact: dict):
+        async with semaphore:
+            start = time.perf_counter()
+            validated = await validator.validate(
+                contact["research"], contact["notes"], contact["full_name"], contact["company"]
+            )
+            return time.perf_counter() - start, len(validated["missing_sections"])
+
+    start = time.perf_counter()
+    samples = await asyncio.gather(*[one(c) for c in contacts])
+    elapsed = time.perf_counter() - start
+    validator.close()
+    await llm.aclose()
+
+    latencies = [s[0] for s in samples]
+    tokens = {kind: (_tokens(kind) - before[kind]) / len(contacts) for kind in before}
+    cost = (tokens["input"] * HAIKU_INPUT_PRICE + tokens["output"] * HAIKU_OUTPUT_PRICE) / 1e6
+    return {
+        "contacts": len(contacts),
+        "elapsed_seconds": elapsed,
+        "latency_ms": {
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "p99": percentile(latencies, 99) * 1000
+        },
+        "input_tokens_per_contact": tokens["input"],
+        "output_tokens_per_contact": tokens["output"],
+        "cost_per_1000_contacts_usd": cost * 1000,
+        "missing_sections": sum(s[1] for s in samples)
+    }
+
+
+def _print_report(report: dict):
+    print(f"{'mode':<10}{'p50 ms':>9}{'p95 ms':>9}{'in tok':>9}{'out tok':>9}{'$/1k':>8}{'missing':>9}")
+    for mode, row in report["modes"].items():
+        print(f"{mode:<10}{row['latency_ms']['p50']:>9.0f}{row['latency_ms']['p95']:>9.0f}"
+              f"{row['input_tokens_per_contact']:>9.0f}{row['output_tokens_per_contact']:>9.0f}"
+              f"{row['cost_per_1000_contacts_usd']:>8.2f}{row['missing_sections']:>9}")
+    sections, combined = report["modes"]["sections"], report["modes"]["combined"]
+    if sections["input_tokens_per_contact"]:
+        saved = 1 - combined["input_tokens_per_contact"] / sections["input_tokens_per_contact"]
+        print(f"combined mode sends {saved:.0%} fewer input tokens per contact")
+
+
+async def main(args) -> int:
+    contacts = synthetic_contacts(args.contacts, args.scale)
+    #Validation results are memoized on disk, each mode gets an empty temporary cache
+    directory = tempfile.mkdtemp()
+    fake = None
+    if not args.live:
+        port = _free_port()
+        fake = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.fake_servers", "--port", str(port), "--anthropic", args.anthropic],
+            cwd=ROOT
+        )
+        os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{port}"
+        os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+    try:
+        if fake:
+            await _wait_ready(f"{os.environ['ANTHROPIC_BASE_URL']}/stats")
+        report = {"modes": {}}
+        for mode in MODES:
+            report["modes"][mode] = await run_mode(mode, contacts, args.concurrency, directory)
+    finally:
+        if fake:
+            fake.terminate()
+            fake.wait(timeout=10)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report["config"] = vars(args)
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare combined and per-section research validation")
+    parser.add_argument("--contacts", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=0.6,
+                        help="research size as a fraction of each section's context budget")
+    parser.add_argument("--live", action="store_true", help="call the real Anthropic API")
+    parser.add_argument("--anthropic", default="latency=0.8,jitter=0.3",
+                        help="fake service profile: latency=SECONDS,jitter=SIGMA,errors=FRACTION,rate_limits=FRACTION")
+    parser.add_argument("--output", help="also write the report as JSON")
+    sys.exit(asyncio.run(main(parser.parse_args())))
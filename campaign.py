@@ -0,0 +1,353 @@
+#Runs the outreach pipeline for many contacts at once with a bounded number of pipelines in flight
+#Contacts are grouped by company first: company news is researched and validated once per company
+#and shared by all of its founders, only the person stages run per contact.
+#Bulk mode sends every validation, draft and strategy prompt through the Message Batches API
+#instead: half the LLM cost and no interactive rate-limit pressure, but it can take hours.
+#Used by the /campaigns endpoint and from the command line:
+#   python campaign.py --team-member Nico
+#   python campaign.py --contacts-file data/contacts.csv --team-member Nico --concurrency 10
+#   python campaign.py --team-member Nico --bulk
+
+import sys
+import asyncio
+import logging
+import argparse
+from models import (OutreachRequest, CampaignRequest, CampaignItemResult,
+                    CampaignResponse, CAMPAIGN_DEFAULT_CONCURRENCY, CAMPAIGN_MAX_CONCURRENCY)
+from orchestrator import OutreachOrchestrator
+from services.contact_resolver import ContactResolver, normalize
+from services.batch_llm import BatchLLMService
+from services.research_validator import PERSON_FIELDS, COMPANY_FIELD
+
+logger = logging.getLogger(__name__)
+
+
+def requests_from_contacts(contacts: list, team_member: str) -> list:
+    #A team_member column in the contacts file overrides the default team member
+    return [
+        OutreachRequest(
+            first_name=row["first_name"],
+            last_name=row["last_name"],
+            company=row["company"],
+            team_member=row.get("team_member") or team_member
+        )
+        for row in contacts
+    ]
+
+
+def group_by_company(contacts: list) -> dict:
+    #contacts are (index, resolved contact) pairs. Company key -> the company as first written,
+    #the distinct notes of its contacts and their indexes
+    groups = {}
+    for i, contact in contacts:
+        group = groups.setdefault(
+            normalize(contact["company"]), {"company": contact["company"], "notes": [], "members": []}
+        )
+        group["members"].append(i)
+        if contact["notes"] and contact["notes"] not in group["notes"]:
+            group["notes"].append(contact["notes"])
+    return groups
+
+
+def company_notes(group: dict) -> str:
+    return "\n".join(group["notes"])
+
+
+class CampaignRunner:
+
+    def __init__(self, orchestrator: OutreachOrchestrator):
+        self.orchestrator = orchestrator
+        #Only built for bulk runs
+        self._batch = None
+
+    def expand(self, campaign: CampaignRequest) -> list:
+        if campaign.all_contacts:
+            return requests_from_contacts(self.orchestrator.resolver.contacts, campaign.team_member)
+        return list(campaign.items)
+
+    def plan(self, requests: list) -> dict:
+        #Request index -> its company group, for companies with more than one contact in the campaign.
+        #Contacts that do not resolve are left out and fail in their own run with the usual error
+        contacts = []
+        for i, request in enumerate(requests):
+            try:
+                contacts.append((i, self.orchestrator.resolver.get_contact(request.first_name, request.last_name)))
+            except ValueError:
+                continue
+        groups = [group for group in group_by_company(contacts).values() if len(group["members"]) > 1]
+        if groups:
+            shared = sum(len(group["members"]) for group in groups)
+            logger.info(f"{shared} contacts share company research across {len(groups)} companies")
+        return {i: group for group in groups for i in group["members"]}
+
+    async def run(self, requests: list, concurrency: int = CAMPAIGN_DEFAULT_CONCURRENCY,
+                  bulk: bool = False) -> CampaignResponse:
+        if bulk:
+            return await self.run_bulk(requests, concurrency)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        logger.info(f"Starting campaign of {len(requests)} contacts, concurrency {concurrency}")
+        #Campaign runs have no run deadline (deadline_seconds=None): they wait out rate limits instead of failing
+        plan = self.plan(requests)
+        #Company key -> task running that company's stages, started by the first of its contacts to run
+        companies = {}
+
+        def company_stages(group: dict):
+            key = normalize(group["company"])
+            if key not in companies:
+                companies[key] = asyncio.ensure_future(
+                    self.orchestrator.company_stages(group["company"], company_notes(group), deadline_seconds=None)
+                )
+            return companies[key]
+
+        async def run_one(i: int, request: OutreachRequest):
+            async with semaphore:
+                try:
+                    if i not in plan:
+                        return await self.orchestrator.run(request, deadline_seconds=None)
+                    #The person stages run while the shared company stages finish
+                    person, company = await asyncio.gather(
+                        self.orchestrator.run_stages(request, targets=("research", "strategy_research"),
+                                                     deadline_seconds=None),
+                        company_stages(plan[i])
+                    )
+                    return await self.orchestrator.run(request, completed={**person, **company}, deadline_seconds=None)
+                except Exception as e:
+                    #One failing contact never stops the rest of the campaign
+                    logger.warning(f"Campaign item {request.first_name} {request.last_name} failed: {e}")
+                    return e
+
+        try:
+            outcomes = await asyncio.gather(*[run_one(i, r) for i, r in enumerate(requests)])
+        finally:
+            for task in companies.values():
+                task.cancel()
+        return self._summarize(requests, outcomes)
+
+
+    async def run_bulk(self, requests: list,
+                       concurrency: int = CAMPAIGN_DEFAULT_CONCURRENCY) -> CampaignResponse:
+        if self._batch is None:
+            self._batch = BatchLLMService(self.orchestrator.llm)
+        semaphore = asyncio.Semaphore(concurrency)
+        logger.info(f"Starting bulk campaign of {len(requests)} contacts")
+
+        #Index -> stage results so far, or the exception that knocked the contact out
+        stages = {}
+
+        #1. Web research runs interactively, it is not an LLM call
+        async def research(i: int, request: OutreachRequest):
+            async with semaphore:
+                try:
+                    stages[i] = await self.orchestrator.run_stages(
+                        request, targets=("research", "strategy_research"), deadline_seconds=None
+                    )
+                except Exception as e:
+                    logger.warning(f"Research for {request.first_name} {request.last_name} failed: {e}")
+                    stages[i] = e
+        await asyncio.gather(*[research(i, r) for i, r in enumerate(requests)])
+
+        #Company news once per company, shared by its contacts
+        async def company_research(group: dict):
+            async with semaphore:
+                try:
+                    result = await self.orchestrator.researcher.research_company(group["company"])
+                except Exception as e:
+                    logger.warning(f"Company research for {group['company']} failed: {e}")
+                    result = e
+            for i in group["members"]:
+                if isinstance(result, Exception):
+                    stages[i] = result
+                else:
+                    stages[i]["company_research"] = result
+        await asyncio.gather(*[company_research(g) for g in _companies(stages).values()])
+
+        #2. One batch for every validation section, 3. one batch for every draft and strategy
+        await self._bulk_validate(stages)
+        await self._bulk_draft(stages)
+
+        #4. Remaining stages (delivery) run through the normal pipeline on top of the batch results
+        async def deliver(i: int, request: OutreachRequest):
+            if isinstance(stages[i], Exception):
+                return stages[i]
+            async with semaphore:
+                try:
+                    return await self.orchestrator.run(request, completed=stages[i], deadline_seconds=None)
+                except Exception as e:
+                    logger.warning(f"Delivery for {request.first_name} {request.last_name} failed: {e}")
+                    return e
+
+        return self._summarize(requests, await asyncio.gather(*[deliver(i, r) for i, r in enumerate(requests)]))
+
+
+    async def _bulk_validate(self, stages: dict):
+        validator = self.orchestrator.validator
+        companies = _companies(stages)
+        #Batch id prefix -> output field -> params: person sections per contact (c<i>),
+        #company news once per company (co<j>)
+        sections = {}
+        for i, results in _active(stages):
+            contact = results["resolve"]["contact"]
+            sections[f"c{i}"] = validator.section_requests(
+                research=results["research"],
+                notes=contact["notes"],
+                full_name=_full_name(contact),
+                company=contact["company"],
+                fields=PERSON_FIELDS
+            )
+        for j, group in enumerate(companies.values()):
+            research = stages[group["members"][0]]["company_research"]
+            sections[f"co{j}"] = {COMPANY_FIELD: validator.company_request(
+                research["company_context"], company_notes(group), group["company"]
+            )}
+
+        batch_requests = {}
+        for prefix, requests in sections.items():
+            for field, params in requests.items():
+                #Sections with nothing to validate already hold their final text,
+                #sections validated before with the same inputs are taken from the cache
+                if isinstance(params, str):
+                    continue
+                cached = validator.cached(params)
+                if cached is not None:
+                    requests[field] = cached
+                else:
+                    batch_requests[f"{prefix}-{field}"] = params
+
+        outputs = await self._batch.run(batch_requests)
+
+        section_results = {}
+        for prefix, requests in sections.items():
+            section_results[prefix] = {}
+            for field, params in requests.items():
+                if isinstance(params, str):
+                    section_results[prefix][field] = params
+                    continue
+                output = outputs[f"{prefix}-{field}"]
+                if isinstance(output, Exception):
+                    section_results[prefix][field] = output
+                else:
+                    section_results[prefix][field] = validator.parse(output)
+                    validator.remember(params, section_results[prefix][field])
+
+        for j, group in enumerate(companies.values()):
+            company = validator.assemble(None, group["company"], section_results[f"co{j}"])
+            for i in group["members"]:
+                contact = stages[i]["resolve"]["contact"]
+                person = validator.assemble(_full_name(contact), contact["company"], section_results[f"c{i}"])
+                stages[i]["validate"] = validator.merge(person, company)
+
+
+    async def _bulk_draft(self, stages: dict):
+        drafter, strategy = self.orchestrator.drafter, self.orchestrator.strategy
+        batch_requests = {}
+        for i, results in _active(stages):
+            resolve = results["resolve"]
+            batch_requests[f"c{i}-draft"] = drafter.build_request(
+                contact=resolve["contact"],
+                research=results["validate"],
+                team_member=resolve["team_member"]
+            )
+            if results.get("strategy_research") is not None:
+                batch_requests[f"c{i}-strategy"] = strategy.build_request(
+                    contact=resolve["contact"],
+                    research=results["validate"],
+                    team_member=resolve["team_member"],
+                    strategy_research=results["strategy_research"]
+                )
+
+        outputs = await self._batch.run(batch_requests)
+
+        for i, results in _active(stages):
+            try:
+                output = outputs[f"c{i}-draft"]
+                if isinstance(output, Exception):
+                    raise output
+                results["draft"] = drafter.parse(output)
+            except Exception as e:
+                logger.warning(f"Bulk draft for {_full_name(results['resolve']['contact'])} failed: {e}")
+                stages[i] = e
+                continue
+
+            #The strategy stays optional, same as in the interactive pipeline
+            results["strategy"] = None
+            output = outputs.get(f"c{i}-strategy")
+            if output is not None and not isinstance(output, Exception):
+                try:
+                    results["strategy"] = strategy.parse(output)
+                except Exception as e:
+                    logger.warning(f"Bulk strategy for {_full_name(results['resolve']['contact'])} failed: {e}")
+
+
+    @staticmethod
+    def _summarize(requests: list, outcomes: list) -> CampaignResponse:
+        results = [
+            CampaignItemResult(request=request, status="failed", error=str(outcome))
+            if isinstance(outcome, Exception) else
+            CampaignItemResult(request=request, status="succeeded", result=outcome)
+            for request, outcome in zip(requests, outcomes)
+        ]
+        succeeded = sum(1 for r in results if r.status == "succeeded")
+        logger.info(f"Campaign finished: {succeeded}/{len(results)} succeeded")
+        return CampaignResponse(
+            total=len(results),
+            succeeded=succeeded,
+            failed=len(results) - succeeded,
+            results=results
+        )
+
+
+def _active(stages: dict):
+    #Contacts still in the running, in a stable order
+    return [(i, results) for i, results in sorted(stages.items()) if not isinstance(results, Exception)]
+
+
+def _companies(stages: dict) -> dict:
+    #Company groups of the contacts still in the running
+    return group_by_company([(i, results["resolve"]["contact"]) for i, results in _active(stages)])
+
+
+def _full_name(contact: dict) -> str:
+    return f"{contact['first_name']} {contact['last_name']}"
+
+
+async def _main(args) -> int:
+    orchestrator = OutreachOrchestrator()
+    if args.contacts_file:
+        #Contacts must resolve against the same file the campaign is read from
+        orchestrator.resolver.close()
+        orchestrator.resolver = ContactResolver(contacts_path=args.contacts_file)
+    runner = CampaignRunner(orchestrator)
+    #No background sender: flush() below sends the queued emails, one batch at a time
+    try:
+        requests = requests_from_contacts(orchestrator.resolver.contacts, args.team_member)
+        response = await runner.run(requests, concurrency=args.concurrency, bulk=args.bulk)
+        #Emails are queued by the pipeline, send what is due before the process exits.
+        #Anything left for a later retry stays in the outbox and goes out on the next run or app start
+        if not await orchestrator.outbox.flush():
+            print(f"{orchestrator.outbox.pending()} emails still queued in the outbox", file=sys.stderr)
+    finally:
+        await orchestrator.aclose()
+
+    output = response.model_dump_json(indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    print(f"{response.succeeded}/{response.total} succeeded", file=sys.stderr)
+    return 0 if response.failed == 0 else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run outreach for every contact in a contacts file")
+    parser.add_argument("--contacts-file", help="semicolon separated CSV, defaults to data/contacts.csv")
+    parser.add_argument("--team-member", required=True,
+                        help="team member receiving the drafts, unless the file has a team_member column")
+    parser.add_argument("--concurrency", type=int, default=CAMPAIGN_DEFAULT_CONCURRENCY,
+                        choices=range(1, CAMPAIGN_MAX_CONCURRENCY + 1), metavar="N")
+    parser.add_argument("--bulk", action="store_true",
+                        help="run all LLM prompts through the Message Batches API (cheaper, slower)")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    sys.exit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,231 @@
+#Idempotency keys for POST /generate-outreach
+#A client that retries after a timeout sends the same Idempotency-Key header, or without the header the
+#same body, whose hash is then the key. A retry of a run that is still going attaches to that run, and a
+#retry of a finished run gets the stored OutreachResponse back at once, so the research and LLM calls are
+#not paid for twice and the team member is not emailed twice. Finished results are kept in SQLite until
+#they expire. Failed runs are not stored, their retries run again.
+#A run in progress is leased in the same SQLite file, so a retry that lands on another worker process
+#waits for the run's stored result instead of starting a second run, which would write a different draft.
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from models import OutreachRequest, OutreachResponse
+from orchestrator import OutreachOrchestrator
+from services.cache import DiskCache
+from services.single_flight import SingleFlight
+from services.shared_state import connect
+
+logger = logging.getLogger(__name__)
+
+#-------------  Idempotency Configuration --------------
+IDEMPOTENCY_DB_PATH = os.getenv("IDEMPOTENCY_DB_PATH", "cache/idempotency.db")
+#Seconds a finished result is replayed for the same key
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+#Seconds a run in progress stays with its worker without renewal. Renewed every quarter lease
+IDEMPOTENCY_LEASE = 30.0
+#Seconds between checks while another worker runs the same key
+IDEMPOTENCY_POLL_INTERVAL = 0.25
+#---------------------------------------------
+
+
+class IdempotencyConflictError(Exception):
+    #The key was already used for a different request body
+    pass
+
+
+def request_fingerprint(request: OutreachRequest) -> str:
+    return DiskCache.make_key(request.model_dump())
+
+
+class IdempotencyStore:
+
+    def __init__(self, path: str = IDEMPOTENCY_DB_PATH, ttl: float = IDEMPOTENCY_TTL):
+        self.ttl = ttl
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_expiry ON results (expires_at)")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS runs (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    lease_until REAL NOT NULL
+                )"""
+            )
+
+
+    def get(self, key: str):
+        #(fingerprint, response dict) of an unexpired result, or None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, response FROM results WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+
+    def put(self, key: str, fingerprint: str, response: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, fingerprint, response, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, fingerprint, json.dumps(response), now, now + self.ttl)
+            )
+
+
+    def claim(self, key: str, fingerprint: str, owner: str) -> tuple:
+        #("claimed", None) when owner may run key now, ("stored", (fingerprint, response)) when a result
+        #landed meanwhile, or ("running", fingerprint) while another owner holds an unexpired lease
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                stored = self._conn.execute(
+                    "SELECT fingerprint, response FROM results WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                running = self._conn.execute(
+                    "SELECT fingerprint FROM runs WHERE key = ? AND owner != ? AND lease_until > ?", (key, owner, now)
+                ).fetchone()
+                if stored is None and running is None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO runs (key, fingerprint, owner, lease_until) VALUES (?, ?, ?, ?)",
+                        (key, fingerprint, owner, now + IDEMPOTENCY_LEASE)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if stored is not None:
+            return "stored", (stored[0], json.loads(stored[1]))
+        if running is not None:
+            return "running", running[0]
+        return "claimed", None
+
+
+    def renew(self, key: str, owner: str) -> bool:
+        #False once another owner took the run over after the lease ran out
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE runs SET lease_until = ? WHERE key = ? AND owner = ?",
+                (time.time() + IDEMPOTENCY_LEASE, key, owner)
+            )
+        return cursor.rowcount == 1
+
+
+    def release(self, key: str, owner: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM runs WHERE key = ? AND owner = ?", (key, owner))
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class IdempotentRunner:
+
+    def __init__(self, orchestrator: OutreachOrchestrator, store: IdempotencyStore = None):
+        self.orchestrator = orchestrator
+        self.store = store or IdempotencyStore()
+        #Runs in progress in this process: key -> fingerprint of the body that started it
+        self.flight = SingleFlight("idempotency")
+        self._running = {}
+        #Identifies this runner's leases, unique per process and instance
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+    async def run(self, request: OutreachRequest, key: str = None) -> tuple:
+        #Returns (response, replayed). replayed is True when no new run was started for this call
+        fingerprint = request_fingerprint(request)
+        key = key or fingerprint
+
+        stored = self.store.get(key)
+        if stored is not None:
+            self._check(key, fingerprint, stored[0])
+            logger.info(f"Replaying stored result for idempotency key {key}")
+            return OutreachResponse(**stored[1]), True
+
+        async def run_once():
+            try:
+                return await self._run_or_wait(request, key, fingerprint)
+            finally:
+                self._running.pop(key, None)
+
+        running = self._running.get(key)
+        if running is not None:
+            self._check(key, fingerprint, running)
+            logger.info(f"Attaching to the run in progress for idempotency key {key}")
+        else:
+            self._running[key] = fingerprint
+        #The run is a separate task: a caller that disconnects does not cancel it, so its retry can attach
+        result, ran = await self.flight.do(key, run_once)
+        return result, running is not None or not ran
+
+
+    async def _run_or_wait(self, request: OutreachRequest, key: str, fingerprint: str) -> tuple:
+        #(response, True) after running the pipeline here, (response, False) when another worker ran it.
+        #If that worker's run fails or dies, its lease ends without a result and the key is run here
+        waiting = False
+        while True:
+            state, detail = self.store.claim(key, fingerprint, self.owner)
+            if state == "claimed":
+                return await self._run_leased(request, key, fingerprint), True
+            if state == "stored":
+                self._check(key, fingerprint, detail[0])
+                logger.info(f"Using the result another worker stored for idempotency key {key}")
+                return OutreachResponse(**detail[1]), False
+            self._check(key, fingerprint, detail)
+            if not waiting:
+                logger.info(f"Waiting for the run another worker has in progress for idempotency key {key}")
+                waiting = True
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+
+    async def _run_leased(self, request: OutreachRequest, key: str, fingerprint: str) -> OutreachResponse:
+        run = asyncio.ensure_future(self.orchestrator.run(request))
+        heartbeat = asyncio.create_task(self._heartbeat(key, run))
+        try:
+            result = await run
+            self.store.put(key, fingerprint, result.model_dump())
+            return result
+        finally:
+            heartbeat.cancel()
+            self.store.release(key, self.owner)
+
+
+    async def _heartbeat(self, key: str, run: asyncio.Future):
+        while True:
+            await asyncio.sleep(IDEMPOTENCY_LEASE / 4)
+            if not self.store.renew(key, self.owner):
+                #Another worker took the key over after the lease ran out, two runs would email twice
+                logger.warning(f"Idempotency key {key} lease lost, stopping this run of it")
+                run.cancel()
+                return
+
+
+    @staticmethod
+    def _check(key: str, fingerprint: str, expected: str):
+        if fingerprint != expected:
+            raise IdempotencyConflictError(f"Idempotency key '{key}' was already used with a different request body.")
+
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,284 @@
+#Durable background jobs for outreach runs
+#POST /jobs stores the request in SQLite and returns a job id straight away. A pool of workers
+#inside the app runs queued jobs through the orchestrator. Each completed stage result is persisted,
+#so a job interrupted by a restart resumes from its last completed stage instead of starting over.
+#A running job is leased to the process running it, which renews the lease while it works. Workers in
+#other processes only take a job over once its lease has run out, never while it is still running.
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from models import OutreachRequest, JobStatus
+from orchestrator import OutreachOrchestrator
+from services.shared_state import connect
+
+logger = logging.getLogger(__name__)
+
+#-------------  Job Configuration --------------
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "cache/jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+#Seconds an idle worker waits before checking the store again
+JOB_POLL_INTERVAL = 2.0
+#Seconds a running job stays with its worker without renewal. Renewed every quarter lease
+JOB_LEASE = 60.0
+#---------------------------------------------
+
+
+class JobStore:
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        #Autocommit mode, transactions are opened explicitly where a read and a write must be atomic
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    request TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    running TEXT NOT NULL DEFAULT '[]',
+                    stages TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    error TEXT,
+                    owner TEXT,
+                    lease_until REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            #Stores created before leases existed
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        #Identifies this process' leases
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+    def create(self, request: OutreachRequest) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, request, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, request.model_dump_json(), now, now)
+            )
+        return job_id
+
+
+    def claim_next(self):
+        #Oldest queued job moves to running in one transaction so no two workers take the same job.
+        #Running jobs whose lease ran out were cut off (restart, crashed worker) and are taken over
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, request, stages, status FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'running' AND COALESCE(lease_until, 0) <= ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', running = '[]', owner = ?, lease_until = ?, "
+                        "updated_at = ? WHERE id = ?",
+                        (self.owner, now + JOB_LEASE, now, row[0])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        if row[3] == "running":
+            logger.info(f"Job {row[0]} was interrupted, taking it over")
+        return row[0], OutreachRequest.model_validate_json(row[1]), json.loads(row[2])
+
+
+    def renew(self, job_id: str) -> bool:
+        #False once the job belongs to someone else
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time() + JOB_LEASE, job_id, self.owner)
+            )
+        return cursor.rowcount == 1
+
+
+    def release(self, job_id: str):
+        #The job was stopped here, any worker may resume it straight away
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = 0 WHERE id = ? AND owner = ? AND status = 'running'",
+                (job_id, self.owner)
+            )
+
+
+    def stage_started(self, job_id: str, stage: str):
+        self._modify(job_id, lambda running, stages: (running + [stage], stages))
+
+
+    def stage_finished(self, job_id: str, stage: str, result=None, completed: bool = False):
+        def change(running, stages):
+            if completed:
+                stages[stage] = result
+            return [s for s in running if s != stage], stages
+        self._modify(job_id, change)
+
+
+    def _modify(self, job_id: str, change):
+        #Read-modify-write of the running list and stage results inside one transaction
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT running, stages FROM jobs WHERE id = ? AND owner = ?", (job_id, self.owner)
+                ).fetchone()
+                if row:
+                    running, stages = change(json.loads(row[0]), json.loads(row[1]))
+                    self._conn.execute(
+                        "UPDATE jobs SET running = ?, stages = ?, updated_at = ? WHERE id = ?",
+                        (json.dumps(running), json.dumps(stages), time.time(), job_id)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+    def finish(self, job_id: str, result: str = None, error: str = None):
+        status = "failed" if error else "succeeded"
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, running = '[]', result = ?, error = ?, lease_until = NULL, "
+                "updated_at = ? WHERE id = ? AND owner = ?",
+                (status, result, error, time.time(), job_id, self.owner)
+            )
+
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, running, stages, result, error, created_at, updated_at "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return JobStatus(
+            job_id=row[0],
+            status=row[1],
+            stages_running=json.loads(row[2]),
+            stages_completed=list(json.loads(row[3])),
+            result=json.loads(row[4]) if row[4] else None,
+            error=row[5],
+            created_at=row[6],
+            updated_at=row[7]
+        )
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+
+    def __init__(self, orchestrator: OutreachOrchestrator, store: JobStore = None,
+                 workers: int = JOB_WORKERS):
+        self.orchestrator = orchestrator
+        self.store = store or JobStore()
+        self.workers = workers
+        #Created in start() so it belongs to the running event loop
+        self._wakeup = None
+        self._tasks = []
+
+
+    def submit(self, request: OutreachRequest) -> str:
+        job_id = self.store.create(request)
+        if self._wakeup:
+            self._wakeup.set()
+        logger.info(f"Queued job {job_id} for {request.first_name} {request.last_name}")
+        return job_id
+
+
+    def start(self):
+        #Interrupted jobs are picked up by claim_next once their lease has run out
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+
+    async def stop(self):
+        #Cancelled jobs stay marked running with their lease given up, so any worker resumes them
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.store.close()
+
+
+    async def _worker(self):
+        while True:
+            claimed = self.store.claim_next()
+            if claimed is None:
+                self._wakeup.clear()
+                #asyncio.wait rather than wait_for, which can swallow a stop() cancel
+                #that lands just as a submit sets the event
+                waiter = asyncio.ensure_future(self._wakeup.wait())
+                try:
+                    await asyncio.wait({waiter}, timeout=JOB_POLL_INTERVAL)
+                finally:
+                    waiter.cancel()
+                continue
+            await self._run_job(*claimed)
+
+
+    async def _run_job(self, job_id: str, request: OutreachRequest, completed: dict):
+        if completed:
+            logger.info(f"Job {job_id} resuming after stages: {', '.join(completed)}")
+
+        def listener(stage: str, status: str, payload):
+            if status == "started":
+                self.store.stage_started(job_id, stage)
+            else:
+                #Only real results are persisted. Failed or skipped optional stages run again on resume
+                self.store.stage_finished(job_id, stage, payload, completed=(status == "done"))
+
+        #No run deadline, jobs exist for runs that may wait out rate limits longer than a request could
+        run = asyncio.ensure_future(
+            self.orchestrator.run(request, listener=listener, completed=completed, deadline_seconds=None)
+        )
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, run))
+        try:
+            response = await run
+            self.store.finish(job_id, result=response.model_dump_json())
+            logger.info(f"Job {job_id} succeeded")
+        except asyncio.CancelledError:
+            if heartbeat.done():
+                #The heartbeat stopped the run, the job now belongs to another worker
+                return
+            self.store.release(job_id)
+            raise
+        except Exception as e:
+            logger.warning(f"Job {job_id} failed: {e}")
+            self.store.finish(job_id, error=str(e))
+        finally:
+            heartbeat.cancel()
+
+
+    async def _heartbeat(self, job_id: str, run: asyncio.Future):
+        while True:
+            await asyncio.sleep(JOB_LEASE / 4)
+            if not self.store.renew(job_id):
+                #Another worker took the job over after the lease ran out, two runs would email twice
+                logger.warning(f"Job {job_id} lease lost, stopping this run of it")
+                run.cancel()
+                return
@@ -1,22 +1,74 @@
 import logging
-from fastapi import FastAPI, HTTPException
-from models import OutreachRequest, OutreachResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from models import (OutreachRequest, OutreachResponse, CampaignRequest, CampaignResponse,
+                    JobSubmitted, JobStatus)
 from orchestrator import OutreachOrchestrator
+from campaign import CampaignRunner
+from jobs import JobQueue
+from prewarm import PrewarmScheduler
+from idempotency import IdempotentRunner, IdempotencyConflictError
+from streaming import stream_outreach
+from services.contact_resolver import AmbiguousMatchError
+from services.deadline import DeadlineExceeded
+from services.metrics import REGISTRY
 
 #Logging for error tracking
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Kibo Outreach API")
-orchestrator = OutreachOrchestrator()
+#Built in lifespan rather than at import, so importing the app (workers, tests, tooling)
+#creates no clients, threads or files
+orchestrator: OutreachOrchestrator = None
+campaigns: CampaignRunner = None
+jobs: JobQueue = None
+idempotent: IdempotentRunner = None
+prewarm: PrewarmScheduler = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global orchestrator, campaigns, jobs, idempotent, prewarm
+    orchestrator = OutreachOrchestrator()
+    campaigns = CampaignRunner(orchestrator)
+    jobs = JobQueue(orchestrator)
+    idempotent = IdempotentRunner(orchestrator)
+    prewarm = PrewarmScheduler(orchestrator)
+    #The outbox sender delivers queued emails, background workers resume interrupted jobs and pick up new ones,
+    #and the prewarm scheduler refreshes contact research during off-peak hours
+    orchestrator.start()
+    jobs.start()
+    prewarm.start()
+    yield
+    await prewarm.stop()
+    await jobs.stop()
+    idempotent.close()
+    #Close pooled HTTP connections on shutdown
+    await orchestrator.aclose()
+
+app = FastAPI(title="Kibo Outreach API", lifespan=lifespan)
 
 @app.post("/generate-outreach", response_model=OutreachResponse)
-async def generate_outreach(request: OutreachRequest):
-   
+async def generate_outreach(request: OutreachRequest, response: Response,
+                            idempotency_key: str = Header(None, max_length=255)):
+    #Retries with the same Idempotency-Key (default: the same body) attach to the running call
+    #or get its stored result, instead of running the pipeline and emailing again
     try:
-        result = await orchestrator.run(request)
-        logger.info(f"Email successfully delivered to {result.sent_to}")
+        result, replayed = await idempotent.run(request, idempotency_key)
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+        else:
+            logger.info(f"Email {result.status} for {result.sent_to}")
         return result
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except DeadlineExceeded as e:
+        #The run did not finish within OUTREACH_DEADLINE
+        logger.warning(f"Outreach request ran out of time: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except AmbiguousMatchError as e:
+        # Several different CSV rows match the name
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         # Contact or team member not found in CSVs
         raise HTTPException(status_code=404, detail=str(e))
@@ -24,3 +76,49 @@ async def generate_outreach(request: OutreachRequest):
         #Unexpected error. full details are logged server side
         logger.error(f"Unexpected error processing request: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/generate-outreach/stream")
+async def generate_outreach_stream(request: OutreachRequest):
+    #Same run as /generate-outreach, reported as server-sent events while it happens (see streaming.py)
+    return StreamingResponse(
+        stream_outreach(orchestrator, request),
+        media_type="text/event-stream",
+        #Proxies must pass events through as they come instead of buffering the response
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/campaigns", response_model=CampaignResponse)
+async def run_campaign(campaign: CampaignRequest):
+    #Failures are reported per item, the campaign itself only fails on unexpected errors
+    try:
+        return await campaigns.run(
+            campaigns.expand(campaign),
+            concurrency=campaign.concurrency,
+            bulk=campaign.bulk
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error running campaign: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/jobs", response_model=JobSubmitted, status_code=202)
+async def submit_job(request: OutreachRequest):
+    #Returns at once, poll GET /jobs/{job_id} for progress and the result
+    job_id = jobs.submit(request)
+    return JobSubmitted(job_id=job_id, status="queued")
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    job = jobs.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return job
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    #Prometheus text format: stage and outbound call latency, in-flight calls, retries, 429s and tokens
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
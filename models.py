@@ -1,6 +1,11 @@
 
 #Autovalidation with pydantic
-from pydantic import BaseModel, field_validator
+from typing import List, Optional
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+#Upper bound on parallel pipelines per campaign, protects the Exa and Anthropic quotas
+CAMPAIGN_MAX_CONCURRENCY = 20
+CAMPAIGN_DEFAULT_CONCURRENCY = 5
 
 class OutreachRequest(BaseModel):
     first_name: str
@@ -20,4 +25,49 @@ class OutreachResponse(BaseModel):
     status: str
     sent_to: str                
     contact_name: str           
-    email_preview: str         
\ No newline at end of file
+    email_preview: str
+
+
+class CampaignRequest(BaseModel):
+    #Either explicit contact/team-member pairs, or every contact in the contact store for one team member
+    items: List[OutreachRequest] = []
+    all_contacts: bool = False
+    team_member: Optional[str] = None
+    concurrency: int = Field(CAMPAIGN_DEFAULT_CONCURRENCY, ge=1, le=CAMPAIGN_MAX_CONCURRENCY)
+    #Run LLM prompts through the Message Batches API: half the cost, can take hours
+    bulk: bool = False
+
+    @model_validator(mode="after")
+    def check_source(self):
+        if self.all_contacts and not self.team_member:
+            raise ValueError("team_member is required when all_contacts is set")
+        if not self.all_contacts and not self.items:
+            raise ValueError("Provide items or set all_contacts")
+        return self
+
+class CampaignItemResult(BaseModel):
+    request: OutreachRequest
+    status: str                 # "succeeded" or "failed"
+    result: Optional[OutreachResponse] = None
+    error: Optional[str] = None
+
+class CampaignResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    results: List[CampaignItemResult]
+
+
+class JobSubmitted(BaseModel):
+    job_id: str
+    status: str
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str                 # "queued", "running", "succeeded" or "failed"
+    stages_running: List[str]
+    stages_completed: List[str]
+    result: Optional[OutreachResponse] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
@@ -1,95 +1,215 @@
 #sequences the full outreach pipeline
-#Steps are run in thread pool to avoid blocking
+#Stages are declared with their inputs and run by the Pipeline scheduler, so independent
+#stages overlap. Exa and Anthropic calls run natively async. Emails are handed to the outbox,
+#which sends them through Gmail in the background, so delivery is not on the critical path.
+#Every run has a deadline (services.deadline) that all its outbound calls respect; optional strategy
+#work is skipped when too little of it is left.
+#Company news is researched in a stage of its own that only depends on the company. A single run
+#validates it in the same Haiku call as the person sections. A campaign researches and validates it once
+#per company and passes the result to each founder's run (company_stages)
 
-import asyncio
-import httpx
 import logging
+from contextvars import ContextVar
+from pipeline import Pipeline, Stage
 from services.contact_resolver import ContactResolver
 from services.research import ResearchService
 from services.email_drafter import EmailDraftService
 from services.email_delivery import EmailDeliveryService
+from services.outbox import Outbox
+from services.llm import LLMClient
 from models import OutreachRequest, OutreachResponse
 from services.connection_strategy import ConnectionStrategyService
-from services.research_validator import ResearchValidatorService
+from services.research_validator import ResearchValidatorService, PERSON_FIELDS
+from services.deadline import deadline, require, OUTREACH_DEADLINE
+from services import cassette
 
 logger = logging.getLogger(__name__)
 
+#-------------  Orchestrator Configuration --------------
+#Seconds of the run deadline that must be left to start the optional strategy research and drafting
+STRATEGY_RESEARCH_MIN_REMAINING = 20.0
+STRATEGY_MIN_REMAINING = 15.0
+#---------------------------------------------
+
+#Per-run callback for the email body as it is drafted. A context variable, so concurrent runs
+#on the shared orchestrator each stream to their own caller
+_draft_listener = ContextVar("draft_listener", default=None)
+
 class OutreachOrchestrator:
     def __init__(self):
         self.resolver = ContactResolver()
         self.researcher = ResearchService()
-        self.validator = ResearchValidatorService()
-        self.drafter = EmailDraftService()
-        self.strategy = ConnectionStrategyService()
-        self.gmail = EmailDeliveryService()
+        #One Anthropic client and one coalescing map for every LLM stage
+        self.llm = LLMClient()
+        self.validator = ResearchValidatorService(self.llm)
+        self.drafter = EmailDraftService(self.llm)
+        self.strategy = ConnectionStrategyService(self.llm)
+        #Wrapped to record or replay sends when CASSETTE_MODE is set
+        self.gmail = cassette.delivery(EmailDeliveryService())
+        self.outbox = Outbox(self.gmail)
+        #Called with each contact a run resolves, the prewarm scheduler ranks contacts by it
+        self.on_resolve = None
+
+        #Critical path: resolve -> research -> validate -> draft -> deliver.
+        #Company research runs alongside the person research and joins it at validate.
+        #Strategy research starts right after resolve and the strategy is drafted alongside the email.
+        #Everything strategy related is optional and can fail without blocking the flow
+        self.pipeline = Pipeline(
+            [
+                Stage("resolve", self._resolve, deps=("request",)),
+                Stage("research", self._research, deps=("resolve",)),
+                Stage("company_research", self._company_research, deps=("resolve",)),
+                Stage("strategy_research", self._strategy_research, deps=("resolve",), optional=True),
+                Stage("validate", self._validate, deps=("resolve", "research", "company_research")),
+                Stage("draft", self._draft, deps=("resolve", "validate")),
+                Stage("strategy", self._strategy,
+                      deps=("resolve", "validate", "strategy_research"), optional=True),
+                Stage("deliver", self._deliver, deps=("resolve", "draft")),
+                #Queued after the outreach email so it is sent second
+                Stage("deliver_strategy", self._deliver_strategy,
+                      deps=("resolve", "strategy", "deliver"), optional=True)
+            ],
+            inputs=("request",)
+        )
+
+    async def run(self, request: OutreachRequest, listener=None,
+                  completed: dict = None, on_draft=None,
+                  deadline_seconds: float = OUTREACH_DEADLINE) -> OutreachResponse:
+        #listener(stage, status, payload) receives per-stage progress, see Pipeline.run.
+        #completed holds results of stages that already ran (e.g. a resumed job) and are not repeated.
+        #on_draft(text) receives the email body token by token while it is drafted.
+        #deadline_seconds bounds the whole run, None for no deadline
+        results = await self.run_stages(request, listener=listener, completed=completed, on_draft=on_draft,
+                                        deadline_seconds=deadline_seconds)
+        return self._response(results)
+
+    #Runs only the stages needed for targets (default all) and returns every stage result
+    async def run_stages(self, request: OutreachRequest, targets: tuple = None,
+                         listener=None, completed: dict = None, on_draft=None,
+                         deadline_seconds: float = OUTREACH_DEADLINE) -> dict:
+        #Stage tasks copy the current context, so they see the listener and deadline set here
+        token = _draft_listener.set(on_draft)
+        try:
+            with deadline(deadline_seconds):
+                return await self.pipeline.run(
+                    {**(completed or {}), "request": request},
+                    listener=listener,
+                    targets=targets
+                )
+        finally:
+            _draft_listener.reset(token)
+
+    #Company research for one company, already validated, to pass in completed to the run of everyone
+    #there. Their validate stages then only validate the person sections. notes are the internal notes
+    #on the company's contacts
+    async def company_stages(self, company: str, notes: str,
+                             deadline_seconds: float = OUTREACH_DEADLINE) -> dict:
+        with deadline(deadline_seconds):
+            company_research = await self.researcher.research_company(company)
+            validated = await self.validator.validate_company(company_research, notes, company)
+        return {"company_research": {**company_research, "validated": validated}}
+
+    def _response(self, results: dict) -> OutreachResponse:
+        # Return confirmation
+        contact = results["resolve"]["contact"]
+        team_member = results["resolve"]["team_member"]
+        return OutreachResponse(
+            status=results["deliver"]["status"],
+            sent_to=team_member["email"],
+            contact_name=f"{contact['first_name']} {contact['last_name']}",
+            email_preview=results["draft"]["body"]
+        )
+
+    # ---------- Stages ----------
 
-    async def run(self, request: OutreachRequest) -> OutreachResponse:
+    async def _resolve(self, request: OutreachRequest) -> dict:
         # Validate contact and team member exist
         contact = self.resolver.get_contact(request.first_name, request.last_name)
         team_member = self.resolver.get_team_member(request.team_member)
         logger.info(f"Resolved contact: {contact['first_name']} {contact['last_name']}")
+        if self.on_resolve:
+            self.on_resolve(contact)
+        return {"contact": contact, "team_member": team_member}
 
-        #  Research the contact 
-        raw_research = await asyncio.to_thread(
-            self.researcher.research,
+    async def _research(self, resolve: dict) -> dict:
+        contact = resolve["contact"]
+        return await self.researcher.research_person(
             first_name=contact["first_name"],
             last_name=contact["last_name"],
             company=contact["company"]
         )
-        #validate research
-        validated_research = await asyncio.to_thread(
-            self.validator.validate,
-            research=raw_research,
-            notes=contact["notes"],
+
+    async def _company_research(self, resolve: dict) -> dict:
+        return await self.researcher.research_company(resolve["contact"]["company"])
+
+    async def _strategy_research(self, resolve: dict) -> dict:
+        require(STRATEGY_RESEARCH_MIN_REMAINING, "strategy research")
+        contact = resolve["contact"]
+        return await self.researcher.research_strategy(
             full_name=f"{contact['first_name']} {contact['last_name']}",
             company=contact["company"]
         )
 
-        #  Draft the email 
-        draft = await asyncio.to_thread(
-            self.drafter.draft,
-            contact=contact,
-            research=validated_research,
-            team_member=team_member
+    async def _validate(self, resolve: dict, research: dict, company_research: dict) -> dict:
+        contact = resolve["contact"]
+        shared = company_research.get("validated")
+        if shared is None:
+            #One combined call for the person and company sections
+            return await self.validator.validate(
+                research={**research, "company_context": company_research["company_context"]},
+                notes=contact["notes"],
+                full_name=f"{contact['first_name']} {contact['last_name']}",
+                company=contact["company"]
+            )
+        #A campaign validated the company news once for everyone at the company
+        validated = await self.validator.validate(
+            research=research,
+            notes=contact["notes"],
+            full_name=f"{contact['first_name']} {contact['last_name']}",
+            company=contact["company"],
+            fields=PERSON_FIELDS
         )
+        return self.validator.merge(validated, shared)
 
-        #Connection strategy. Can fail without blocking the flow
-        strategy = None
-        try:
-            strategy = await asyncio.to_thread(
-                self.strategy.generate,
-                contact=contact,
-                research=validated_research,
-                team_member=team_member
-            )
-        except Exception as e:
-            logger.warning(f"Connection strategy failed — sending outreach only: {e}")
+    async def _draft(self, resolve: dict, validate: dict) -> dict:
+        return await self.drafter.draft(
+            contact=resolve["contact"],
+            research=validate,
+            team_member=resolve["team_member"],
+            on_body=_draft_listener.get()
+        )
 
+    async def _strategy(self, resolve: dict, validate: dict, strategy_research: dict) -> dict:
+        require(STRATEGY_MIN_REMAINING, "connection strategy")
+        return await self.strategy.generate(
+            contact=resolve["contact"],
+            research=validate,
+            team_member=resolve["team_member"],
+            strategy_research=strategy_research
+        )
 
-        # Deliver to team member's inbox 
-        delivery = await asyncio.to_thread(
-            self.gmail.send,
-            to_email=team_member["email"],
+    async def _deliver(self, resolve: dict, draft: dict) -> dict:
+        # Queue for the team member's inbox, the outbox sender delivers it
+        return self.outbox.enqueue(
+            to_email=resolve["team_member"]["email"],
             subject=draft["subject"],
             body=draft["body"]
         )
 
-        if strategy:
-            try:
-                await asyncio.to_thread(
-                    self.gmail.send,
-                    to_email=team_member["email"],
-                    subject=strategy["subject"],
-                    body=strategy["body"]
-                )
-            except Exception as e:
-                logger.warning(f"Strategy email delivery failed: {e}")
+    async def _deliver_strategy(self, resolve: dict, strategy: dict, deliver: dict) -> dict:
+        return self.outbox.enqueue(
+            to_email=resolve["team_member"]["email"],
+            subject=strategy["subject"],
+            body=strategy["body"]
+        )
 
+    def start(self):
+        #Starts the background outbox sender, call from inside the running event loop
+        self.outbox.start()
 
-        # Return confirmation
-        return OutreachResponse(
-            status=delivery["status"],
-            sent_to=team_member["email"],
-            contact_name=f"{contact['first_name']} {contact['last_name']}",
-            email_preview=draft["body"]
-        )
\ No newline at end of file
+    async def aclose(self):
+        await self.outbox.stop()
+        await self.researcher.aclose()
+        await self.llm.aclose()
+        self.validator.close()
+        self.resolver.close()
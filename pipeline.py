@@ -0,0 +1,157 @@
+#Small dependency-graph executor for the outreach pipeline
+#Each stage declares the stages (or seed inputs) it needs and starts as soon as they are done,
+#so independent stages run concurrently and latency follows the critical path.
+#Optional stages fail soft: their result is None and optional stages depending on them are skipped.
+
+import time
+import asyncio
+import inspect
+import logging
+from dataclasses import dataclass
+from typing import Callable, Optional
+from services.metrics import STAGE_DURATION, STAGES_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    #Called with one keyword argument per dependency. Sync functions run in the thread pool
+    func: Callable
+    deps: tuple = ()
+    optional: bool = False
+
+
+class Pipeline:
+
+    def __init__(self, stages: list, inputs: tuple = ()):
+        self.inputs = set(inputs)
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages or stage.name in self.inputs:
+                raise ValueError(f"Duplicate pipeline stage '{stage.name}'")
+            self.stages[stage.name] = stage
+
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages and dep not in self.inputs:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+                #A required stage can never wait on something that is allowed to fail
+                if not stage.optional and dep in self.stages and self.stages[dep].optional:
+                    raise ValueError(f"Required stage '{stage.name}' depends on optional stage '{dep}'")
+
+        self.order = self._topological_order()
+
+
+    def _topological_order(self) -> list:
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done or name in self.inputs:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline has a dependency cycle through '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+            order.append(self.stages[name])
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+
+    #Stage names that must run to produce the targets, targets included
+    def _needed(self, targets: tuple) -> set:
+        needed, pending = set(), list(targets)
+        while pending:
+            name = pending.pop()
+            if name in needed or name in self.inputs:
+                continue
+            if name not in self.stages:
+                raise ValueError(f"Unknown pipeline stage '{name}'")
+            needed.add(name)
+            pending.extend(self.stages[name].deps)
+        return needed
+
+
+    #results holds the seed inputs and any stages already completed (those are not re-run).
+    #targets limits the run to those stages and what they depend on, default is the whole graph.
+    #listener(stage_name, status, payload) is called with "started", "done", "skipped" or "failed"
+    async def run(self, results: dict, listener: Optional[Callable] = None,
+                  targets: Optional[tuple] = None) -> dict:
+        results = dict(results)
+        missing = self.inputs - set(results)
+        if missing:
+            raise ValueError(f"Pipeline inputs missing: {', '.join(sorted(missing))}")
+        needed = self._needed(targets) if targets else set(self.stages)
+
+        tasks = {}
+        for stage in self.order:
+            if stage.name in results or stage.name not in needed:
+                continue
+            tasks[stage.name] = asyncio.create_task(
+                self._run_stage(stage, tasks, results, listener),
+                name=f"stage:{stage.name}"
+            )
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            #A required stage failed (or we were cancelled): stop everything still running
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return results
+
+
+    async def _run_stage(self, stage: Stage, tasks: dict, results: dict, listener):
+        for dep in stage.deps:
+            if dep in tasks:
+                await tasks[dep]
+
+        inputs = {dep: results[dep] for dep in stage.deps}
+        skipped = [dep for dep in stage.deps
+                   if dep in self.stages and self.stages[dep].optional and inputs[dep] is None]
+        if skipped:
+            results[stage.name] = None
+            logger.info(f"Skipping stage {stage.name}: {', '.join(skipped)} produced no result")
+            _notify(listener, stage.name, "skipped", None)
+            return
+
+        _notify(listener, stage.name, "started", None)
+        start = time.perf_counter()
+        STAGES_IN_FLIGHT.inc(stage=stage.name)
+        try:
+            if inspect.iscoroutinefunction(stage.func):
+                result = await stage.func(**inputs)
+            else:
+                result = await asyncio.to_thread(stage.func, **inputs)
+        except Exception as e:
+            STAGE_DURATION.observe(time.perf_counter() - start, stage=stage.name, status="failed")
+            _notify(listener, stage.name, "failed", e)
+            if not stage.optional:
+                raise
+            logger.warning(f"Optional stage {stage.name} failed, continuing without it: {e}")
+            results[stage.name] = None
+            return
+        finally:
+            STAGES_IN_FLIGHT.dec(stage=stage.name)
+
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage.name, status="done")
+        results[stage.name] = result
+        _notify(listener, stage.name, "done", result)
+
+
+def _notify(listener, name: str, status: str, payload):
+    if listener is None:
+        return
+    #A broken listener must never break the pipeline itself
+    try:
+        listener(name, status, payload)
+    except Exception as e:
+        logger.warning(f"Pipeline listener failed on {name}/{status}: {e}")
@@ -0,0 +1,244 @@
+#Background pre-research that keeps contact research warm
+#The contacts are known in advance, so research and validation do not have to wait for a request.
+#During off-peak hours the scheduler walks the contact store and runs each due contact through the
+#pipeline up to validate. Research and validated sections that would expire before the next working
+#day are refreshed, and the results land in the research and validation caches. A later
+#/generate-outreach for a warm contact finds every lookup in the caches and only spends time drafting.
+#Contacts that were added or requested most recently go first, and a daily quota caps the cost.
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from models import OutreachRequest
+from orchestrator import OutreachOrchestrator
+from services.cache import fresh_for
+from services.contact_resolver import normalize
+from services.rate_limit import TokenBucket, SharedTokenBucket
+from services.shared_state import connect, shared
+
+logger = logging.getLogger(__name__)
+
+#-------------  Prewarm Configuration --------------
+PREWARM_DB_PATH = os.getenv("PREWARM_DB_PATH", "cache/prewarm.db")
+#Contacts warmed per day, across all workers. Off (0) unless set, warming spends Exa and Haiku credits
+PREWARM_CONTACTS_PER_DAY = int(os.getenv("PREWARM_CONTACTS_PER_DAY", "0"))
+#Local hours the scheduler works in, start-end with the end excluded and wrapping past midnight.
+#Late enough that company news (12h TTL) stays fresh well into the working day
+PREWARM_HOURS = os.getenv("PREWARM_HOURS", "2-7")
+#Seconds before a warmed contact is due again, about once per off-peak window
+PREWARM_REFRESH_AFTER = 12 * 3600
+#Seconds of life cached research must have left, entries closer to expiry are fetched again.
+#Capped at half of each category's TTL by the cache, see services/cache.py
+PREWARM_FRESH_FOR = 16 * 3600
+#Seconds between checks for due contacts
+PREWARM_INTERVAL = 300.0
+#Seconds a worker keeps a contact to itself while warming it
+PREWARM_CLAIM_TTL = 120.0
+#Stages run for each contact, their results are what a request would otherwise wait for
+PREWARM_TARGETS = ("validate", "strategy_research")
+#---------------------------------------------
+
+
+def contact_key(contact: dict) -> str:
+    #Same normalization as the contact lookups, so "Martín" and "martin" are one contact
+    return "|".join(normalize(contact[field]) for field in ("first_name", "last_name", "company"))
+
+
+def off_peak(hours: str = PREWARM_HOURS, now: float = None) -> bool:
+    start, end = (int(part) for part in hours.split("-"))
+    hour = time.localtime(now).tm_hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+class PrewarmStore:
+    #When each contact was first seen, last requested and last warmed
+
+    def __init__(self, path: str = PREWARM_DB_PATH):
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS contacts (
+                    key TEXT PRIMARY KEY,
+                    position INTEGER NOT NULL,
+                    added_at REAL NOT NULL,
+                    requested_at REAL,
+                    warmed_at REAL
+                )"""
+            )
+
+
+    def sync(self, contacts: list):
+        #Adds new rows of the contact store and forgets removed ones. position (row order) breaks
+        #ties between contacts added together, later rows are taken to be newer
+        now = time.time()
+        keys = {contact_key(contact): position for position, contact in enumerate(contacts)}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                known = {row[0] for row in self._conn.execute("SELECT key FROM contacts")}
+                self._conn.executemany(
+                    "INSERT INTO contacts (key, position, added_at) VALUES (?, ?, ?)",
+                    [(key, position, now) for key, position in keys.items() if key not in known]
+                )
+                self._conn.executemany(
+                    "DELETE FROM contacts WHERE key = ?", [(key,) for key in known - keys.keys()]
+                )
+                self._conn.executemany(
+                    "UPDATE contacts SET position = ? WHERE key = ?",
+                    [(position, key) for key, position in keys.items() if key in known]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+    def requested(self, contact: dict):
+        #A contact added since the last sync is inserted here, ahead of the rows it ties with
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO contacts (key, position, added_at, requested_at) VALUES (?, -1, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET requested_at = excluded.requested_at",
+                (contact_key(contact), now, now)
+            )
+
+
+    def warmed(self, key: str):
+        with self._lock:
+            self._conn.execute("UPDATE contacts SET warmed_at = ? WHERE key = ?", (time.time(), key))
+
+
+    def due(self, refresh_after: float = PREWARM_REFRESH_AFTER) -> list:
+        #Keys never warmed or warmed longer ago than refresh_after, most recently added or requested first
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM contacts WHERE warmed_at IS NULL OR warmed_at <= ? "
+                "ORDER BY MAX(added_at, COALESCE(requested_at, 0)) DESC, position DESC",
+                (time.time() - refresh_after,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+    def is_due(self, key: str, refresh_after: float = PREWARM_REFRESH_AFTER) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT warmed_at FROM contacts WHERE key = ?", (key,)).fetchone()
+        return row is not None and (row[0] is None or row[0] <= time.time() - refresh_after)
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PrewarmScheduler:
+
+    def __init__(self, orchestrator: OutreachOrchestrator, store: PrewarmStore = None,
+                 per_day: int = PREWARM_CONTACTS_PER_DAY):
+        self.orchestrator = orchestrator
+        self.store = store or PrewarmStore()
+        self.per_day = per_day
+        #The quota refills continuously at per_day a day. Shared, so extra workers do not multiply it
+        state = shared()
+        rate = max(per_day, 1) / (24 * 3600)
+        self.quota = (SharedTokenBucket(state, "prewarm", rate, max(per_day, 1)) if state is not None
+                      else TokenBucket(rate, max(per_day, 1)))
+        self._task = None
+        #Requests move their contact up the queue
+        orchestrator.on_resolve = self.store.requested
+
+
+    def start(self):
+        #Call from inside the running event loop
+        self.store.sync(self.orchestrator.resolver.contacts)
+        if self.per_day > 0:
+            self._task = asyncio.create_task(self._loop(), name="prewarm-scheduler")
+
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.orchestrator.on_resolve = None
+        self.store.close()
+
+
+    async def _loop(self):
+        while True:
+            if off_peak():
+                try:
+                    await self.run_pass()
+                except Exception as e:
+                    logger.error(f"Prewarm pass failed: {e}", exc_info=True)
+            await asyncio.sleep(PREWARM_INTERVAL)
+
+
+    async def run_pass(self, hours: str = PREWARM_HOURS) -> int:
+        #Warms due contacts until none are left, the quota runs out or off-peak hours end.
+        #Returns the number of contacts warmed
+        contacts = {contact_key(row): row for row in self.orchestrator.resolver.contacts}
+        self.store.sync(list(contacts.values()))
+        warmed = 0
+        for key in self.store.due():
+            if not off_peak(hours):
+                logger.info("Prewarm stopped, off-peak hours are over")
+                break
+            if key not in contacts:
+                continue
+            outcome = await self._warm_claimed(key, contacts[key])
+            if outcome == "quota":
+                logger.info(f"Prewarm quota of {self.per_day} contacts a day used up")
+                break
+            warmed += outcome == "warmed"
+        if warmed:
+            logger.info(f"Prewarmed research for {warmed} contacts")
+        return warmed
+
+
+    async def _warm_claimed(self, key: str, row: dict) -> str:
+        #"warmed", "skipped" when another worker is warming the contact or just did, or "quota"
+        state = shared()
+        if state is not None and not state.claim(f"prewarm:{key}", PREWARM_CLAIM_TTL):
+            return "skipped"
+        try:
+            if not self.store.is_due(key):
+                return "skipped"
+            if not await self.quota.try_acquire_async():
+                return "quota"
+            try:
+                await self.warm(row)
+            except Exception as e:
+                #Marked warmed all the same, a contact that keeps failing must not use up the quota
+                logger.warning(f"Prewarm failed for {row['first_name']} {row['last_name']}: {e}")
+            self.store.warmed(key)
+            return "warmed"
+        finally:
+            if state is not None:
+                state.release(f"prewarm:{key}")
+
+
+    async def warm(self, row: dict):
+        #The same stages and inputs as a request, so a request finds exactly these cache entries.
+        #resolve is passed in, it needs a team member and would count as a request
+        contact = {
+            "first_name": row["first_name"],
+            "last_name": row["last_name"],
+            "company": row["company"],
+            "notes": row.get("notes", "")
+        }
+        request = OutreachRequest(first_name=contact["first_name"], last_name=contact["last_name"],
+                                  company=contact["company"], team_member="")
+        with fresh_for(PREWARM_FRESH_FOR):
+            await self.orchestrator.run_stages(
+                request,
+                targets=PREWARM_TARGETS,
+                completed={"resolve": {"contact": contact, "team_member": None}},
+                #Nobody is waiting, the scheduler waits out rate limits instead of giving up
+                deadline_seconds=None
+            )
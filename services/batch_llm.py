@@ -0,0 +1,92 @@
+# BatchLLMService: runs many messages.create requests through the Anthropic Message Batches API.
+# Batches are billed at half the price of interactive calls and do not count against the
+# interactive rate limits, at the cost of latency (minutes to hours). Used for bulk campaign runs.
+# It reuses the Anthropic client of the LLMClient it is given. The client honours ANTHROPIC_BASE_URL,
+# so it can be pointed at a local fake batch endpoint.
+
+import os
+import asyncio
+import logging
+from dotenv import load_dotenv
+from services.llm import LLMClient, usage_counts
+from services.metrics import track_call, record_tokens
+from services.rate_limit import upstream
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+#-------------  Batch Configuration --------------
+#Seconds between status checks while a batch is processing
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "30"))
+#API limit is 100,000 requests per batch; larger sets are split
+BATCH_MAX_REQUESTS = 10000
+#---------------------------------------------
+
+
+class BatchRequestError(RuntimeError):
+    pass
+
+
+class BatchLLMService:
+
+    def __init__(self, llm: LLMClient = None):
+        self.llm = llm or LLMClient()
+
+
+    #requests maps custom_id -> messages.create params. custom_ids must match ^[a-zA-Z0-9_-]{1,64}$.
+    #Returns custom_id -> response text, or a BatchRequestError for requests that did not succeed
+    async def run(self, requests: dict) -> dict:
+        if not requests:
+            return {}
+
+        ids = list(requests)
+        chunks = [ids[i:i + BATCH_MAX_REQUESTS] for i in range(0, len(ids), BATCH_MAX_REQUESTS)]
+        results = {}
+        #Chunks are independent batches and are processed by the API in parallel
+        for chunk_results in await asyncio.gather(
+            *[self._run_batch({cid: requests[cid] for cid in chunk}) for chunk in chunks]
+        ):
+            results.update(chunk_results)
+
+        #Anything the results file did not mention is treated as failed
+        for cid in ids:
+            results.setdefault(cid, BatchRequestError(f"No batch result for {cid}"))
+        return results
+
+
+    async def _run_batch(self, requests: dict) -> dict:
+        #Batch calls have their own limits, separate from the per-model message buckets
+        limiter = upstream("anthropic:batches")
+
+        async def create():
+            async with track_call("anthropic", "Batch create"):
+                return await self.llm.client.messages.batches.create(
+                    requests=[{"custom_id": cid, "params": params} for cid, params in requests.items()]
+                )
+
+        batch = await limiter.call(create)
+        logger.info(f"Submitted message batch {batch.id} with {len(requests)} requests")
+
+        while batch.processing_status != "ended":
+            await asyncio.sleep(BATCH_POLL_INTERVAL)
+            batch = await limiter.call(lambda: self.llm.client.messages.batches.retrieve(batch.id))
+            counts = batch.request_counts
+            logger.info(f"Batch {batch.id}: {counts.processing} processing, "
+                        f"{counts.succeeded} succeeded, {counts.errored} errored")
+
+        results = {}
+        totals = {"input": 0, "output": 0, "cache_write": 0, "cache_read": 0}
+        async for entry in await self.llm.client.messages.batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                results[entry.custom_id] = entry.result.message.content[0].text
+                counts = usage_counts(entry.result.message.usage)
+                record_tokens(entry.result.message.model, counts, mode="batch")
+                for key, value in counts.items():
+                    totals[key] += value
+            else:
+                detail = getattr(entry.result, "error", None) or entry.result.type
+                results[entry.custom_id] = BatchRequestError(f"Batch request {entry.custom_id} {detail}")
+        logger.info(f"Batch {batch.id} ended with {len(results)} results, tokens: input {totals['input']}, "
+                    f"output {totals['output']}, cache write {totals['cache_write']}, cache read {totals['cache_read']}")
+        return results
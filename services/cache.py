@@ -0,0 +1,154 @@
+# Disk-backed key/value cache on SQLite, shared by services that want to skip repeated remote calls.
+# Entries expire after a per-category TTL and the least recently used rows are evicted once
+# the cache grows past max_entries. Values are stored as JSON. Lookups only read: the access times
+# LRU eviction goes by are collected in memory and written in batches, with the next write or every
+# CACHE_TOUCH_BATCH hits, so a hit never waits on another process's write lock.
+# Inside fresh_for(seconds), entries that would expire within that many seconds count as misses, so
+# a refresh (prewarm.py) fetches them again before they run out. The window is capped at a share of
+# each category's TTL, so an entry just written is never a miss for the refresh that wrote it.
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from services.shared_state import connect
+
+logger = logging.getLogger(__name__)
+
+#Share of its TTL an entry must have left at most to be a hit inside fresh_for
+FRESH_FOR_MAX_SHARE = 0.5
+#Hits whose access times are kept in memory before they are written
+CACHE_TOUCH_BATCH = 100
+
+#Seconds of life an entry must have left to be a hit in the current context, 0 outside fresh_for
+_fresh_for = ContextVar("cache_fresh_for", default=0.0)
+
+
+@contextmanager
+def fresh_for(seconds: float):
+    token = _fresh_for.set(seconds)
+    try:
+        yield
+    finally:
+        _fresh_for.reset(token)
+
+
+class DiskCache:
+
+    def __init__(self, path: str, ttls: dict, default_ttl: float, max_entries: int):
+        self.path = path
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        #Key -> last access time of hits not written yet
+        self._touched = {}
+        #One connection shared across threads, every access goes through the lock
+        self._lock = threading.Lock()
+
+        #WAL and a busy timeout, every uvicorn worker reads and writes the same file
+        self._conn = connect(path, isolation_level="")
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    category TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)"
+            )
+
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        #Stable hash of any JSON-serializable parts
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, category FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+            #Expired rows are left for the eviction on the next write
+            if row is None or row[1] <= now:
+                self.misses += 1
+                return None
+
+            value, expires_at, category = row
+            fresh = min(_fresh_for.get(), FRESH_FOR_MAX_SHARE * self.ttls.get(category, self.default_ttl))
+            if expires_at <= now + fresh:
+                #Still valid for others, but about to expire for whoever asked for a fresh copy
+                self.misses += 1
+                return None
+
+            #Remembered so LRU eviction keeps entries that are still being read
+            self._touched[key] = now
+            self.hits += 1
+            if len(self._touched) >= CACHE_TOUCH_BATCH:
+                with self._conn:
+                    self._touch()
+        return json.loads(value)
+
+
+    def _touch(self):
+        #Writes the collected access times, call with the lock held inside a transaction
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE entries SET accessed_at = MAX(accessed_at, ?) WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._touched.items()]
+            )
+            self._touched.clear()
+
+
+    def set(self, key: str, value, category: str):
+        now = time.time()
+        ttl = self.ttls.get(category, self.default_ttl)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, category, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, category, json.dumps(value, ensure_ascii=False), now + ttl, now)
+            )
+            self._touched.pop(key, None)
+            self._touch()
+            self._evict(now)
+
+
+    def _evict(self, now: float):
+        #Expired rows go first, then the least recently used ones above the size bound
+        self._conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY accessed_at LIMIT ?)",
+                (overflow,)
+            )
+            logger.info(f"Cache {self.path} evicted {overflow} least recently used entries")
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
+
+
+    def close(self):
+        with self._lock:
+            with self._conn:
+                self._touch()
+            self._conn.close()
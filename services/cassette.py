@@ -0,0 +1,273 @@
+# Record-and-replay of outbound traffic ("cassettes"), for offline, repeatable runs
+# With CASSETTE_MODE=record every Exa and Anthropic HTTP exchange and every Gmail send is stored in one
+# SQLite archive, bodies zlib-compressed and indexed by a hash of the request. With CASSETTE_MODE=replay
+# the same requests are answered from the archive, with their recorded latency or none, and nothing
+# goes out on the network. Profiling and before/after comparisons then run on real responses without
+# spending API credits, and every run sees the same data.
+# Exa and Anthropic are hooked in at the httpx transport, Gmail (googleapiclient, not httpx) by
+# wrapping EmailDeliveryService. Off by default; nothing here is touched unless a mode is set.
+
+import os
+import json
+import time
+import zlib
+import asyncio
+import hashlib
+import logging
+import threading
+import httpx
+from services.metrics import status_code
+from services.shared_state import connect
+
+logger = logging.getLogger(__name__)
+
+#-------------  Cassette Configuration --------------
+#record, replay, or unset for normal live traffic
+CASSETTE_MODE = os.getenv("CASSETTE_MODE")
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cache/cassette.db")
+#original: replayed responses take as long as they did when recorded, zero: answered at once
+CASSETTE_LATENCY = os.getenv("CASSETTE_LATENCY", "original")
+CASSETTE_COMPRESSION_LEVEL = 6
+#---------------------------------------------
+
+#Set by the transport from the decoded body, they would be wrong on a replayed response
+_DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+class CassetteMissError(RuntimeError):
+    #Replay found no recording for a request. status_code keeps it out of the retry logic
+    status_code = None
+
+
+class ReplayedError(RuntimeError):
+    #A per-message Gmail failure as recorded. status_code lets the outbox treat it like the original
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Cassette:
+
+    def __init__(self, path: str = CASSETTE_PATH, mode: str = CASSETTE_MODE, latency: str = CASSETTE_LATENCY):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}'")
+        if latency not in ("original", "zero"):
+            raise ValueError(f"Unknown cassette latency '{latency}'")
+        self.mode = mode
+        self.latency = latency
+        #key -> occurrences seen in this process. The nth identical request gets the nth recording,
+        #so repeated calls whose answers change (batch status polls) replay in order
+        self._seen = {}
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS interactions (
+                    key TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    service TEXT NOT NULL,
+                    method TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    request BLOB NOT NULL,
+                    status INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    latency REAL NOT NULL,
+                    recorded_at REAL NOT NULL,
+                    PRIMARY KEY (key, seq)
+                )"""
+            )
+        logger.info(f"Cassette {mode} mode, archive {path}")
+
+
+    @staticmethod
+    def make_key(service: str, method: str, path: str, body: bytes) -> str:
+        #JSON bodies are compared by content, so key order or spacing differences still match.
+        #The host is left out: a cassette recorded against one endpoint replays against any other
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode("utf-8")
+        except ValueError:
+            pass
+        digest = hashlib.sha256()
+        for part in (service, method.upper(), path):
+            digest.update(part.encode("utf-8") + b"\0")
+        digest.update(body)
+        return digest.hexdigest()
+
+
+    def next_seq(self, key: str) -> int:
+        with self._lock:
+            seq = self._seen.get(key, 0)
+            self._seen[key] = seq + 1
+        return seq
+
+
+    def record(self, key: str, seq: int, service: str, method: str, url: str, request: bytes,
+               status: int, headers: dict, body: bytes, latency: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO interactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, seq, service, method, url,
+                 zlib.compress(request, CASSETTE_COMPRESSION_LEVEL), status, json.dumps(headers),
+                 zlib.compress(body, CASSETTE_COMPRESSION_LEVEL), latency, time.time())
+            )
+
+
+    def lookup(self, key: str, seq: int, what: str):
+        #(status, headers, body, latency) of the seq-th recording, or the last one if fewer were made
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, headers, body, latency FROM interactions WHERE key = ? AND seq <= ? "
+                "ORDER BY seq DESC LIMIT 1",
+                (key, seq)
+            ).fetchone()
+        if row is None:
+            raise CassetteMissError(f"No recording for {what}, record it again with CASSETTE_MODE=record")
+        status, headers, body, latency = row
+        return status, json.loads(headers), zlib.decompress(body), latency
+
+
+    async def wait(self, latency: float):
+        if self.latency == "original" and latency > 0:
+            await asyncio.sleep(latency)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT service, COUNT(*), SUM(LENGTH(request) + LENGTH(body)) FROM interactions GROUP BY service"
+            ).fetchall()
+        return {service: {"interactions": count, "bytes": size} for service, count, size in rows}
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    #Records through to the real transport, or answers from the cassette without any network
+
+    def __init__(self, cassette: Cassette, service: str, transport: httpx.AsyncBaseTransport = None):
+        self.cassette = cassette
+        self.service = service
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        path = request.url.raw_path.decode("ascii")
+        key = Cassette.make_key(self.service, request.method, path, body)
+        seq = self.cassette.next_seq(key)
+
+        if self.cassette.mode == "replay":
+            status, headers, content, latency = self.cassette.lookup(
+                key, seq, f"{self.service} {request.method} {request.url.path}"
+            )
+            await self.cassette.wait(latency)
+            return httpx.Response(status, headers=headers, content=content, request=request)
+
+        #Streamed replies (Anthropic SSE) are read in full before they are handed on
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        latency = time.perf_counter() - start
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in _DROPPED_HEADERS}
+        self.cassette.record(key, seq, self.service, request.method, str(request.url), body,
+                             response.status_code, headers, content, latency)
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class CassetteDelivery:
+    #Stands in for EmailDeliveryService. Each message is recorded on its own, so replayed sends
+    #match even when the outbox groups messages into batches differently than when recording
+
+    def __init__(self, cassette: Cassette, delivery):
+        self.cassette = cassette
+        self.delivery = delivery
+
+
+    @staticmethod
+    def _key(message: dict) -> str:
+        body = json.dumps(
+            [message["to_email"], message["subject"], message["body"]], ensure_ascii=False
+        ).encode("utf-8")
+        return Cassette.make_key("gmail", "POST", "send", body)
+
+
+    def _record(self, message: dict, key: str, seq: int, result, latency: float):
+        if isinstance(result, BaseException):
+            status, body = status_code(result) or 0, {"error": str(result)}
+        else:
+            status, body = 200, result
+        self.cassette.record(key, seq, "gmail", "POST", "send", json.dumps(message).encode("utf-8"),
+                             status, {}, json.dumps(body).encode("utf-8"), latency)
+
+
+    def _replay(self, key: str, seq: int, message: dict):
+        status, _, body, latency = self.cassette.lookup(key, seq, f"gmail send to {message['to_email']}")
+        body = json.loads(body)
+        if "error" in body:
+            return ReplayedError(body["error"], status or None), latency
+        return body, latency
+
+
+    def send(self, to_email: str, subject: str, body: str) -> dict:
+        result = self.send_batch([{"to_email": to_email, "subject": subject, "body": body}])[0]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+
+    def send_batch(self, messages: list) -> list:
+        #Runs in a worker thread like the real one, so replay latency is a blocking sleep
+        keys = [self._key(message) for message in messages]
+        seqs = [self.cassette.next_seq(key) for key in keys]
+
+        if self.cassette.mode == "replay":
+            replayed = [self._replay(key, seq, message) for key, seq, message in zip(keys, seqs, messages)]
+            latency = max((latency for _, latency in replayed), default=0.0)
+            if self.cassette.latency == "original" and latency > 0:
+                time.sleep(latency)
+            return [result for result, _ in replayed]
+
+        start = time.perf_counter()
+        results = self.delivery.send_batch(messages)
+        latency = time.perf_counter() - start
+        for message, key, seq, result in zip(messages, keys, seqs, results):
+            self._record(message, key, seq, result, latency)
+        return results
+
+
+_cassette = None
+
+
+def active():
+    #The process-wide cassette when CASSETTE_MODE is set, otherwise None
+    global _cassette
+    if _cassette is None and CASSETTE_MODE:
+        _cassette = Cassette()
+    return _cassette
+
+
+def transport(service: str, limits: httpx.Limits = None):
+    #httpx transport for a client of service ("exa", "anthropic"), None for the default. A client
+    #given a transport ignores its own limits, so they are passed here instead
+    cassette = active()
+    if cassette is None:
+        return None
+    inner = httpx.AsyncHTTPTransport(limits=limits) if limits is not None else None
+    return CassetteTransport(cassette, service, inner)
+
+
+def delivery(service):
+    #EmailDeliveryService, wrapped when a cassette is active
+    cassette = active()
+    return CassetteDelivery(cassette, service) if cassette is not None else service
@@ -1,56 +1,23 @@
 # ConnectionStrategyService: generates a personalized connection strategy for a contact.
-# Runs additional Exa searches for events and published content, then uses Claude Sonnet
-# to generate a second email to the team member with concrete relationship-building angles.
+# Takes the additional Exa searches for events and published content (ResearchService.research_strategy),
+# then uses Claude Sonnet to generate a second email to the team member with concrete relationship-building angles.
 
-import os
+import json
 import logging
-import anthropic
 from dotenv import load_dotenv
-from services.research import ResearchService
+from services.llm import LLMClient, cached_system
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-class ConnectionStrategyService:
-
-    def __init__(self):
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        if not api_key:
-            raise ValueError("ANTHROPIC_API_KEY is not set in environment variables.")
-        self.client = anthropic.Anthropic(api_key=api_key)
-        self.researcher = ResearchService()
-
-
-    def generate(self, contact: dict, research: dict, team_member: dict) -> dict:
-
-        full_name = f"{contact['first_name']} {contact['last_name']}"
-        company = contact["company"]
-        logger.info(f"Generating connection strategy for {full_name} at {company}")
-
-        # Additional targeted searches
-        strategy_research = self.researcher.research_strategy(full_name, company)
-        
-        prompt = f"""
-        You are a relationship strategist helping {team_member['name']} at Kibo Ventures 
-        build a connection with {full_name}, Co-Founder of {company}.
-
-        GOAL: Write a concise, actionable connection strategy that {team_member['name']} 
-        can use to warm up the relationship before or after the initial outreach.
-
-        VALIDATED RESEARCH:
-        {research.get('validated_person', '')}
-        {research.get('validated_company', '')}
-
-        INTERNAL NOTES:
-        {contact['notes']}
-
-        EVENTS RESEARCH:
-        {strategy_research.get('events_context', 'No specific events found.')}
+#Identical for every strategy, so it is sent as a cached system block.
+#Anything contact or team member specific belongs in the user message instead
+STRATEGY_INSTRUCTIONS = """
+        You are a relationship strategist helping team members at Kibo Ventures build connections with founders.
+        Each request names the team member and the founder, and gives validated research, internal notes,
+        events research and published content research.
 
-        PUBLISHED CONTENT RESEARCH:
-        {strategy_research.get('content_context', 'No specific content found.')}
-        
         STRUCTURE:
         Write a short internal strategy note. No headers with lines, no manual, no sequence narrative.
         Use these sections only if you have something specific and actionable to say — skip any section 
@@ -78,7 +45,7 @@ class ConnectionStrategyService:
 
         RECOMMENDED NEXT STEPS
         3 to 5 short bullets. Concrete options ranked by ease, not a sequence, just options 
-        {team_member['name']} can choose from.
+        the team member can choose from.
 
         TONE:
         - Internal note — direct and practical
@@ -95,26 +62,78 @@ class ConnectionStrategyService:
 
         FORMAT:
         Return a JSON object with exactly these two fields:
-        {{
-            "subject": "Connection strategy — {full_name} / {company}",
+        {
+            "subject": the SUBJECT given in the request,
             "body": "the full strategy email body"
-        }}
+        }
         Return only the JSON object. No preamble, no markdown, no code blocks.
         """
 
-        message = self.client.messages.create(
-            model="claude-sonnet-4-6",
-            max_tokens=800,
-            messages=[{"role": "user", "content": prompt}]
+class ConnectionStrategyService:
+
+    def __init__(self, llm: LLMClient = None):
+        self.llm = llm or LLMClient()
+
+
+    async def generate(self, contact: dict, research: dict, team_member: dict,
+                 strategy_research: dict) -> dict:
+
+        full_name = f"{contact['first_name']} {contact['last_name']}"
+        logger.info(f"Generating connection strategy for {full_name} at {contact['company']}")
+
+        message = await self.llm.create(
+            "Connection strategy", **self.build_request(contact, research, team_member, strategy_research)
         )
 
+        result = self.parse(message.content[0].text)
+        logger.info(f"Connection strategy generated for {full_name}")
+        return result
+
+
+    #messages.create params for one strategy. Shared by the interactive path and bulk (Message Batches) runs.
+    #The instructions are a static, cached system block; only the user message changes per contact
+    def build_request(self, contact: dict, research: dict, team_member: dict,
+                      strategy_research: dict) -> dict:
+
+        full_name = f"{contact['first_name']} {contact['last_name']}"
+        company = contact["company"]
+
+        prompt = f"""
+        You are a relationship strategist helping {team_member['name']} at Kibo Ventures 
+        build a connection with {full_name}, Co-Founder of {company}.
+
+        GOAL: Write a concise, actionable connection strategy that {team_member['name']} 
+        can use to warm up the relationship before or after the initial outreach.
+
+        VALIDATED RESEARCH:
+        {research.get('validated_person', '')}
+        {research.get('validated_company', '')}
+
+        INTERNAL NOTES:
+        {contact['notes']}
+
+        EVENTS RESEARCH:
+        {strategy_research.get('events_context', 'No specific events found.')}
+
+        PUBLISHED CONTENT RESEARCH:
+        {strategy_research.get('content_context', 'No specific content found.')}
+
+        SUBJECT: Connection strategy — {full_name} / {company}
+        """
+
+        return {
+            "model": "claude-sonnet-4-6",
+            "max_tokens": 800,
+            "system": cached_system(STRATEGY_INSTRUCTIONS),
+            "messages": [{"role": "user", "content": prompt}]
+        }
+
+
+    @staticmethod
+    def parse(raw: str) -> dict:
         try:
-            import json
-            raw = message.content[0].text
             clean = raw.replace("```json", "").replace("```", "").strip()
-            result = json.loads(clean)
-            logger.info(f"Connection strategy generated for {full_name}")
-            return result
+            return json.loads(clean)
         except json.JSONDecodeError:
             logger.error("Connection strategy returned invalid JSON")
             raise RuntimeError("Connection strategy failed to return valid JSON.")
\ No newline at end of file
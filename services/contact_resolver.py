@@ -1,44 +1,177 @@
-#Loads both CSVs into memory on startup as lists of dicts for simple lookup
-#If contact list size becomes a problem,  the data can be indexed on load using a dictionary
-#Contact matches are case insensitive
+#Indexed contact and team store loaded from the semicolon separated CSV files
+#Lookups are O(1) dictionary hits on normalized keys: Unicode casefolded with accents stripped,
+#so "Martín" and "martin" find the same row. Contacts are also indexed by company.
+#A background thread watches both files and re-indexes them when they change. Readers keep using
+#the previous snapshot until the new one is swapped in, so a reload never blocks a lookup
 
 
 import csv
 import os
+import logging
+import threading
+import unicodedata
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+CONTACTS_PATH = os.getenv("CONTACTS_PATH", "data/contacts.csv")
+TEAM_PATH = os.getenv("TEAM_PATH", "data/team.csv")
+#Seconds between checks of the CSV files for changes
+RELOAD_INTERVAL = 2.0
+
+
+class AmbiguousMatchError(ValueError):
+    #More than one distinct row matches the lookup
+    pass
+
+
+def normalize(value: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    contacts: list
+    team_members: list
+    contacts_by_name: dict
+    contacts_by_company: dict
+    team_by_name: dict
+    #(mtime, size) per file, used to notice changes
+    versions: tuple
+
 
 class ContactResolver:
 
-    def __init__(self):
-        self.contacts = self._load_csv("data/contacts.csv")
-        self.team_members = self._load_csv("data/team.csv")
+    def __init__(self, contacts_path: str = CONTACTS_PATH, team_path: str = TEAM_PATH,
+                 watch: bool = True):
+        self.contacts_path = contacts_path
+        self.team_path = team_path
+        self._snapshot = self._build()
+        self._stop = threading.Event()
+        if watch:
+            threading.Thread(target=self._watch, name="contact-store-watcher", daemon=True).start()
 
-    def _load_csv(self, filepath: str) -> list:
+    @staticmethod
+    def load_csv(filepath: str) -> list:
         #csv saved with UTF8 (xlxs conversion)
         with open(filepath, newline="", encoding="utf-8-sig") as f:
             return list(csv.DictReader(f, delimiter=";"))
 
-    def get_contact(self, first_name: str, last_name: str) -> dict:
+    # ---------- Index ----------
 
-        for row in self.contacts:
-            if (row["first_name"].lower() == first_name.lower() and
-                row["last_name"].lower() == last_name.lower()):
+    def _versions(self) -> tuple:
+        versions = []
+        for path in (self.contacts_path, self.team_path):
+            stat = os.stat(path)
+            versions.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(versions)
 
-                return {
-                    "first_name": row["first_name"],
-                    "last_name": row["last_name"],
-                    "company": row["company"],
-                    "notes": row.get("notes", "")
-                }
-        raise ValueError(f"Contact '{first_name} {last_name}' not found.")
+    def _build(self) -> _Snapshot:
+        versions = self._versions()
+        contacts = self.load_csv(self.contacts_path)
+        team_members = self.load_csv(self.team_path)
 
+        contacts_by_name, contacts_by_company, team_by_name = {}, {}, {}
+        for row in contacts:
+            key = (normalize(row["first_name"]), normalize(row["last_name"]))
+            contacts_by_name.setdefault(key, []).append(row)
+            contacts_by_company.setdefault(normalize(row["company"]), []).append(row)
+        for row in team_members:
+            rows = team_by_name.setdefault(normalize(row["name"]), [])
+            #Rows with the same name and email are one person listed twice, e.g. under an old and a
+            #new role. The first row is kept, so the person stays usable
+            same = next((r for r in rows if r["email"].strip().casefold() == row["email"].strip().casefold()), None)
+            if same is None:
+                rows.append(row)
+            elif same.get("role") != row.get("role"):
+                logger.warning(f"Team member {row['name']} <{row['email']}> is listed with roles "
+                               f"'{same.get('role')}' and '{row.get('role')}', using '{same.get('role')}'")
 
-    def get_team_member(self, name: str) -> dict:
+        return _Snapshot(
+            contacts=contacts,
+            team_members=team_members,
+            contacts_by_name=contacts_by_name,
+            contacts_by_company=contacts_by_company,
+            team_by_name=team_by_name,
+            versions=versions
+        )
 
-        for row in self.team_members:
-            if row["name"].lower() == name.lower():
-                return {
-                    "name": row["name"],
-                    "email": row["email"],
-                    "role": row["role"]
-                }
-        raise ValueError(f"Team member '{name}' not found.")
\ No newline at end of file
+    def _watch(self):
+        while not self._stop.wait(RELOAD_INTERVAL):
+            try:
+                if self._versions() == self._snapshot.versions:
+                    continue
+                snapshot = self._build()
+            except (OSError, KeyError, csv.Error) as e:
+                #Usually a file caught mid-save, the next check picks up the finished version
+                logger.warning(f"Contact store reload failed, keeping previous data: {e}")
+                continue
+            #Single reference swap, readers see either the old or the new index
+            self._snapshot = snapshot
+            logger.info(f"Contact store reloaded: {len(snapshot.contacts)} contacts, "
+                        f"{len(snapshot.team_members)} team members")
+
+    def close(self):
+        self._stop.set()
+
+    @property
+    def contacts(self) -> list:
+        return self._snapshot.contacts
+
+    @property
+    def team_members(self) -> list:
+        return self._snapshot.team_members
+
+    # ---------- Lookups ----------
+
+    @staticmethod
+    def _contact(row: dict) -> dict:
+        return {
+            "first_name": row["first_name"],
+            "last_name": row["last_name"],
+            "company": row["company"],
+            "notes": row.get("notes", "")
+        }
+
+    @staticmethod
+    def _unique(rows: list, fields: tuple) -> list:
+        #Identical duplicate rows are not ambiguous, only rows that differ in these fields
+        seen, unique = set(), []
+        for row in rows:
+            key = tuple(row.get(field, "") for field in fields)
+            if key not in seen:
+                seen.add(key)
+                unique.append(row)
+        return unique
+
+    def get_contact(self, first_name: str, last_name: str) -> dict:
+        rows = self._snapshot.contacts_by_name.get((normalize(first_name), normalize(last_name)), [])
+        matches = self._unique(rows, ("first_name", "last_name", "company", "notes"))
+        if not matches:
+            raise ValueError(f"Contact '{first_name} {last_name}' not found.")
+        if len(matches) > 1:
+            companies = ", ".join(row["company"] for row in matches)
+            raise AmbiguousMatchError(
+                f"Contact '{first_name} {last_name}' matches {len(matches)} rows ({companies})."
+            )
+        return self._contact(matches[0])
+
+    def get_contacts_by_company(self, company: str) -> list:
+        return [self._contact(row) for row in self._snapshot.contacts_by_company.get(normalize(company), [])]
+
+    def get_team_member(self, name: str) -> dict:
+        rows = self._snapshot.team_by_name.get(normalize(name), [])
+        matches = self._unique(rows, ("name", "email", "role"))
+        if not matches:
+            raise ValueError(f"Team member '{name}' not found.")
+        if len(matches) > 1:
+            candidates = ", ".join(f"{row['email']} ({row['role']})" for row in matches)
+            raise AmbiguousMatchError(f"Team member '{name}' matches {len(matches)} rows: {candidates}.")
+        row = matches[0]
+        return {
+            "name": row["name"],
+            "email": row["email"],
+            "role": row["role"]
+        }
@@ -0,0 +1,60 @@
+# Request-scoped deadlines
+# The orchestrator opens a deadline for every run. Outbound calls made inside it (rate limiter waits,
+# each attempt, retries) get at most the time that is left, and stages can ask what remains to shrink
+# their own budgets or skip optional work. The deadline lives in a context variable, so it follows a run
+# into its stage tasks and concurrent runs each see their own.
+
+import os
+import time
+from contextvars import ContextVar
+from contextlib import contextmanager
+
+#-------------  Deadline Configuration --------------
+#Seconds one outreach run may take end to end
+OUTREACH_DEADLINE = float(os.getenv("OUTREACH_DEADLINE", "60"))
+#---------------------------------------------
+
+#Absolute time.monotonic() the current run must finish by, None when no deadline is set
+_deadline = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(seconds: float = None):
+    #None leaves the current deadline as it is. A nested deadline can only tighten the outer one
+    if seconds is None:
+        yield
+        return
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    #Seconds left, negative once passed, None without a deadline
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def budget(default: float = None, what: str = "call"):
+    #The smaller of default and the time left, for use as a timeout. Raises once nothing is left
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded(f"Deadline passed before {what}")
+    return left if default is None else min(default, left)
+
+
+def require(seconds: float, what: str):
+    #For optional work: only start it with at least seconds left
+    left = remaining()
+    if left is not None and left < seconds:
+        raise DeadlineExceeded(f"Skipping {what}: {max(left, 0):.1f}s left of the deadline, {seconds:.0f}s needed")
@@ -1,52 +1,131 @@
+# Sends emails to team members through the Gmail API
+# Authentication and the Gmail client are set up on first send, not at construction, so the app
+# starts without touching the network or opening the OAuth browser flow. The Gmail API description
+# comes from the discovery document bundled with google-api-python-client instead of being fetched
+
 import os
+import json
 import base64
+import threading
 from email.mime.text import MIMEText
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from services.metrics import track_call, status_code, RATE_LIMITED
+from services.shared_state import file_lock, write_atomic
 
+#-------------  Gmail Configuration --------------
 # Only request permission to send email
 SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
+#Root URL of the Gmail API. Point it at a local stand-in (benchmarks/fake_servers.py) to send nothing
+#for real; a stand-in is called without OAuth
+GMAIL_ROOT_URL = os.getenv("GMAIL_ROOT_URL")
+#---------------------------------------------
 
 class EmailDeliveryService:
     def __init__(self):
-        self.service = self._authenticate()
+        self._service = None
+        self._lock = threading.Lock()
+        #The client shares one httplib2 connection, which is not thread-safe: one send at a time
+        self._send_lock = threading.Lock()
+
+    @property
+    def service(self):
+        #Sends run in worker threads, the lock makes sure only one of them authenticates
+        with self._lock:
+            if self._service is None:
+                self._service = self._authenticate()
+            return self._service
 
     def _authenticate(self):
-        creds = None
+        #Imported here, the Google client libraries add noticeably to import time
+        from googleapiclient.discovery import build_from_document
+        from googleapiclient.discovery_cache import get_static_doc
 
-        # Load existing token if it exists
-        if os.path.exists("token.json"):
-            creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+        #Bundled discovery document, no request to the discovery service
+        document = json.loads(get_static_doc("gmail", "v1"))
+        if GMAIL_ROOT_URL:
+            from google.auth.credentials import AnonymousCredentials
+            #rootUrl also decides where batch requests go, so both follow the override
+            document["rootUrl"] = GMAIL_ROOT_URL.rstrip("/") + "/"
+            return build_from_document(document, credentials=AnonymousCredentials())
 
-        # If no valid token, run the OAuth flow
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    "credentials.json", SCOPES
-                )
-                creds = flow.run_local_server(port=0)
+        return build_from_document(document, credentials=self._credentials())
 
-            # Save token for next time
-            with open("token.json", "w") as f:
-                f.write(creds.to_json())
+    @staticmethod
+    def _credentials():
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
 
-        return build("gmail", "v1", credentials=creds)
+        #Every worker process may refresh the token, the lock makes them take turns and the ones after
+        #the first find the refreshed token on disk instead of refreshing it again
+        with file_lock("token.json"):
+            creds = None
 
-    def send(self, to_email: str, subject: str, body: str) -> dict:
+            # Load existing token if it exists
+            if os.path.exists("token.json"):
+                creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+
+            # If no valid token, run the OAuth flow
+            if not creds or not creds.valid:
+                if creds and creds.expired and creds.refresh_token:
+                    creds.refresh(Request())
+                else:
+                    flow = InstalledAppFlow.from_client_secrets_file(
+                        "credentials.json", SCOPES
+                    )
+                    creds = flow.run_local_server(port=0)
+
+                # Save token for next time, never leaving a half-written file for another worker to read
+                write_atomic("token.json", creds.to_json())
+
+        return creds
+
+    @staticmethod
+    def _raw(to_email: str, subject: str, body: str) -> dict:
         message = MIMEText(body)
         message["to"] = to_email
         message["subject"] = subject
+        return {"raw": base64.urlsafe_b64encode(message.as_bytes()).decode()}
 
-        encoded = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        result = self.service.users().messages().send(
+    @staticmethod
+    def _result(result: dict) -> dict:
+        status = "delivered" if result.get("labelIds") and "SENT" in result["labelIds"] else "failed"
+        return {"message_id": result["id"], "status": status}
+
+    def send(self, to_email: str, subject: str, body: str) -> dict:
+        request = self.service.users().messages().send(
             userId="me",
-            body={"raw": encoded}
-        ).execute()
+            body=self._raw(to_email, subject, body)
+        )
+        try:
+            with self._send_lock, track_call("gmail", "send"):
+                result = request.execute()
+        except Exception as e:
+            if status_code(e) == 429:
+                RATE_LIMITED.inc(service="gmail")
+            raise
 
-        status = "delivered" if result.get("labelIds") and "SENT" in result["labelIds"] else "failed"
+        return self._result(result)
+
+    #Sends several emails in one HTTP request through Gmail's batch endpoint.
+    #messages is a list of dicts with to_email, subject and body. Returns one entry per message,
+    #in order: the send result, or the exception for that message. Transport errors raise
+    def send_batch(self, messages: list) -> list:
+        results = [None] * len(messages)
+
+        def callback(request_id, response, exception):
+            if exception is not None and status_code(exception) == 429:
+                RATE_LIMITED.inc(service="gmail")
+            results[int(request_id)] = exception if exception is not None else self._result(response)
 
-        return {"message_id": result["id"], "status": status}
\ No newline at end of file
+        batch = self.service.new_batch_http_request(callback=callback)
+        for i, message in enumerate(messages):
+            batch.add(
+                self.service.users().messages().send(
+                    userId="me",
+                    body=self._raw(message["to_email"], message["subject"], message["body"])
+                ),
+                request_id=str(i)
+            )
+        with self._send_lock, track_call("gmail", "send_batch"):
+            batch.execute()
+        return results
\ No newline at end of file
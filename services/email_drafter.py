@@ -1,54 +1,31 @@
-import os
+import re
 import json
-import anthropic
 import logging
 from dotenv import load_dotenv
+from services.llm import LLMClient, cached_system
 
 load_dotenv()
 
 
 logger = logging.getLogger(__name__)
 
-class EmailDraftService:
-
-    def __init__(self):
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        if not api_key:
-            raise ValueError("ANTHROPIC_API_KEY is not set in environment variables.")
-        self.client = anthropic.Anthropic(api_key=api_key)
-
-    def draft(self, contact: dict, research: dict, team_member: dict) -> dict:
-        logger.info(f"Drafting email for {contact['first_name']} {contact['last_name']}")
-        
-        prompt = f"""
-        You are writing a cold outreach email on behalf of {team_member['name']}, 
-        who works as {team_member['role']} at Kibo Ventures. Kibo Ventures is a European tech investment firm that backs founders with bold 
+#Identical for every draft, so it is sent as a cached system block.
+#Anything contact or team member specific belongs in the user message instead
+DRAFT_INSTRUCTIONS = """
+        You are writing cold outreach emails on behalf of team members at Kibo Ventures. 
+        Kibo Ventures is a European tech investment firm that backs founders with bold 
         ideas. They support them beyond capital, with guidance, expertise, and 
         international connections to help them scale.
-
-        OBJECTIVE:
-        Write a cold outreach email to {contact['first_name']} {contact['last_name']} 
-        at {contact['company']} to open a conversation about a potential investment 
-        or partnership with Kibo Ventures.
-
-        CONTEXT ABOUT THE CONTACT:
-        {research.get('validated_person', 'No information available.')}
-
-        RECENT ACTIVITY:
-        {research.get('validated_activity', 'No information available.')}
-
-        RECENT COMPANY NEWS:
-        {research.get('validated_company', 'No information available.')}
+        Each request names the team member and the contact, and gives validated research and internal notes.
 
         INTERNAL NOTES:
         Use these to personalize where natural and appropriate, 
         but do not reference them directly or make it obvious they came from internal notes. 
         Also only include information relevant to the context of the email,
         do not force including notes especially if they are arbitrary facts and are irrelevant to the proposition.
-        {contact['notes']}
 
         MUST INCLUDE:
-        - A brief, natural introduction of {team_member['name']} and their role at Kibo Ventures
+        - A brief, natural introduction of the team member and their role at Kibo Ventures
         - One sentence describing what Kibo Ventures does and who they back
         - A specific reference to something real about the contact. For example a project, publication, 
           competition, or initiative they are associated with (use the research context provided)
@@ -80,17 +57,116 @@ class EmailDraftService:
 
         FORMAT:
             Return a JSON object with exactly these two fields:
-            {{
+            {
                 "subject": "the subject line",
                 "body": "the full email body including sign off"
-            }}
+            }
             Return only the JSON object. No preamble, no markdown, no code blocks.
             """
 
-        message = self.client.messages.create(
-            model="claude-sonnet-4-6",
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}]
-        )
+class EmailDraftService:
+
+    def __init__(self, llm: LLMClient = None):
+        self.llm = llm or LLMClient()
 
-        return json.loads(message.content[0].text)
\ No newline at end of file
+    #on_body(text) switches to a streamed reply and receives the email body piece by piece as it is
+    #generated. The returned draft is parsed from the complete reply either way
+    async def draft(self, contact: dict, research: dict, team_member: dict, on_body=None) -> dict:
+        logger.info(f"Drafting email for {contact['first_name']} {contact['last_name']}")
+
+        params = self.build_request(contact, research, team_member)
+        if on_body is None:
+            message = await self.llm.create("Email draft", **params)
+        else:
+            message = await self.llm.stream("Email draft", BodyStream(on_body).feed, **params)
+
+        return self.parse(message.content[0].text)
+
+    #messages.create params for one draft. Shared by the interactive path and bulk (Message Batches) runs.
+    #The instructions are a static, cached system block; only the user message changes per contact
+    def build_request(self, contact: dict, research: dict, team_member: dict) -> dict:
+        prompt = f"""
+        You are writing a cold outreach email on behalf of {team_member['name']}, 
+        who works as {team_member['role']} at Kibo Ventures.
+
+        OBJECTIVE:
+        Write a cold outreach email to {contact['first_name']} {contact['last_name']} 
+        at {contact['company']} to open a conversation about a potential investment 
+        or partnership with Kibo Ventures.
+
+        CONTEXT ABOUT THE CONTACT:
+        {research.get('validated_person', 'No information available.')}
+
+        RECENT ACTIVITY:
+        {research.get('validated_activity', 'No information available.')}
+
+        RECENT COMPANY NEWS:
+        {research.get('validated_company', 'No information available.')}
+
+        INTERNAL NOTES:
+        {contact['notes']}
+        """
+
+        return {
+            "model": "claude-sonnet-4-6",
+            "max_tokens": 1024,
+            "system": cached_system(DRAFT_INSTRUCTIONS),
+            "messages": [{"role": "user", "content": prompt}]
+        }
+
+    @staticmethod
+    def parse(text: str) -> dict:
+        return json.loads(text)
+
+
+_BODY_START = re.compile(r'"body"\s*:\s*"')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class BodyStream:
+    #Pulls the decoded "body" string out of the draft JSON while it is still being generated.
+    #Chunks can end anywhere, including inside an escape sequence, so undecoded text is kept until complete
+
+    def __init__(self, on_body):
+        self.on_body = on_body
+        self.raw = ""
+        #Index in raw of the next undecoded body character, None until the body has started
+        self.position = None
+        self.finished = False
+
+    def feed(self, chunk: str):
+        if self.finished:
+            return
+        self.raw += chunk
+        if self.position is None:
+            match = _BODY_START.search(self.raw)
+            if match is None:
+                return
+            self.position = match.end()
+
+        decoded, i = [], self.position
+        while i < len(self.raw):
+            char = self.raw[i]
+            if char == '"':
+                self.finished = True
+                break
+            if char != "\\":
+                decoded.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(self.raw):
+                break
+            if self.raw[i + 1] != "u":
+                decoded.append(_ESCAPES.get(self.raw[i + 1], self.raw[i + 1]))
+                i += 2
+                continue
+            #\uXXXX, or a surrogate pair \uXXXX\uXXXX for characters outside the BMP
+            end = i + 12 if 0xD8 <= int(self.raw[i + 2:i + 4] or "0", 16) <= 0xDB else i + 6
+            if end > len(self.raw):
+                break
+            decoded.append(json.loads(f'"{self.raw[i:end]}"'))
+            i = end
+
+        self.position = i
+        if decoded:
+            self.on_body("".join(decoded))
@@ -0,0 +1,74 @@
+# Hedged requests: when a call has not answered by the time most calls have (the observed p95), a
+# duplicate is sent and whichever answers first is used. One slow server or connection then costs
+# about p95 instead of its full latency. Duplicates are capped at a fraction of all calls, so a slow
+# upstream is never hit with twice the load, and can be made to depend on spare rate limit quota.
+
+import time
+import math
+import asyncio
+import logging
+from collections import deque
+from services.metrics import HEDGED
+
+logger = logging.getLogger(__name__)
+
+#-------------  Hedging Configuration --------------
+#Latest successful call latencies the percentile is taken from
+HEDGE_WINDOW = 200
+#Below this many samples the default delay is used
+HEDGE_MIN_SAMPLES = 20
+HEDGE_PERCENTILE = 95
+#Seconds, hedges are never sent sooner than this
+HEDGE_MIN_DELAY = 0.1
+#At most this fraction of calls gets a duplicate
+HEDGE_BUDGET = 0.1
+#---------------------------------------------
+
+
+class Hedger:
+
+    def __init__(self, name: str, default_delay: float, admit=None):
+        #admit() is awaited before each duplicate is sent, e.g. to take a rate limit token without waiting
+        self.name = name
+        self.default_delay = default_delay
+        self.admit = admit
+        self.latencies = deque(maxlen=HEDGE_WINDOW)
+        self.calls = 0
+        self.hedges = 0
+
+    def delay(self) -> float:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return self.default_delay
+        ordered = sorted(self.latencies)
+        index = max(0, math.ceil(HEDGE_PERCENTILE / 100 * len(ordered)) - 1)
+        return max(HEDGE_MIN_DELAY, ordered[index])
+
+    async def call(self, fn):
+        #fn is a zero-argument coroutine function; it may be called twice, so it must be safe to repeat
+        self.calls += 1
+        start = time.perf_counter()
+        first = asyncio.ensure_future(fn())
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay())
+            if not done and self.hedges < HEDGE_BUDGET * self.calls and (self.admit is None or await self.admit()):
+                self.hedges += 1
+                HEDGED.inc(service=self.name, result="sent")
+                logger.info(f"{self.name} call slower than {self.delay():.2f}s, sending a hedged duplicate")
+                tasks.add(asyncio.ensure_future(fn()))
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.latencies.append(time.perf_counter() - start)
+                        if task is not first:
+                            HEDGED.inc(service=self.name, result="won")
+                        return task.result()
+                    error = error or task.exception()
+            #Both attempts failed
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,125 @@
+# Shared helpers for Anthropic calls made by the validator, drafter and strategy services
+# LLMClient is the single path for interactive messages.create calls, so cross-cutting behaviour
+# (coalescing of identical requests, per-model rate limiting and retries, usage logging) lives in one place.
+# The orchestrator builds one LLMClient and hands it to every service. The Anthropic SDK is imported
+# and its client created on first use, so importing and starting the app stays fast
+
+import os
+import json
+import hashlib
+import logging
+from dotenv import load_dotenv
+from services.single_flight import SingleFlight
+from services.metrics import track_call, record_tokens
+from services.rate_limit import upstream
+from services import cassette
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class LLMClient:
+
+    def __init__(self):
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        #Replayed runs never reach Anthropic
+        if not api_key and cassette.CASSETTE_MODE == "replay":
+            api_key = "replay"
+        if not api_key:
+            raise ValueError("ANTHROPIC_API_KEY is not set in environment variables.")
+        self._api_key = api_key
+        self._client = None
+        self.flight = SingleFlight("anthropic")
+
+
+    @property
+    def client(self):
+        #Single AsyncAnthropic (one connection pool) for interactive and batch calls
+        if self._client is None:
+            import anthropic
+            #SDK retries are off: services.rate_limit retries against the shared per-model buckets,
+            #so concurrent runs back off together instead of each retrying on its own
+            #With CASSETTE_MODE set, requests are recorded or replayed at the HTTP transport
+            transport = cassette.transport("anthropic", anthropic.DEFAULT_CONNECTION_LIMITS)
+            self._client = anthropic.AsyncAnthropic(
+                api_key=self._api_key,
+                max_retries=0,
+                http_client=anthropic.DefaultAsyncHttpxClient(transport=transport) if transport else None
+            )
+        return self._client
+
+
+    async def create(self, label: str, **params):
+        #Identical params (same model, prompt and limits) share one in-flight call
+        key = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+        async def attempt():
+            async with track_call("anthropic", label):
+                return await self.client.messages.create(**params)
+
+        async def call():
+            message = await upstream(f"anthropic:{params['model']}").call(attempt)
+            log_usage(label, message)
+            return message
+
+        return await self.flight.do(key, call)
+
+
+    async def stream(self, label: str, on_text, **params):
+        #Streams the reply, calling on_text(chunk) for every text delta, and returns the final message.
+        #Not coalesced: every caller wants its own deltas as they arrive
+        emitted = False
+
+        async def attempt():
+            nonlocal emitted
+            try:
+                async with track_call("anthropic", label):
+                    async with self.client.messages.stream(**params) as stream:
+                        async for text in stream.text_stream:
+                            emitted = True
+                            on_text(text)
+                        return await stream.get_final_message()
+            except Exception as e:
+                #A retry would send the caller the same text twice, so only retry before the first delta
+                if emitted:
+                    raise RuntimeError(f"{label} stream interrupted: {e}") from e
+                raise
+
+        message = await upstream(f"anthropic:{params['model']}").call(attempt)
+        log_usage(label, message)
+        return message
+
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+def cached_system(text: str) -> list:
+    #Static instructions as a system block marked for prompt caching. Requests that share this
+    #exact prefix read it from the cache instead of paying full input price for it again.
+    #Anthropic only caches prefixes above a minimum size (1024 tokens for Sonnet); shorter
+    #blocks are accepted but not cached, which shows up as zero cache tokens in the usage log
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+
+def usage_counts(usage) -> dict:
+    #Token counts from message.usage. Cache fields are None when caching was not involved
+    return {
+        "input": usage.input_tokens or 0,
+        "output": usage.output_tokens or 0,
+        "cache_write": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        "cache_read": getattr(usage, "cache_read_input_tokens", None) or 0
+    }
+
+
+def log_usage(label: str, message):
+    counts = usage_counts(message.usage)
+    logger.info(
+        f"{label} ({message.model}) tokens: input {counts['input']}, output {counts['output']}, "
+        f"cache write {counts['cache_write']}, cache read {counts['cache_read']}"
+    )
+    record_tokens(message.model, counts)
+    return counts
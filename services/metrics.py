@@ -0,0 +1,220 @@
+# In-process metrics in the Prometheus text format, served on GET /metrics
+# A small registry of counters, gauges and histograms with labels, so no extra dependency is needed.
+# Safe to update from the event loop and from worker threads (Gmail sends run in the thread pool).
+# Every metric this app records is defined at the bottom of this module.
+
+import time
+import bisect
+import threading
+
+#Seconds. Covers sub-millisecond cache hits up to multi-minute LLM and batch calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "Registry", name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = registry.lock
+        registry.metrics.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _label_text(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key: tuple, value) -> list:
+        return [f"{self.name}{self._label_text(key)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: "Registry", name: str, help_text: str, labels: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            #[per-bucket counts, sum, count]; values above the last bucket only show in +Inf
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _render_value(self, key: tuple, value) -> list:
+        counts, total, observed = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            le = f'le="{_number(bound)}"'
+            lines.append(f"{self.name}_bucket{self._label_text(key, le)} {cumulative}")
+        le = 'le="+Inf"'
+        lines.append(f"{self.name}_bucket{self._label_text(key, le)} {observed}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {_number(total)}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {observed}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def status_code(error: BaseException):
+    #HTTP status behind an exception from httpx, the Anthropic SDK or googleapiclient, if any
+    code = getattr(error, "status_code", None)
+    if code is None:
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    if code is None:
+        code = getattr(getattr(error, "resp", None), "status", None)
+    return int(code) if code is not None else None
+
+
+class track_call:
+    #Times one outbound call and keeps the in-flight gauge. Works with "with" and "async with":
+    #   async with track_call("exa", "search"):
+    #       ...
+
+    def __init__(self, service: str, operation: str):
+        self.service = service
+        self.operation = operation
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        EXTERNAL_IN_FLIGHT.inc(service=self.service)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        EXTERNAL_IN_FLIGHT.dec(service=self.service)
+        if exc is None:
+            outcome = "ok"
+        elif status_code(exc) == 429:
+            #RATE_LIMITED is counted where each 429 response is seen, this call may span several
+            outcome = "rate_limited"
+        else:
+            outcome = "error"
+        EXTERNAL_DURATION.observe(
+            time.perf_counter() - self.start, service=self.service, operation=self.operation, outcome=outcome
+        )
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def record_tokens(model: str, counts: dict, mode: str = "interactive"):
+    #counts as returned by services.llm.usage_counts. mode is interactive or batch (billed at half price)
+    for kind, amount in counts.items():
+        if amount:
+            LLM_TOKENS.inc(amount, model=model, type=kind, mode=mode)
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = Histogram(
+    REGISTRY, "outreach_stage_duration_seconds", "Pipeline stage run time", ("stage", "status")
+)
+STAGES_IN_FLIGHT = Gauge(REGISTRY, "outreach_stages_in_flight", "Pipeline stages currently running", ("stage",))
+EXTERNAL_DURATION = Histogram(
+    REGISTRY, "outreach_external_request_duration_seconds",
+    "Outbound Exa, Anthropic and Gmail call time", ("service", "operation", "outcome")
+)
+EXTERNAL_IN_FLIGHT = Gauge(
+    REGISTRY, "outreach_external_requests_in_flight", "Outbound calls currently waiting on a reply", ("service",)
+)
+RETRIES = Counter(REGISTRY, "outreach_external_retries_total", "Outbound calls sent again after a failure", ("service",))
+RATE_LIMITED = Counter(
+    REGISTRY, "outreach_external_rate_limited_total", "Outbound calls answered with HTTP 429", ("service",)
+)
+RATE_LIMIT_WAIT = Histogram(
+    REGISTRY, "outreach_rate_limit_wait_seconds", "Time outbound calls waited for a rate limit token", ("service",)
+)
+CIRCUIT_OPEN = Gauge(
+    REGISTRY, "outreach_circuit_open", "1 while calls to an upstream fail fast after repeated errors", ("service",)
+)
+HEDGED = Counter(
+    REGISTRY, "outreach_hedged_requests_total",
+    "Duplicates sent for calls slower than the observed p95 (sent), and how often a duplicate answered first (won)",
+    ("service", "result")
+)
+COALESCED = Counter(
+    REGISTRY, "outreach_coalesced_calls_total", "Calls that joined an identical call already in flight", ("service",)
+)
+RESEARCH_CACHE = Counter(REGISTRY, "outreach_research_cache_total", "Research cache lookups", ("result",))
+VALIDATION_CACHE = Counter(
+    REGISTRY, "outreach_validation_cache_total", "Validated research section cache lookups", ("result",)
+)
+LLM_TOKENS = Counter(
+    REGISTRY, "outreach_llm_tokens_total",
+    "Anthropic tokens by model, type (input, output, cache_write, cache_read) and mode (interactive, batch)",
+    ("model", "type", "mode")
+)
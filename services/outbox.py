@@ -0,0 +1,368 @@
+# Durable outbox for outgoing emails
+# The pipeline enqueues messages in SQLite and returns without waiting for Gmail. A background sender
+# drains the outbox through Gmail's batch endpoint (many sends per HTTP request), retries failures
+# with exponential backoff, and deduplicates by message hash, so a retried or resumed pipeline never
+# emails the team member twice. Sent and failed messages are kept for OUTBOX_RETENTION and then purged;
+# an identical message is only held back while the first is queued or was sent within that window.
+# Messages being sent are leased to one sender. Senders in other worker processes only take them over
+# once the lease has run out, i.e. the sender holding it stopped renewing it.
+
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import threading
+from googleapiclient.errors import HttpError
+from services.email_delivery import EmailDeliveryService
+from services.metrics import RETRIES
+from services.rate_limit import upstream, retry_after, CircuitOpenError
+from services.shared_state import connect
+
+logger = logging.getLogger(__name__)
+
+#-------------  Outbox Configuration --------------
+OUTBOX_DB_PATH = os.getenv("OUTBOX_DB_PATH", "cache/outbox.db")
+#Gmail accepts up to 100 calls per batch but recommends no more than 50
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 5
+#Seconds before the first retry, doubled on every further attempt
+OUTBOX_RETRY_DELAY = 30.0
+#Seconds an idle sender waits before checking for due retries
+OUTBOX_POLL_INTERVAL = 5.0
+#Seconds a claimed batch stays with its sender without renewal. Renewed every quarter lease while sending
+OUTBOX_LEASE = 120.0
+#Seconds sent and failed messages are kept, and the window in which an identical message is not sent again
+OUTBOX_RETENTION = 7 * 24 * 3600
+#Seconds between purges of messages older than the retention window
+OUTBOX_PURGE_INTERVAL = 3600.0
+#Seconds stop() waits for a batch in flight to be sent and recorded before cutting it off
+OUTBOX_STOP_TIMEOUT = 30.0
+#---------------------------------------------
+
+
+def message_hash(to_email: str, subject: str, body: str) -> str:
+    return hashlib.sha256("\x1f".join((to_email, subject, body)).encode("utf-8")).hexdigest()
+
+
+class Outbox:
+
+    def __init__(self, gmail: EmailDeliveryService, path: str = OUTBOX_DB_PATH):
+        self.gmail = gmail
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    hash TEXT NOT NULL,
+                    to_email TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    message_id TEXT,
+                    error TEXT,
+                    owner TEXT,
+                    lease_until REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            #Outboxes created before leases existed
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+            for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {kind}")
+            self._drop_unique_hash()
+            self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_hash ON outbox (hash)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_updated ON outbox (updated_at)")
+        #Identifies this sender's leases, unique per process and instance
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wakeup = None
+        self._task = None
+        self._purged_at = 0.0
+        #One batch at a time per outbox, the background sender and flush() take turns
+        self._draining = asyncio.Lock()
+
+
+    def _drop_unique_hash(self):
+        #Outboxes created when every hash had to be unique forever: rebuilt without the constraint
+        unique = any(
+            row[2] and [column[2] for column in self._conn.execute(f"PRAGMA index_info('{row[1]}')")] == ["hash"]
+            for row in self._conn.execute("PRAGMA index_list(outbox)")
+        )
+        if not unique:
+            return
+        sql = self._conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'outbox'").fetchone()[0]
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(sql.replace("outbox", "outbox_rebuilt", 1).replace("hash TEXT NOT NULL UNIQUE", "hash TEXT NOT NULL"))
+            self._conn.execute("INSERT INTO outbox_rebuilt SELECT * FROM outbox")
+            self._conn.execute("DROP TABLE outbox")
+            self._conn.execute("ALTER TABLE outbox_rebuilt RENAME TO outbox")
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        logger.info("Outbox table rebuilt without the permanent unique hash")
+
+
+    # ---------- Store ----------
+
+    def enqueue(self, to_email: str, subject: str, body: str) -> dict:
+        digest = message_hash(to_email, subject, body)
+        now = time.time()
+        with self._lock:
+            #The same message enqueued twice (retried request, resumed job) is stored and sent once, as long
+            #as the first is still queued or was sent within the retention window. After a permanent
+            #failure it can be queued again
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, status FROM outbox WHERE hash = ? AND (status IN ('pending', 'sending') "
+                    "OR (status = 'sent' AND updated_at > ?)) ORDER BY id DESC LIMIT 1",
+                    (digest, now - OUTBOX_RETENTION)
+                ).fetchone()
+                if row is None:
+                    cursor = self._conn.execute(
+                        "INSERT INTO outbox (hash, to_email, subject, body, status, next_attempt_at, "
+                        "created_at, updated_at) VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)",
+                        (digest, to_email, subject, body, now, now, now)
+                    )
+                    row = (cursor.lastrowid, "pending")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if self._wakeup:
+            self._wakeup.set()
+        status = "queued" if row[1] in ("pending", "sending") else row[1]
+        return {"outbox_id": row[0], "status": status}
+
+
+    def status(self, outbox_id: int):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, attempts, message_id, error FROM outbox WHERE id = ?", (outbox_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"status": row[0], "attempts": row[1], "message_id": row[2], "error": row[3]}
+
+
+    def _claim(self) -> list:
+        #Due messages, and messages whose sender stopped renewing its lease (a crashed or killed
+        #worker). Those may have gone out already, they are sent again (at-least-once delivery)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, to_email, subject, body, attempts, status FROM outbox "
+                    "WHERE (status = 'pending' AND next_attempt_at <= ?) "
+                    "OR (status = 'sending' AND COALESCE(lease_until, 0) <= ?) ORDER BY id LIMIT ?",
+                    (now, now, OUTBOX_BATCH_SIZE)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE outbox SET status = 'sending', owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                    [(self.owner, now + OUTBOX_LEASE, now, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        abandoned = sum(1 for row in rows if row[5] == "sending")
+        if abandoned:
+            logger.warning(f"Outbox took over {abandoned} messages whose sender's lease ran out")
+        return rows
+
+
+    def _renew(self, rows: list):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'sending'",
+                [(time.time() + OUTBOX_LEASE, row[0], self.owner) for row in rows]
+            )
+
+
+    async def _heartbeat(self, rows: list):
+        #Keeps the lease on a batch while it is being sent, however long Gmail or the rate limiter take
+        while True:
+            await asyncio.sleep(OUTBOX_LEASE / 4)
+            self._renew(rows)
+
+
+    def _record(self, row: tuple, outcome):
+        outbox_id, attempts = row[0], row[4] + 1
+        now = time.time()
+        with self._lock:
+            if isinstance(outcome, dict) and outcome.get("status") == "delivered":
+                self._conn.execute(
+                    "UPDATE outbox SET status = 'sent', attempts = ?, message_id = ?, error = NULL, "
+                    "owner = NULL, lease_until = NULL, updated_at = ? WHERE id = ?",
+                    (attempts, outcome["message_id"], now, outbox_id)
+                )
+                return
+
+            error = str(outcome) if isinstance(outcome, Exception) else f"Gmail returned {outcome}"
+            #Client errors (bad address, malformed message) will not succeed on retry, rate limits will
+            permanent = (isinstance(outcome, HttpError) and 400 <= outcome.resp.status < 500
+                         and outcome.resp.status != 429)
+            if permanent or attempts >= OUTBOX_MAX_ATTEMPTS:
+                logger.error(f"Outbox message {outbox_id} to {row[1]} failed permanently: {error}")
+                self._conn.execute(
+                    "UPDATE outbox SET status = 'failed', attempts = ?, error = ?, owner = NULL, lease_until = NULL, "
+                    "updated_at = ? WHERE id = ? AND owner = ?",
+                    (attempts, error, now, outbox_id, self.owner)
+                )
+            else:
+                delay = OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+                RETRIES.inc(service="gmail")
+                logger.warning(f"Outbox message {outbox_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+                self._conn.execute(
+                    "UPDATE outbox SET status = 'pending', attempts = ?, error = ?, next_attempt_at = ?, "
+                    "owner = NULL, lease_until = NULL, updated_at = ? WHERE id = ? AND owner = ?",
+                    (attempts, error, now + delay, now, outbox_id, self.owner)
+                )
+
+
+    def _release(self, rows: list):
+        #Back to pending without spending an attempt, nothing was sent
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'pending', owner = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND owner = ?",
+                [(time.time(), row[0], self.owner) for row in rows]
+            )
+
+
+    def purge(self, retention: float = OUTBOX_RETENTION) -> int:
+        #Sent and failed messages (full email bodies) are not kept forever
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND updated_at <= ?",
+                (time.time() - retention,)
+            )
+        self._purged_at = time.monotonic()
+        if cursor.rowcount:
+            logger.info(f"Outbox purged {cursor.rowcount} messages older than the retention window")
+        return cursor.rowcount
+
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')"
+            ).fetchone()[0]
+
+
+    # ---------- Sender ----------
+
+    def start(self):
+        #Messages another worker is sending are left alone, _claim takes over only expired leases
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="outbox-sender")
+
+
+    async def stop(self):
+        await self._stop_sender()
+        with self._lock:
+            #A batch cut off mid-send is unknown to have gone out, any sender may retry it straight away
+            self._conn.execute(
+                "UPDATE outbox SET lease_until = 0 WHERE owner = ? AND status = 'sending'", (self.owner,)
+            )
+            self._conn.close()
+
+
+    async def _stop_sender(self):
+        #Lets a batch in flight finish and be recorded first, a batch cut off mid-send would go out again
+        if not self._task:
+            return
+        try:
+            await asyncio.wait_for(self._draining.acquire(), OUTBOX_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Outbox batch still in flight after {OUTBOX_STOP_TIMEOUT:.0f}s, stopping the sender anyway")
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        else:
+            try:
+                self._task.cancel()
+                await asyncio.gather(self._task, return_exceptions=True)
+            finally:
+                self._draining.release()
+        self._task = None
+
+
+    async def flush(self, timeout: float = 60.0) -> bool:
+        #Waits until nothing is waiting to be sent right now, used before a CLI run exits.
+        #The background sender is stopped first, so no batch of it is still in flight when this returns
+        await self._stop_sender()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            sent = await self.drain_once()
+            if not sent:
+                return self.pending() == 0
+        return False
+
+
+    async def _run(self):
+        while True:
+            try:
+                sent = await self.drain_once()
+            except Exception as e:
+                logger.error(f"Outbox sender error: {e}", exc_info=True)
+                sent = 0
+            if sent:
+                continue
+            if time.monotonic() - self._purged_at >= OUTBOX_PURGE_INTERVAL:
+                try:
+                    self.purge()
+                except Exception as e:
+                    logger.error(f"Outbox purge failed: {e}", exc_info=True)
+            self._wakeup.clear()
+            #asyncio.wait rather than wait_for: wait_for can swallow a stop() cancel that lands
+            #just as the event is set, leaving the sender running
+            waiter = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait({waiter}, timeout=OUTBOX_POLL_INTERVAL)
+            finally:
+                waiter.cancel()
+
+
+    async def drain_once(self) -> int:
+        #Sends one batch of due messages and returns how many were attempted
+        async with self._draining:
+            return await self._drain()
+
+
+    async def _drain(self) -> int:
+        rows = self._claim()
+        if not rows:
+            return 0
+        messages = [{"to_email": row[1], "subject": row[2], "body": row[3]} for row in rows]
+        gmail = upstream("gmail")
+        heartbeat = asyncio.create_task(self._heartbeat(rows))
+        try:
+            #Every message in the batch counts against the Gmail send quota
+            outcomes = await gmail.call(lambda: asyncio.to_thread(self.gmail.send_batch, messages), cost=len(rows))
+        except CircuitOpenError as e:
+            logger.warning(f"Outbox holding {len(rows)} messages: {e}")
+            self._release(rows)
+            return 0
+        except Exception as e:
+            #Transport failure: nothing in this batch is known to be sent, all of it is retried
+            outcomes = [e] * len(rows)
+        finally:
+            heartbeat.cancel()
+        limited = [o for o in outcomes if isinstance(o, HttpError) and o.resp.status == 429]
+        if limited:
+            #Single sends were throttled inside a successful batch: slow the next batches down too
+            await gmail.throttled(retry_after(limited[0]))
+        for row, outcome in zip(rows, outcomes):
+            self._record(row, outcome if outcome is not None else RuntimeError("No response in batch"))
+        logger.info(f"Outbox sent batch of {len(rows)} messages")
+        return len(rows)
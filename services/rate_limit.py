@@ -0,0 +1,354 @@
+# Shared rate limiting, retries and circuit breaking for outbound APIs
+# Every call to an upstream (Exa, each Anthropic model, Gmail) goes through that upstream's single
+# Upstream object, so all concurrent pipelines draw from one token bucket sized to our quota instead
+# of each hitting the limit on its own. On a 429 the bucket pauses for Retry-After and halves its rate,
+# then recovers gradually as calls succeed. Transient failures are retried with jittered exponential
+# backoff, and a circuit breaker fails fast while an upstream keeps erroring. Inside a request deadline
+# (services.deadline) waits, attempts and retries only get the time that is left.
+# With shared state enabled (services.shared_state) the buckets live in a SQLite file, so every worker
+# process on the host draws from the same quota. Circuit breakers stay per process. Their write
+# transactions run in a thread, so waiting for another worker's lock never blocks the event loop.
+
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+from contextlib import contextmanager, nullcontext
+from email.utils import parsedate_to_datetime
+import httpx
+from services.metrics import (status_code, RETRIES, RATE_LIMITED, RATE_LIMIT_WAIT, CIRCUIT_OPEN)
+from services.deadline import remaining, DeadlineExceeded
+from services import cassette
+from services.shared_state import shared, SharedState
+
+logger = logging.getLogger(__name__)
+
+#-------------  Rate Limit Configuration --------------
+#Sustained rate and burst per upstream. Set these to the account's quotas
+EXA_REQUESTS_PER_SECOND = float(os.getenv("EXA_REQUESTS_PER_SECOND", "5"))
+EXA_BURST = 5
+#Anthropic limits each model separately, so every model gets its own bucket
+ANTHROPIC_REQUESTS_PER_MINUTE = float(os.getenv("ANTHROPIC_REQUESTS_PER_MINUTE", "1000"))
+ANTHROPIC_BURST = 20
+#Each Gmail send costs 100 of the 250 quota units a user gets per second
+GMAIL_SENDS_PER_SECOND = float(os.getenv("GMAIL_SENDS_PER_SECOND", "2"))
+GMAIL_BURST = 50
+#Attempts per call, including the first
+MAX_ATTEMPTS = 4
+#Seconds. Backoff is drawn uniformly from 0 to base * 2^(attempt - 1), capped
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+#Longest Retry-After honoured inside a request, in seconds
+RETRY_AFTER_CAP = 60.0
+#After a 429 the rate is halved, but never below this fraction of the configured rate
+MIN_RATE_FRACTION = 0.1
+#Consecutive failures that open the circuit, and seconds before a trial call is let through
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30.0
+#Requests per second for every upstream while replaying a cassette at zero latency: no quota is
+#spent, so the limits would only stretch a profiling run
+REPLAY_RATE = 1e6
+#---------------------------------------------
+
+#Statuses worth retrying: timeouts, conflicts, rate limits, server errors and Anthropic overload (529)
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    #Callers reserve tokens up front and sleep until their reservation is covered, so waiters are
+    #served in arrival order and nobody polls. rate changes at runtime (see throttle and recover).
+    #Every change of tokens, updated and rate happens inside _state(), which SharedTokenBucket uses
+    #to load and store them
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, rate: float, burst: float):
+        self.ceiling = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        #Time the tokens were last brought up to date; in the future while paused
+        self.updated = self.clock()
+
+    def _state(self):
+        return nullcontext()
+
+    async def _offload(self, fn, *args):
+        #Runs fn, one of the methods below, from the event loop. In memory it is quick enough to call inline
+        return fn(*args)
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def _reserve(self, cost: float, max_wait: float = None) -> float:
+        with self._state():
+            now = self.clock()
+            self._refill(now)
+            wait = max(0.0, self.updated - now) + max(0.0, cost - self.tokens) / self.rate
+            if max_wait is not None and wait > max_wait:
+                raise DeadlineExceeded(f"Rate limit wait of {wait:.1f}s is longer than the {max(max_wait, 0):.1f}s left")
+            self.tokens -= cost
+        return wait
+
+    def _give_back(self, cost: float):
+        with self._state():
+            self.tokens += cost
+
+    async def acquire(self, cost: float = 1.0, max_wait: float = None) -> float:
+        #Returns the seconds spent waiting. Gives the tokens back and raises if the wait exceeds max_wait
+        wait = await self._offload(self._reserve, cost, max_wait)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                await self._offload(self._give_back, cost)
+                raise
+        return wait
+
+    def try_acquire(self, cost: float = 1.0) -> bool:
+        #Takes the tokens only if they are available right now, for work that can be skipped
+        with self._state():
+            now = self.clock()
+            self._refill(now)
+            if now < self.updated or self.tokens < cost:
+                return False
+            self.tokens -= cost
+            return True
+
+    async def try_acquire_async(self, cost: float = 1.0) -> bool:
+        #try_acquire for callers on the event loop
+        return await self._offload(self.try_acquire, cost)
+
+    def throttle(self, pause: float):
+        #Upstream said slow down: nothing is handed out for pause seconds, then at half the rate.
+        #Calls that were in flight together tend to get their 429s together; that halves the rate once
+        with self._state():
+            now = self.clock()
+            if now >= self.updated:
+                self._refill(now)
+                self.rate = max(self.ceiling * MIN_RATE_FRACTION, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = max(self.updated, now + pause)
+
+    def recover(self):
+        #Additive increase, back to the configured rate after a run of successes
+        with self._state():
+            self.rate = min(self.ceiling, self.rate + self.ceiling / 20)
+
+
+class SharedTokenBucket(TokenBucket):
+    #One bucket for every process using the same shared state file. Each change is a short write
+    #transaction: load the bucket, apply the change, store it. Wall-clock time, so all processes agree
+    clock = staticmethod(time.time)
+
+    def __init__(self, state: SharedState, name: str, rate: float, burst: float):
+        super().__init__(rate, burst)
+        self.shared = state
+        self.name = name
+
+    async def _offload(self, fn, *args):
+        #A transaction may wait up to the busy timeout for another process, the event loop must not
+        return await asyncio.to_thread(fn, *args)
+
+    @contextmanager
+    def _state(self):
+        with self.shared.transaction() as conn:
+            row = conn.execute("SELECT tokens, updated, rate FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            if row is not None:
+                self.tokens, self.updated, self.rate = row
+                #The configured limits may have changed since the row was written
+                self.tokens = min(self.tokens, self.burst)
+                self.rate = min(self.rate, self.ceiling)
+            yield
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated, rate) VALUES (?, ?, ?, ?)",
+                (self.name, self.tokens, self.updated, self.rate)
+            )
+
+
+class CircuitBreaker:
+
+    def __init__(self, name: str, threshold: int = BREAKER_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        #Half open: one trial call is in flight and decides whether the circuit closes again
+        self.trial = False
+
+    def check(self):
+        if self.opened_at is None:
+            return
+        remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+        if remaining > 0 or self.trial:
+            raise CircuitOpenError(f"{self.name} is unavailable, circuit open for another {max(remaining, 0):.0f}s")
+        self.trial = True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info(f"Circuit for {self.name} closed")
+            CIRCUIT_OPEN.dec(service=self.name)
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial or (self.opened_at is None and self.failures >= self.threshold):
+            if self.opened_at is None:
+                CIRCUIT_OPEN.inc(service=self.name)
+            logger.warning(f"Circuit for {self.name} opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+            self.trial = False
+
+    def release(self):
+        #The trial call was cancelled before it could tell us anything
+        self.trial = False
+
+
+class Upstream:
+
+    def __init__(self, name: str, rate: float, burst: float, max_attempts: int = MAX_ATTEMPTS,
+                 state: SharedState = None):
+        self.name = name
+        self.bucket = SharedTokenBucket(state, name, rate, burst) if state is not None else TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(name)
+        self.max_attempts = max_attempts
+
+    async def call(self, fn, cost: float = 1.0):
+        #fn is a zero-argument coroutine function making one attempt. cost is in bucket tokens
+        for attempt in range(1, self.max_attempts + 1):
+            self.breaker.check()
+            try:
+                waited = await self.bucket.acquire(cost, max_wait=remaining())
+            except BaseException:
+                #A trial call that never reached the upstream must not keep the circuit half open
+                self.breaker.release()
+                raise
+            if waited:
+                RATE_LIMIT_WAIT.observe(waited, service=self.name)
+            try:
+                result = await self._attempt(fn)
+            except DeadlineExceeded:
+                #Says nothing about the upstream's health
+                self.breaker.release()
+                raise
+            except Exception as e:
+                status = status_code(e)
+                if not is_transient(e, status):
+                    #The upstream answered, the request itself was wrong
+                    self.breaker.record_success()
+                    raise
+                delay = retry_after(e)
+                if status == 429:
+                    #Alive but throttling us: slow everyone down, the breaker is for outages
+                    RATE_LIMITED.inc(service=self.name)
+                    await self.throttled(delay)
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                if attempt == self.max_attempts:
+                    raise
+                wait = delay if delay is not None else backoff(attempt)
+                left = remaining()
+                if left is not None and wait >= left:
+                    #The retry could not finish in time anyway
+                    raise
+                RETRIES.inc(service=self.name)
+                logger.warning(f"{self.name} call failed ({status or type(e).__name__}), "
+                               f"attempt {attempt} of {self.max_attempts}, retrying in {wait:.1f}s")
+                await asyncio.sleep(wait)
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.record_success()
+                await self.bucket._offload(self.bucket.recover)
+                return result
+
+    async def _attempt(self, fn):
+        left = remaining()
+        if left is None:
+            return await fn()
+        if left <= 0:
+            raise DeadlineExceeded(f"Deadline passed before calling {self.name}")
+        try:
+            return await asyncio.wait_for(fn(), timeout=left)
+        except asyncio.TimeoutError:
+            if remaining() > 0:
+                #A timeout from inside the call itself, not ours
+                raise
+            raise DeadlineExceeded(f"{self.name} call ran past the request deadline")
+
+    async def throttled(self, delay: float = None):
+        #Also used for 429s seen outside call(), e.g. single messages in a Gmail batch
+        await self.bucket._offload(self.bucket.throttle, delay if delay is not None else backoff(1))
+
+
+def is_transient(error: Exception, status: int = None) -> bool:
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    #Connection and timeout errors of the Anthropic SDK, if it has been imported
+    anthropic = sys.modules.get("anthropic")
+    return anthropic is not None and isinstance(error, anthropic.APIConnectionError)
+
+
+def retry_after(error: Exception):
+    #Seconds from a Retry-After header (delta seconds or HTTP date), capped; None if absent
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is None:
+        #googleapiclient: resp is a dict of lower-cased headers
+        headers = getattr(error, "resp", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), RETRY_AFTER_CAP)
+
+
+def backoff(attempt: int) -> float:
+    #Full jitter, so callers that failed together do not retry together
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+_upstreams = {}
+
+
+def upstream(name: str) -> Upstream:
+    #"exa", "gmail", or "anthropic:<model>". One shared instance per name in this process
+    if name not in _upstreams:
+        max_attempts = MAX_ATTEMPTS
+        if name == "exa":
+            rate, burst = EXA_REQUESTS_PER_SECOND, EXA_BURST
+        elif name == "gmail":
+            rate, burst = GMAIL_SENDS_PER_SECOND, GMAIL_BURST
+            #The outbox retries failed sends durably, so a batch is attempted once here
+            max_attempts = 1
+        elif name.startswith("anthropic"):
+            rate, burst = ANTHROPIC_REQUESTS_PER_MINUTE / 60, ANTHROPIC_BURST
+        else:
+            raise ValueError(f"Unknown upstream '{name}'")
+        state = shared()
+        if cassette.CASSETTE_MODE == "replay":
+            #Replays spend no quota, they must not use up the live buckets either
+            state = None
+            if cassette.CASSETTE_LATENCY == "zero":
+                rate, burst = REPLAY_RATE, REPLAY_RATE
+        _upstreams[name] = Upstream(name, rate, burst, max_attempts, state)
+    return _upstreams[name]
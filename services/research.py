@@ -1,18 +1,40 @@
+import asyncio
 import httpx
 import os
 from dotenv import load_dotenv
 import logging
-import time
+from services.cache import DiskCache
+from services.research_ranker import rank_and_pack
+from services.single_flight import SingleFlight
+from services.metrics import track_call, RESEARCH_CACHE
+from services.rate_limit import upstream
+from services.deadline import budget
+from services.hedge import Hedger
+from services import cassette
+from services.shared_state import shared
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
 #-------------  Exa Configuration --------------
-EXA_URL = "https://api.exa.ai/search"
+#Overridable so runs can point at a local stand-in (benchmarks/fake_servers.py)
+EXA_URL = os.getenv("EXA_URL", "https://api.exa.ai/search")
 EXA_TIMEOUT = 10.0
+#Seconds before a search is hedged while too few latencies have been seen to know the p95
+EXA_HEDGE_DEFAULT_DELAY = 2.0
+#Seconds other workers wait on a worker making the same search before trying it themselves
+EXA_CLAIM_TTL = 60.0
+#Pooled connections shared by every query, so each search reuses an open TLS connection
+EXA_MAX_CONNECTIONS = 20
+EXA_MAX_KEEPALIVE = 10
 EXA_MAX_CHARACTERS = 3000
 EXA_INCLUDE_HTML = False
+#Characters of ranked, deduplicated text passed on to validation per section
+PERSON_CONTEXT_BUDGET = 8000
+ACTIVITY_CONTEXT_BUDGET = 5000
+COMPANY_CONTEXT_BUDGET = 8000
+STRATEGY_CONTEXT_BUDGET = 2400
 #Web results per category and instance
 EXA_PERSON_RESULTS = 5
 EXA_ACTIVITY_RESULTS = 3
@@ -46,6 +68,22 @@ EXA_COMPANY_DOMAINS = None
 '''
 #---------------------------------------------
 
+#-------------  Research Cache --------------
+#Identical queries are answered from disk until their category TTL runs out
+RESEARCH_CACHE_PATH = os.getenv("RESEARCH_CACHE_PATH", "cache/research.db")
+RESEARCH_CACHE_MAX_ENTRIES = 5000
+#Seconds. Company news goes stale faster than a person's background
+RESEARCH_CACHE_TTLS = {
+    "person": 7 * 24 * 3600,
+    "linkedin": 7 * 24 * 3600,
+    "activity": 24 * 3600,
+    "company": 12 * 3600,
+    "events": 24 * 3600,
+    "content": 24 * 3600
+}
+RESEARCH_CACHE_DEFAULT_TTL = 24 * 3600
+#---------------------------------------------
+
 
 class ResearchService:
     
@@ -53,13 +91,81 @@ class ResearchService:
 
     def __init__(self):
         self.api_key = os.getenv("EXA_API_KEY")
+        #Replayed runs never reach Exa
+        if not self.api_key and cassette.CASSETTE_MODE == "replay":
+            self.api_key = "replay"
         if not self.api_key:
             raise ValueError("EXA_API_KEY is not set in environment variables.")
+        #One pooled async client for all searches. Created here, bound to the event loop on first use
+        limits = httpx.Limits(
+            max_connections=EXA_MAX_CONNECTIONS,
+            max_keepalive_connections=EXA_MAX_KEEPALIVE
+        )
+        self.client = httpx.AsyncClient(
+            headers={
+                "x-api-key": self.api_key,
+                "Content-Type": "application/json"
+            },
+            timeout=EXA_TIMEOUT,
+            limits=limits,
+            #Recorded or replayed when CASSETTE_MODE is set, see services/cassette.py
+            transport=cassette.transport("exa", limits)
+        )
+        self.cache = DiskCache(
+            RESEARCH_CACHE_PATH,
+            ttls=RESEARCH_CACHE_TTLS,
+            default_ttl=RESEARCH_CACHE_DEFAULT_TTL,
+            max_entries=RESEARCH_CACHE_MAX_ENTRIES
+        )
+        #Identical queries already on their way to Exa are joined instead of sent again
+        self.flight = SingleFlight("exa")
+        #Searches still running at the observed p95 get a duplicate if the Exa quota has room, the first answer wins
+        self.hedger = Hedger("exa", EXA_HEDGE_DEFAULT_DELAY, admit=upstream("exa").bucket.try_acquire_async)
+
+
+    async def aclose(self):
+        await self.client.aclose()
+        self.cache.close()
+
+
+    @staticmethod
+    def _cache_key(query: str, num_results: int, include_domains: list = None) -> str:
+        #Case and whitespace differences in the query should not cause a miss
+        normalized = " ".join(query.lower().split())
+        return DiskCache.make_key(normalized, sorted(include_domains or []), num_results)
 
 
-    #helper method that makes a single HTTP POST request to avoid repeating HTTP logic
-    def _search(self, query: str, num_results: int = 3,
-                 include_domains: list = None, _retry: bool = True) -> list:
+    #Cached, coalesced front of _fetch, also across worker processes. category picks the TTL the results are stored with
+    async def _search(self, query: str, num_results: int = 3,
+                 include_domains: list = None, category: str = None) -> list:
+
+        key = self._cache_key(query, num_results, include_domains)
+        cached = self.cache.get(key)
+        RESEARCH_CACHE.inc(result="miss" if cached is None else "hit")
+        if cached is not None:
+            logger.info(f"Research cache hit ({category}) for query: {query}")
+            return cached
+
+        async def fetch_and_store():
+            results = await self._fetch(query, num_results, include_domains)
+            self.cache.set(key, results, category)
+            return results
+
+        async def fetch():
+            state = shared()
+            if state is None:
+                return await fetch_and_store()
+            #Another worker process may be making the same search, its results land in the shared cache
+            return await state.once(f"exa:{key}", fetch_and_store, lambda: self.cache.get(key), EXA_CLAIM_TTL)
+
+        return await self.flight.do(key, fetch)
+
+
+    #helper method that makes a single HTTP POST request to avoid repeating HTTP logic.
+    #Goes through the shared Exa rate limiter, which also retries 429s and transient failures,
+    #and is hedged when slow. No attempt runs past the request deadline
+    async def _fetch(self, query: str, num_results: int = 3,
+                 include_domains: list = None) -> list:
         
         payload = {
             "query": query,
@@ -75,97 +181,111 @@ class ResearchService:
         if include_domains:
             payload["includeDomains"] = include_domains
 
-        try:
-            response = httpx.post(
-                EXA_URL,
-                headers={
-                    "x-api-key": self.api_key,
-                    "Content-Type": "application/json"
-                },
-                json=payload,
-                timeout=EXA_TIMEOUT
-            )
-            response.raise_for_status()
+        async def search():
+            async with track_call("exa", "search"):
+                response = await self.client.post(
+                    EXA_URL, json=payload, timeout=budget(EXA_TIMEOUT, "Exa search")
+                )
+                response.raise_for_status()
             return response.json().get("results", [])
+
+        try:
+            #Hedged inside the limiter, so the p95 is Exa's own latency and not time spent queued
+            return await upstream("exa").call(lambda: self.hedger.call(search))
         
         except httpx.TimeoutException:
             logger.warning(f"Exa search timed out for query: {query}")
             raise RuntimeError(f"Exa search timed out for query: {query}")
 
         except httpx.HTTPStatusError as e:
-            if e.response.status_code == 429 and _retry:
-                #Exa Rate limited: waits a moment and retries once
-                logger.warning("Exa rate limited, retrying once")
-                time.sleep(2)
-                return self._search(query, num_results, include_domains, _retry=False)
-            else:
-                logger.error(f"Exa API error {e.response.status_code} for query: {query}")
-                raise RuntimeError(f"Exa API error {e.response.status_code} for query: {query}")
+            logger.error(f"Exa API error {e.response.status_code} for query: {query}")
+            raise RuntimeError(f"Exa API error {e.response.status_code} for query: {query}")
 
 
     
-    def research(self, first_name: str, last_name: str, company: str) -> dict:
+    #Person and company research together, as one dict with every context section
+    async def research(self, first_name: str, last_name: str, company: str) -> dict:
+        person, company_research = await asyncio.gather(
+            self.research_person(first_name, last_name, company),
+            self.research_company(company)
+        )
+        return {**person, "company_context": company_research["company_context"]}
+
+
+    #Research about the contact themselves. Company news is in research_company, which only depends
+    #on the company and can be shared by every founder there
+    async def research_person(self, first_name: str, last_name: str, company: str) -> dict:
             full_name = f"{first_name} {last_name}"
 
-            #Who is person
-            person_results_general = self._search(
-                f'"{full_name}" "{company}"  Europe startup founder education backround',
-                include_domains=EXA_PERSON_DOMAINS,
-                num_results=EXA_PERSON_RESULTS)
-            
-            linkedin_results = self._search(
-                f'"{full_name}" "{company}" founder',
-                num_results=5,
-                include_domains=["linkedin.com"]
+            #All three searches are independent, so they run at the same time over the shared pool
+            person_results_general, linkedin_results, activity_results = await asyncio.gather(
+                #Who is person
+                self._search(
+                    f'"{full_name}" "{company}"  Europe startup founder education backround',
+                    include_domains=EXA_PERSON_DOMAINS,
+                    num_results=EXA_PERSON_RESULTS,
+                    category="person"),
+                self._search(
+                    f'"{full_name}" "{company}" founder',
+                    num_results=5,
+                    include_domains=["linkedin.com"],
+                    category="linkedin"
+                ),
+                # What have they said or published recently
+                self._search(
+                    f'"{full_name}" "{company}" Congratulations Hiring Launch Project Development 2026 2025 2024',
+                    num_results=EXA_ACTIVITY_RESULTS,
+                    include_domains=EXA_ACTIVITY_DOMAINS,
+                    category="activity"
+                )
             )
 
             # Merge both
             person_results =  linkedin_results + person_results_general
 
-            
-            # What have they said or published recently
-            activity_results = self._search(
-                f'"{full_name}" "{company}" Congratulations Hiring Launch Project Development 2026 2025 2024',
-                num_results=EXA_ACTIVITY_RESULTS,
-                include_domains=EXA_ACTIVITY_DOMAINS
-            )
-            
-            # What is happening at their company
-            company_results = self._search(
-                f'"{company}" Europe Spain funding news product launch partnership 2026 2025 2024',
-                num_results=EXA_COMPANY_RESULTS,
-                include_domains=EXA_COMPANY_DOMAINS
-            )
-
-            person_snippets = [r["text"] for r in person_results if r.get("text")]
-            activity_snippets = [r["text"] for r in activity_results if r.get("text")]
-            company_snippets = [r["text"] for r in company_results if r.get("text")]
-
-
+            #Duplicates dropped, most relevant passages first, within each section's budget
             return {
                 "contact_name": full_name,
                 "company": company,
-                "person_context": " ".join(person_snippets),
-                "activity_context": " ".join(activity_snippets),
-                "company_context": " ".join(company_snippets)
+                "person_context": rank_and_pack(person_results, full_name, company, PERSON_CONTEXT_BUDGET),
+                "activity_context": rank_and_pack(activity_results, full_name, company, ACTIVITY_CONTEXT_BUDGET)
             }
+
+
+    async def research_company(self, company: str) -> dict:
+        # What is happening at their company
+        company_results = await self._search(
+            f'"{company}" Europe Spain funding news product launch partnership 2026 2025 2024',
+            num_results=EXA_COMPANY_RESULTS,
+            include_domains=EXA_COMPANY_DOMAINS,
+            category="company"
+        )
+        #Ranked on the company alone, so the packed text is the same for everyone who works there
+        return {
+            "company": company,
+            "company_context": rank_and_pack(company_results, "", company, COMPANY_CONTEXT_BUDGET)
+        }
     
 
 
-    def research_strategy(self, full_name: str, company: str) -> dict:
+    async def research_strategy(self, full_name: str, company: str) -> dict:
     # Additional searches specifically for connection strategy
-        events_results = self._search(
-            f'"{full_name}" OR "{company}" conference event summit 2025 2026 speaker',
-            num_results=3
-        )
-        content_results = self._search(
-            f'"{full_name}" "{company}" published article post interview podcast 2025 2026',
-            num_results=3
+        events_results, content_results = await asyncio.gather(
+            self._search(
+                f'"{full_name}" OR "{company}" conference event summit 2025 2026 speaker',
+                num_results=3,
+                category="events"
+            ),
+            self._search(
+                f'"{full_name}" "{company}" published article post interview podcast 2025 2026',
+                num_results=3,
+                category="content"
+            )
         )
 
-        #Trimming to prevent overwhelming the strategy prompt or one narrative dominating, prioritizing the start of texts which often contain the most relevant info. 
-        events_snippets = " ".join([r["text"][:800] for r in events_results if r.get("text")])
-        content_snippets = " ".join([r["text"][:800] for r in content_results if r.get("text")])
+        #Small budget to prevent overwhelming the strategy prompt, ranking keeps the passages about the contact
+        events_snippets = rank_and_pack(events_results, full_name, company, STRATEGY_CONTEXT_BUDGET)
+        content_snippets = rank_and_pack(content_results, full_name, company, STRATEGY_CONTEXT_BUDGET)
 
         return {
             "events_context": events_snippets or "No specific events found.",
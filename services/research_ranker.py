@@ -0,0 +1,175 @@
+# Post-search stage between Exa and validation
+# Drops duplicate pages (same URL, or near-identical text detected with MinHash over word shingles),
+# ranks the remaining passages by how much they are about the contact and their company,
+# and packs the best ones into a per-section character budget. Smaller, cleaner context means
+# fewer Haiku input tokens and faster validation without losing the useful facts.
+
+import re
+import zlib
+import random
+import logging
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from services.contact_resolver import normalize
+
+logger = logging.getLogger(__name__)
+
+#-------------  Ranking Configuration --------------
+SHINGLE_SIZE = 5
+MINHASH_PERMUTATIONS = 64
+#Estimated Jaccard similarity above which two pages count as the same content
+NEAR_DUPLICATE_THRESHOLD = 0.8
+#Passages are built from lines up to roughly this size. Longer lines are split into sentences first,
+#and sentences that are still too long at word boundaries
+PASSAGE_TARGET_CHARS = 500
+#Lines shorter than this that look like boilerplate are dropped before passages are built
+BOILERPLATE_LINE_CHARS = 160
+#Lines typical of navigation, cookie banners and footers
+BOILERPLATE_PATTERNS = re.compile(
+    r"cookie|subscribe|sign up|sign in|log in|privacy policy|terms of (use|service)|"
+    r"all rights reserved|newsletter|accept all|javascript|skip to (main )?content",
+    re.IGNORECASE
+)
+#Company name words too common to signal relevance on their own
+COMMON_COMPANY_WORDS = {"ai", "inc", "ltd", "sl", "gmbh", "the", "labs", "tech", "group", "co", "app"}
+#---------------------------------------------
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(7)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(MINHASH_PERMUTATIONS)]
+_TRACKING_PARAMS = ("utm_", "ref", "trk", "fbclid", "gclid")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def normalize_url(url: str) -> str:
+    #Scheme, www., fragments, trailing slashes and tracking parameters do not make a different page
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower().removeprefix("www.")
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query) if not k.lower().startswith(_TRACKING_PARAMS)
+    ))
+    path = parts.path.rstrip("/")
+    return f"{host}{path}?{query}" if query else f"{host}{path}"
+
+
+def _signature(text: str) -> tuple:
+    words = re.findall(r"\w+", normalize(text))
+    shingles = {
+        zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8"))
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    }
+    return tuple(min((a * s + b) % _PRIME for s in shingles) for a, b in _PERMUTATIONS)
+
+
+def _similarity(a: tuple, b: tuple) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+def dedupe(results: list) -> list:
+    #Keeps the first occurrence, Exa returns results best match first
+    kept, urls, signatures = [], set(), []
+    for result in results:
+        text = result.get("text") or ""
+        if not text.strip():
+            continue
+        url = normalize_url(result.get("url") or "")
+        if url and url in urls:
+            continue
+        signature = _signature(text)
+        if any(_similarity(signature, seen) >= NEAR_DUPLICATE_THRESHOLD for seen in signatures):
+            continue
+        urls.add(url)
+        signatures.append(signature)
+        kept.append(result)
+    return kept
+
+
+def _pieces(line: str) -> list:
+    #Pages without line breaks (Exa often returns one long line) would otherwise be a single passage
+    #larger than the whole budget
+    if len(line) <= PASSAGE_TARGET_CHARS:
+        return [line]
+    pieces = []
+    for sentence in _SENTENCE_END.split(line):
+        while len(sentence) > PASSAGE_TARGET_CHARS:
+            cut = sentence.rfind(" ", 0, PASSAGE_TARGET_CHARS)
+            cut = cut if cut > 0 else PASSAGE_TARGET_CHARS
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def _passages(text: str) -> list:
+    passages, current = [], ""
+    for line in (l.strip() for l in text.splitlines()):
+        if not line or (len(line) < BOILERPLATE_LINE_CHARS and BOILERPLATE_PATTERNS.search(line)):
+            continue
+        for piece in _pieces(line):
+            if current and len(current) + len(piece) > PASSAGE_TARGET_CHARS:
+                passages.append(current)
+                current = ""
+            current = f"{current} {piece}".strip()
+    if current:
+        passages.append(current)
+    return passages
+
+
+def _score(passage: str, terms: dict) -> float:
+    folded = normalize(passage)
+    score = sum(weight * folded.count(term) for term, weight in terms.items())
+    #Boilerplate left inside longer lines pushes a passage down, short fragments carry little information
+    score -= 2 * len(BOILERPLATE_PATTERNS.findall(passage))
+    if len(passage) < 80:
+        score -= 1
+    return score
+
+
+def _terms(full_name: str, company: str) -> dict:
+    #An empty full_name ranks for the company alone, e.g. research shared by a company's founders
+    name, company_name = normalize(full_name), normalize(company)
+    terms = {company_name: 3.0}
+    if name:
+        terms[name] = 4.0
+    name_parts = name.split()
+    if len(name_parts) > 1:
+        terms[name_parts[-1]] = terms.get(name_parts[-1], 0) + 2.0
+        terms[name_parts[0]] = terms.get(name_parts[0], 0) + 0.5
+    for word in company_name.split():
+        if len(word) > 2 and word not in COMMON_COMPANY_WORDS:
+            terms[word] = terms.get(word, 0) + 1.0
+    return terms
+
+
+def rank_and_pack(results: list, full_name: str, company: str, budget: int) -> str:
+    unique = dedupe(results)
+    terms = _terms(full_name, company)
+
+    #(score, result index, passage index, text). A page that is about the contact lifts all of its
+    #passages a little, so context sentences that do not repeat the name are not lost.
+    #Neutral passages still fill leftover budget, only boilerplate and fragments are dropped outright
+    candidates = []
+    for r_index, result in enumerate(unique):
+        passages = _passages(result["text"])
+        scores = [_score(p, terms) for p in passages]
+        page_bonus = 0.25 * max(0.0, sum(scores))
+        for p_index, (passage, score) in enumerate(zip(passages, scores)):
+            total = score + page_bonus
+            if total > -1:
+                candidates.append((total, r_index, p_index, passage))
+
+    chosen, used = [], 0
+    for candidate in sorted(candidates, key=lambda c: (-c[0], c[1], c[2])):
+        if used + len(candidate[3]) > budget:
+            continue
+        chosen.append(candidate)
+        used += len(candidate[3]) + 1
+
+    #Back in reading order so passages from the same page stay together
+    chosen.sort(key=lambda c: (c[1], c[2]))
+    packed = " ".join(c[3] for c in chosen)
+
+    raw_chars = sum(len(r.get("text") or "") for r in results)
+    logger.info(f"Ranked research for {full_name or company}: {len(results)} results, {len(unique)} unique, "
+                f"{raw_chars} -> {len(packed)} chars")
+    return packed
@@ -1,54 +1,276 @@
 # Validates and enriches raw research results using an LLM
 # Filters with internal notes to remove irrelevant or incorrect information
+# By default all sections go to Haiku in one call that returns them together through a tool (structured
+# output), so the instructions, contact and notes are sent once instead of three times. Very long
+# research, or a failed combined call, falls back to one call per section, validated concurrently
+# Validated sections are memoized on disk one by one, whichever way they were validated, so a re-run
+# only sends Haiku the sections whose research or notes changed
+# Company news is validated on its own, against the company rather than a person, so founders of the
+# same company can share one result (validate_company)
 
 import os
+import asyncio
 import logging
-import anthropic
 from dotenv import load_dotenv
+from services.llm import LLMClient
+from services.cache import DiskCache
+from services.metrics import VALIDATION_CACHE
+from services.deadline import budget
+from services.shared_state import shared
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+VALIDATION_MODEL = "claude-haiku-4-5-20251001"
+#combined: one structured call for all sections, sections: one call per section
+VALIDATION_MODE = os.getenv("VALIDATION_MODE", "combined")
+#Seconds each section may take before it is given up on, and the combined call
+VALIDATION_SECTION_TIMEOUT = 30.0
+VALIDATION_COMBINED_TIMEOUT = 45.0
+VALIDATION_SECTION_MAX_TOKENS = 600
+#Characters of research and notes above which sections are validated separately again. A single
+#very long call is slow and one failure would cost every section
+VALIDATION_COMBINED_MAX_CHARS = 24000
+VALIDATION_TOOL = "record_validated_research"
+#Placeholder for sections that timed out or failed, the drafter falls back to internal notes
+MISSING_SECTION = "Validation unavailable. Utilise internal notes for context."
+
+#-------------  Validation Cache --------------
+VALIDATION_CACHE_PATH = os.getenv("VALIDATION_CACHE_PATH", "cache/validation.db")
+VALIDATION_CACHE_MAX_ENTRIES = 20000
+#Seconds. A result only depends on its key, the TTL just bounds how long unused entries stay around
+VALIDATION_CACHE_TTL = 30 * 24 * 3600
+#Bump when the prompt wording or the parsing of replies changes, so older results are not reused
+VALIDATION_PROMPT_VERSION = 2
+#Seconds other workers wait on a worker validating the same inputs before trying it themselves
+VALIDATION_CLAIM_TTL = VALIDATION_COMBINED_TIMEOUT
+#---------------------------------------------
+
+#output field -> (raw research field, section description)
+SECTIONS = {
+    "validated_person": (
+        "person_context",
+        "person background, role and previous employers and education"
+    ),
+    "validated_activity": (
+        "activity_context",
+        "recent public activity, interviews, publications and social media presence"
+    ),
+    "validated_company": (
+        "company_context",
+        "company news, funding and product updates"
+    )
+}
+
+#Sections about the contact themselves, and the one that only depends on their company
+PERSON_FIELDS = ("validated_person", "validated_activity")
+COMPANY_FIELD = "validated_company"
+
 class ResearchValidatorService:
-    def __init__(self):
-        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-        if not os.getenv("ANTHROPIC_API_KEY"):
-            raise ValueError("ANTHROPIC_API_KEY is not set in environment variables.")
+    def __init__(self, llm: LLMClient = None, mode: str = VALIDATION_MODE):
+        if mode not in ("combined", "sections"):
+            raise ValueError(f"Unknown validation mode '{mode}'")
+        self.llm = llm or LLMClient()
+        self.mode = mode
+        self.cache = DiskCache(
+            VALIDATION_CACHE_PATH,
+            ttls={},
+            default_ttl=VALIDATION_CACHE_TTL,
+            max_entries=VALIDATION_CACHE_MAX_ENTRIES
+        )
+
+
+    def close(self):
+        self.cache.close()
 
 
-    def validate(self, research: dict, notes: str, full_name: str, company: str) -> dict:
+    #fields limits validation to some sections, e.g. PERSON_FIELDS when company news is validated
+    #separately with validate_company
+    async def validate(self, research: dict, notes: str, full_name: str, company: str,
+                       fields: tuple = tuple(SECTIONS)) -> dict:
         logger.info(f"Validating research for {full_name} at {company}")
 
-        return {
-        "contact_name": full_name,
-        "company": company,
-        "validated_person": self._validate_section(
-            content=research.get("person_context", ""),
-            section_type="person background, role and previous employers and education",
-            full_name=full_name,
-            company=company,
-            notes=notes
-        ),
-        "validated_activity": self._validate_section(
-            content=research.get("activity_context", ""),
-            section_type="recent public activity, interviews, publications and social media presence",
-            full_name=full_name,
-            company=company,
-            notes=notes
-        ),
-        "validated_company": self._validate_section(
-            content=research.get("company_context", ""),
-            section_type="company news, funding and product updates",
-            full_name=full_name,
-            company=company,
-            notes=notes
+        requests = self.section_requests(research, notes, full_name, company, fields)
+        #Sections with nothing to validate already hold their final text
+        results = {field: params for field, params in requests.items() if isinstance(params, str)}
+        pending = {field: params for field, params in requests.items() if field not in results}
+        #Sections validated before with identical inputs are not sent again
+        for field, params in list(pending.items()):
+            cached = self.cached(params)
+            if cached is not None:
+                results[field] = cached
+                del pending[field]
+
+        if self.mode == "combined" and len(pending) > 1:
+            size = len(notes or "") + sum(len(research.get(SECTIONS[field][0], "")) for field in pending)
+            if size <= VALIDATION_COMBINED_MAX_CHARS:
+                try:
+                    results.update(await asyncio.wait_for(
+                        self._run_combined(research, notes, full_name, company, pending),
+                        timeout=budget(VALIDATION_COMBINED_TIMEOUT, "validation")
+                    ))
+                    pending = {}
+                except Exception as e:
+                    logger.warning(f"Combined validation for {full_name} failed, validating sections separately: {e!r}")
+            else:
+                logger.info(f"Research for {full_name} is {size} characters, validating sections separately")
+
+        #Each section gets its own timeout, or what is left of the request deadline if that is less
+        timeout = budget(VALIDATION_SECTION_TIMEOUT, "validation") if pending else None
+        outputs = await asyncio.gather(
+            *[
+                asyncio.wait_for(self._run_section(params), timeout=timeout)
+                for params in pending.values()
+            ],
+            return_exceptions=True
         )
-    }
-    
+        results.update(zip(pending, outputs))
+        validated = self.assemble(full_name, company, {field: results[field] for field in requests})
+        logger.info(f"Validated research for {full_name}, missing sections: {validated['missing_sections'] or 'none'}")
+        return validated
+
+
+    #Company news checked against the company alone. notes are the internal notes on the people there
+    async def validate_company(self, research: dict, notes: str, company: str) -> dict:
+        logger.info(f"Validating company research for {company}")
+        params = self.company_request(research.get("company_context", ""), notes, company)
+        timeout = budget(VALIDATION_SECTION_TIMEOUT, "validation")
+        try:
+            result = None if isinstance(params, str) else self.cached(params)
+            if result is None:
+                result = await asyncio.wait_for(self._run_section(params), timeout=timeout)
+        except Exception as e:
+            result = e
+        return self.assemble(None, company, {COMPANY_FIELD: result})
+
+
+    @staticmethod
+    def merge(person: dict, company: dict) -> dict:
+        #A contact's validated research from validate(..., fields=PERSON_FIELDS) and validate_company
+        return {
+            **person,
+            COMPANY_FIELD: company[COMPANY_FIELD],
+            "missing_sections": person["missing_sections"] + company["missing_sections"]
+        }
+
+
+    #output field -> messages.create params, or the final text when there is nothing to validate.
+    #Shared by the interactive path and bulk (Message Batches) runs
+    def section_requests(self, research: dict, notes: str, full_name: str, company: str,
+                         fields: tuple = tuple(SECTIONS)) -> dict:
+        return {
+            field: self._section_request(
+                content=research.get(raw_field, ""),
+                section_type=section_type,
+                full_name=full_name,
+                company=company,
+                notes=notes
+            )
+            for field, (raw_field, section_type) in SECTIONS.items()
+            if field in fields
+        }
+
+
+    #results maps each output field to its validated text or the exception that section raised.
+    #full_name is None for company research
+    def assemble(self, full_name: str, company: str, results: dict) -> dict:
+        validated = {"company": company, "missing_sections": []}
+        if full_name is not None:
+            validated["contact_name"] = full_name
+        for field, result in results.items():
+            #One slow or failing section should not fail the whole request
+            if isinstance(result, BaseException):
+                logger.warning(f"Validation of {field} for {full_name or company} failed: {result!r}")
+                validated[field] = MISSING_SECTION
+                validated["missing_sections"].append(field)
+            else:
+                validated[field] = result
+        return validated
+
+
+    #Callers check the cache first
+    async def _run_section(self, params) -> str:
+        if isinstance(params, str):
+            return params
+
+        async def call():
+            message = await self.llm.create("Research validation", **params)
+            text = self.parse(message.content[0].text)
+            self.remember(params, text)
+            return text
+
+        return await self._once(params, call)
+
 
-    def _validate_section(self, content: str, section_type: str,
-                           full_name: str, company: str, notes: str = "") -> str:
+    #The params hold the model, limits and the full prompt (section type, research, notes, name,
+    #company), so any change to what Haiku would see is a different key
+    @staticmethod
+    def _cache_key(params: dict) -> str:
+        return DiskCache.make_key(VALIDATION_PROMPT_VERSION, params)
+
+
+    def cached(self, params: dict):
+        #Validated text from an earlier run with identical inputs, or None
+        text = self.cache.get(self._cache_key(params))
+        VALIDATION_CACHE.inc(result="miss" if text is None else "hit")
+        return text
+
+
+    def remember(self, params: dict, text: str):
+        self.cache.set(self._cache_key(params), text, "validation")
+
+
+    #pending maps each output field to its per-section request. The results are stored under those,
+    #so a later run only validates again the sections whose inputs changed, in either mode
+    async def _run_combined(self, research: dict, notes: str, full_name: str, company: str, pending: dict) -> dict:
+        fields = list(pending)
+        params = self.combined_request(research, notes, full_name, company, fields)
+
+        async def call():
+            message = await self.llm.create("Research validation (combined)", **params)
+            results = self.parse_combined(message, fields)
+            for field, text in results.items():
+                self.remember(pending[field], text)
+            return results
+
+        def lookup():
+            #Every section stored by the worker that made the call
+            texts = {field: self.cache.get(self._cache_key(section)) for field, section in pending.items()}
+            return texts if all(text is not None for text in texts.values()) else None
+
+        return await self._once(params, call, lookup)
+
+
+    async def _once(self, params: dict, fn, lookup=None):
+        #The same validation running in another worker process is waited for instead of repeated.
+        #lookup finds its result once stored, by default under the key of params
+        state = shared()
+        if state is None:
+            return await fn()
+        key = self._cache_key(params)
+        return await state.once(f"validation:{key}", fn, lookup or (lambda: self.cache.get(key)), VALIDATION_CLAIM_TTL)
+
+
+    @staticmethod
+    def parse(text: str) -> str:
+        return text.strip()
+
+
+    @staticmethod
+    def parse_combined(message, fields: list) -> dict:
+        #The forced tool call carries one string per section
+        block = next((b for b in message.content if b.type == "tool_use"), None)
+        if block is None:
+            raise ValueError(f"Combined validation returned no {VALIDATION_TOOL} call")
+        missing = [field for field in fields if not isinstance(block.input.get(field), str)]
+        if missing:
+            raise ValueError(f"Combined validation is missing {', '.join(missing)}")
+        return {field: block.input[field].strip() for field in fields}
+
+
+    def _section_request(self, content: str, section_type: str,
+                           full_name: str, company: str, notes: str = ""):
         
         if not content.strip():
             return "No information found."
@@ -65,7 +287,7 @@ class ResearchValidatorService:
         {full_name} at {company}. Return a clean summary useful for a cold outreach email.
         
         CONTACT: {full_name} at {company}
-
+        {notes_block}
         SECTION TYPE: {section_type}
         RAW RESEARCH:
         {content}
@@ -89,12 +311,125 @@ class ResearchValidatorService:
         Return only the relevant information. No preamble, no commentary, no markdown.
         """
 
-        message = self.client.messages.create(
-            model="claude-haiku-4-5-20251001",
-            max_tokens=600,
-            messages=[{"role": "user", "content": prompt}]
+        return {
+            "model": VALIDATION_MODEL,
+            "max_tokens": VALIDATION_SECTION_MAX_TOKENS,
+            "messages": [{"role": "user", "content": prompt}]
+        }
+
+
+    #Same task as _section_request, but about the company rather than one person, so the result holds
+    #for everyone who works there. notes may combine several founders' notes
+    def company_request(self, content: str, notes: str, company: str):
+
+        if not content.strip():
+            return "No information found."
+
+        notes_block = f"""
+        INTERNAL NOTES on people at the company (use as verification signals such as stage, location, 
+        funding, sector etc.):
+        {notes}
+        """ if notes else ""
+
+        prompt = f"""
+        You are a research assistant validating web research results about a specific company/startup.
+        GOAL: Filter this research to keep only content that genuinely refers to 
+        {company}. Return a clean summary useful for a cold outreach email to its founders.
+        
+        COMPANY: {company}
+        {notes_block}
+        SECTION TYPE: {SECTIONS[COMPANY_FIELD][1]}
+        RAW RESEARCH:
+        {content}
+
+        TASK:
+        1. Read through all the research carefully
+        2. Keep only content that is genuinely about {company}
+        3. Discard anything about unrelated companies with similar names, but be careful not to discard
+           relevant information that may be phrased in a way that doesn't include the company name in
+           every sentence. Use your judgment to determine relevance based on the content.
+        4. From what remains, extract the most useful facts for a cold outreach email:
+           - Recent company news (funding, product launches, partnerships etc.)
+           - What the company does, its stage and its market
+           - Any notable achievements or press coverage
+        5. Return a clean, concise summary 
+
+        If nothing in the research is genuinely about this company, 
+        respond with: "No verified information found. Utilise internal notes for context."
+        
+    
+        Return only the relevant information. No preamble, no commentary, no markdown.
+        """
+
+        return {
+            "model": VALIDATION_MODEL,
+            "max_tokens": VALIDATION_SECTION_MAX_TOKENS,
+            "messages": [{"role": "user", "content": prompt}]
+        }
+
+
+    #fields are the output fields to validate, each with research content. The instructions, contact
+    #and notes appear once; the reply is forced through a tool whose schema has one string per section
+    def combined_request(self, research: dict, notes: str, full_name: str, company: str, fields: list) -> dict:
+
+        notes_block = f"""
+        INTERNAL NOTES (use as verification signals such as stage, location, 
+        funding, previous employers etc.):
+        {notes}
+        """ if notes else ""
+
+        sections = "\n".join(
+            f"""
+        <section field="{field}" type="{SECTIONS[field][1]}">
+        {research.get(SECTIONS[field][0], "")}
+        </section>"""
+            for field in fields
         )
 
-        result = message.content[0].text.strip()
-        logger.info(f"Validation {section_type} for {full_name}")
-        return result
+        prompt = f"""
+        You are a research assistant validating web research results about a specific person and company/startup.
+        GOAL: Filter each research section to keep only content that genuinely refers to 
+        {full_name} at {company}. Return a clean summary per section useful for a cold outreach email.
+        
+        CONTACT: {full_name} at {company}
+        {notes_block}
+        RAW RESEARCH, one section per field:
+        {sections}
+
+        TASK, for every section on its own:
+        1. Read through all the research in the section carefully
+        2. Keep only content that is genuinely about {full_name} at {company}
+        3. Discard anything about different people with similar names or 
+           unrelated companies with similar names, but be careful not to discard relevant information
+           that may be phrased in a way that doesn't include the full name or company name in every sentence. Use your judgment to determine relevance based on the content.
+        4. From what remains, extract the most useful facts for a cold outreach email:
+           - Their current role and background
+           - Recent company news (funding, product launches, partnerships etc.)
+           - Any notable achievements, publications, public activity etc.
+        5. Write a clean, concise summary for the section
+
+        If nothing in a section is genuinely about this contact, 
+        use for that section: "No verified information found. Utilise internal notes for context."
+
+        Record every section with the {VALIDATION_TOOL} tool. Only the relevant information,
+        no preamble, no commentary, no markdown.
+        """
+
+        return {
+            "model": VALIDATION_MODEL,
+            "max_tokens": VALIDATION_SECTION_MAX_TOKENS * len(fields),
+            "tools": [{
+                "name": VALIDATION_TOOL,
+                "description": "Record the validated summary of each research section.",
+                "input_schema": {
+                    "type": "object",
+                    "properties": {
+                        field: {"type": "string", "description": f"Validated {SECTIONS[field][1]}"}
+                        for field in fields
+                    },
+                    "required": fields
+                }
+            }],
+            "tool_choice": {"type": "tool", "name": VALIDATION_TOOL},
+            "messages": [{"role": "user", "content": prompt}]
+        }
@@ -0,0 +1,175 @@
+# State shared by every worker process on one host
+# Each uvicorn worker builds its own orchestrator, clients and rate limiters. Without coordination,
+# N workers spend N times the upstream quota and send the same Exa query or Haiku prompt N times. This
+# module keeps the state that must be common in one SQLite file in WAL mode: the rate limit buckets
+# (services.rate_limit) and short claims on in-flight calls, so one worker makes a call and the
+# others wait for its result in the shared caches. file_lock serializes work on plain files across
+# processes, such as the Gmail token refresh.
+
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from services.deadline import remaining, DeadlineExceeded
+
+try:
+    import fcntl
+except ImportError:
+    #Not on Windows: file_lock then only guards against threads of this process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+#-------------  Shared State Configuration --------------
+#Set to an empty string to keep all of this per process
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "cache/shared_state.db")
+#Seconds a connection waits for another process's write to finish
+SQLITE_BUSY_TIMEOUT = 10.0
+#Seconds between checks while another worker is making a claimed call
+CLAIM_POLL_INTERVAL = 0.05
+#---------------------------------------------
+
+
+def connect(path: str, isolation_level=None) -> sqlite3.Connection:
+    #SQLite connection for a store several processes use at once. WAL lets readers carry on while one
+    #process writes, and the busy timeout makes writers queue instead of failing with "database is locked".
+    #isolation_level as for sqlite3.connect, the default is autocommit with explicit transactions
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=isolation_level, timeout=SQLITE_BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    #Durable at checkpoints, not on every commit. These stores hold caches and counters
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SharedState:
+
+    def __init__(self, path: str = SHARED_STATE_PATH):
+        self.path = path
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    rate REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS claims (
+                    key TEXT PRIMARY KEY,
+                    owner INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+
+
+    @contextmanager
+    def transaction(self):
+        #Write transaction across processes. Keep the body short and free of awaits
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+    def claim(self, key: str, ttl: float) -> bool:
+        #True if this process now owns key for ttl seconds, False while another process owns it
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM claims WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO claims (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, os.getpid(), now + ttl)
+            )
+            return cursor.rowcount == 1
+
+
+    def release(self, key: str):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM claims WHERE key = ? AND owner = ?", (key, os.getpid()))
+
+
+    def claimed(self, key: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM claims WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row is not None
+
+
+    async def once(self, key: str, fn, lookup, ttl: float):
+        #Runs fn in only one process at a time for key. Other processes wait until its result shows up
+        #through lookup() (a shared cache), or run fn themselves if the claim ends without one
+        while not self.claim(key, ttl):
+            while self.claimed(key):
+                left = remaining()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded("Deadline passed waiting for another worker's call")
+                await asyncio.sleep(CLAIM_POLL_INTERVAL)
+            result = lookup()
+            if result is not None:
+                logger.info("Used a result another worker fetched")
+                return result
+        try:
+            return await fn()
+        finally:
+            self.release(key)
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path: str):
+    #Exclusive lock held through path + ".lock", across threads of this process and other processes
+    with _locks_guard:
+        local = _locks.setdefault(path, threading.Lock())
+    with local:
+        if fcntl is None:
+            yield
+            return
+        with open(path + ".lock", "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def write_atomic(path: str, text: str):
+    #Readers see the old file or the new one, never a half-written one
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+_shared = None
+
+
+def shared():
+    #The process-wide SharedState, or None when SHARED_STATE_PATH is empty
+    global _shared
+    if _shared is None and SHARED_STATE_PATH:
+        _shared = SharedState()
+    return _shared
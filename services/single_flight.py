@@ -0,0 +1,48 @@
+# Coalesces identical in-flight calls: while a call for a key is running, other callers asking for
+# the same key wait on that call instead of making their own. Used in front of Exa and Anthropic,
+# where co-founders of one company or simultaneous requests for one founder send identical queries.
+# Results are shared between callers, so they must be treated as read-only.
+
+import asyncio
+import logging
+from services.metrics import COALESCED
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}
+        #Calls actually made, and calls saved by joining one already in flight
+        self.calls = 0
+        self.coalesced = 0
+
+
+    async def do(self, key: str, fn):
+        #fn is a zero-argument coroutine function, only called when no call for key is in flight
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            COALESCED.inc(service=self.name)
+            logger.info(f"Coalesced {self.name} call ({self.coalesced} saved so far)")
+        else:
+            self.calls += 1
+            #A separate task, so one caller being cancelled does not cancel the call for the others
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        #Mark the exception as retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._inflight)}
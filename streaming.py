@@ -0,0 +1,86 @@
+#Server-sent events for POST /generate-outreach/stream
+#Runs the normal pipeline and turns its progress into SSE events as they happen, so a client can show
+#each stage finishing and the email body while it is being written instead of waiting for the whole run.
+#Events, each with a JSON data line:
+#   stage           {"stage", "status", ...}  status is started, done, skipped or failed
+#   draft           {"text"}                  next piece of the email body
+#   draft_complete  {"subject", "body"}       the parsed draft
+#   result          OutreachResponse          the run finished
+#   error           {"status_code", "detail"} the run failed, codes as for /generate-outreach (504: deadline)
+
+import json
+import asyncio
+import logging
+from models import OutreachRequest
+from orchestrator import OutreachOrchestrator
+from services.contact_resolver import AmbiguousMatchError
+from services.deadline import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+
+def format_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _stage_data(stage: str, status: str, payload) -> dict:
+    data = {"stage": stage, "status": status}
+    if status == "failed":
+        data["error"] = str(payload)
+    if status != "done":
+        return data
+
+    if stage == "resolve":
+        contact = payload["contact"]
+        data["contact_name"] = f"{contact['first_name']} {contact['last_name']}"
+        data["company"] = contact["company"]
+        data["team_member"] = payload["team_member"]["name"]
+    elif stage == "validate":
+        data["missing_sections"] = payload.get("missing_sections", [])
+    elif stage in ("deliver", "deliver_strategy"):
+        data["delivery"] = payload["status"]
+    return data
+
+
+async def stream_outreach(orchestrator: OutreachOrchestrator, request: OutreachRequest):
+    queue = asyncio.Queue()
+
+    def emit(event: str, data: dict):
+        queue.put_nowait(format_event(event, data))
+
+    def listener(stage: str, status: str, payload):
+        emit("stage", _stage_data(stage, status, payload))
+        if stage == "draft" and status == "done":
+            emit("draft_complete", {"subject": payload["subject"], "body": payload["body"]})
+
+    async def run():
+        try:
+            result = await orchestrator.run(
+                request, listener=listener, on_draft=lambda text: emit("draft", {"text": text})
+            )
+            emit("result", result.model_dump())
+        except AmbiguousMatchError as e:
+            emit("error", {"status_code": 409, "detail": str(e)})
+        except DeadlineExceeded as e:
+            emit("error", {"status_code": 504, "detail": str(e)})
+        except ValueError as e:
+            emit("error", {"status_code": 404, "detail": str(e)})
+        except Exception as e:
+            logger.error(f"Unexpected error streaming request: {e}", exc_info=True)
+            emit("error", {"status_code": 500, "detail": str(e)})
+        finally:
+            queue.put_nowait(None)
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+    finally:
+        #The client went away: stop the run like a cancelled request, nothing is queued for sending
+        #unless the deliver stage already ran
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,41 @@
+#Jobs and campaigns wait out rate limits, only interactive requests get the run deadline
+
+import asyncio
+from campaign import CampaignRunner
+from jobs import JobQueue, JobStore
+from models import OutreachRequest, OutreachResponse
+
+
+class _Resolver:
+    def get_contact(self, first_name: str, last_name: str):
+        raise ValueError("not in the store")
+
+
+class _Orchestrator:
+    def __init__(self):
+        self.resolver = _Resolver()
+        self.deadlines = []
+
+    async def run(self, request: OutreachRequest, deadline_seconds: float = 60.0, **kwargs) -> OutreachResponse:
+        self.deadlines.append(deadline_seconds)
+        return OutreachResponse(status="queued", sent_to="team@example.com", contact_name="Ana Ruiz",
+                                email_preview="draft")
+
+
+REQUEST = OutreachRequest(first_name="Ana", last_name="Ruiz", company="Acme", team_member="Nico")
+
+
+def test_jobs_run_without_a_deadline(tmp_path):
+    orchestrator = _Orchestrator()
+    queue = JobQueue(orchestrator, JobStore(str(tmp_path / "jobs.db")), workers=1)
+    job_id = queue.store.create(REQUEST)
+    asyncio.run(queue._run_job(*queue.store.claim_next()))
+    assert queue.store.get(job_id).status == "succeeded"
+    assert orchestrator.deadlines == [None]
+
+
+def test_campaigns_run_without_a_deadline():
+    orchestrator = _Orchestrator()
+    response = asyncio.run(CampaignRunner(orchestrator).run([REQUEST]))
+    assert response.succeeded == 1
+    assert orchestrator.deadlines == [None]
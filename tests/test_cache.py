@@ -0,0 +1,77 @@
+#Disk cache expiry, eviction and the refresh window used by prewarming
+
+import time
+from services.cache import DiskCache, fresh_for
+
+
+def _cache(tmp_path, **kwargs) -> DiskCache:
+    options = {"ttls": {"short": 12 * 3600, "long": 7 * 24 * 3600}, "default_ttl": 3600, "max_entries": 100}
+    options.update(kwargs)
+    return DiskCache(str(tmp_path / "cache.db"), **options)
+
+
+def test_fresh_for_is_capped_at_half_of_the_category_ttl(tmp_path):
+    cache = _cache(tmp_path)
+    cache.set("company", "news", "short")
+    cache.set("person", "bio", "long")
+    with fresh_for(16 * 3600):
+        #Just written with a 12h TTL: a hit, a 16h window would make every such entry a miss
+        assert cache.get("company") == "news"
+        assert cache.get("person") == "bio"
+    #Less than half of its TTL left: fetched again inside the window, still a hit outside it
+    with cache._lock, cache._conn:
+        cache._conn.execute("UPDATE entries SET expires_at = ? WHERE key = 'company'", (time.time() + 5 * 3600,))
+    with fresh_for(16 * 3600):
+        assert cache.get("company") is None
+    assert cache.get("company") == "news"
+
+
+def _accessed_at(cache: DiskCache, key: str) -> float:
+    with cache._lock:
+        return cache._conn.execute("SELECT accessed_at FROM entries WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_hits_write_access_times_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr("services.cache.CACHE_TOUCH_BATCH", 3)
+    cache = _cache(tmp_path)
+    for key in ("a", "b", "c"):
+        cache.set(key, key, "short")
+    written = _accessed_at(cache, "a")
+    time.sleep(0.01)
+    assert cache.get("a") == "a" and cache.get("b") == "b"
+    #Read only so far
+    assert _accessed_at(cache, "a") == written
+    assert cache.get("c") == "c"
+    assert _accessed_at(cache, "a") > written
+
+
+def test_entries_expire_after_their_category_ttl(tmp_path):
+    cache = _cache(tmp_path, ttls={"short": 0.05}, default_ttl=3600)
+    cache.set("news", "old", "short")
+    cache.set("other", "kept", "unknown")
+    assert cache.get("news") == "old"
+    time.sleep(0.06)
+    assert cache.get("news") is None
+    #Categories without a TTL of their own use the default
+    assert cache.get("other") == "kept"
+    #Expired rows are dropped on the next write
+    cache.set("more", "new", "unknown")
+    assert cache.stats()["entries"] == 2
+
+
+def test_least_recently_read_entries_are_evicted_first(tmp_path):
+    cache = _cache(tmp_path, max_entries=2)
+    cache.set("a", 1, "long")
+    time.sleep(0.01)
+    cache.set("b", 2, "long")
+    time.sleep(0.01)
+    #Reading a makes b the least recently used
+    assert cache.get("a") == 1
+    cache.set("c", 3, "long")
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_keys_ignore_the_order_of_dict_fields():
+    assert DiskCache.make_key({"a": 1, "b": 2}) == DiskCache.make_key({"b": 2, "a": 1})
+    assert DiskCache.make_key("query", 3) != DiskCache.make_key("query", 5)
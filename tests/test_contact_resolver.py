@@ -0,0 +1,25 @@
+#Team members listed twice with the same email stay usable, different people with one name are ambiguous
+
+import pytest
+from services.contact_resolver import ContactResolver, AmbiguousMatchError
+
+
+def _resolver(tmp_path, team: str) -> ContactResolver:
+    contacts = tmp_path / "contacts.csv"
+    contacts.write_text("first_name;last_name;company;notes\nAna;Ruiz;Acme;\n", encoding="utf-8")
+    team_path = tmp_path / "team.csv"
+    team_path.write_text(team, encoding="utf-8")
+    return ContactResolver(str(contacts), str(team_path), watch=False)
+
+
+def test_same_email_with_two_roles_is_one_team_member(tmp_path):
+    resolver = _resolver(tmp_path, "name;email;role\nJuan;jaaz@example.com;Partner\n"
+                                   "Juan;JAAZ@example.com;Product & Dev Intern\n")
+    assert resolver.get_team_member("juan") == {"name": "Juan", "email": "jaaz@example.com", "role": "Partner"}
+
+
+def test_same_name_with_different_emails_is_ambiguous(tmp_path):
+    resolver = _resolver(tmp_path, "name;email;role\nJuan;juan@example.com;Partner\n"
+                                   "Juan;juan.b@example.com;Analyst\n")
+    with pytest.raises(AmbiguousMatchError):
+        resolver.get_team_member("Juan")
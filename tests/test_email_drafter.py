@@ -0,0 +1,39 @@
+#The email body is decoded from the draft JSON while it streams, however the chunks are cut
+
+import json
+from services.email_drafter import BodyStream
+
+DRAFT = {
+    "subject": "Quick \"hello\"",
+    "body": "Hola Martín,\n\nTabs\tquotes \"here\", a backslash \\ and an emoji 🚀.\n\nBest"
+}
+
+
+def _stream(chunks: list) -> str:
+    received = []
+    stream = BodyStream(received.append)
+    for chunk in chunks:
+        stream.feed(chunk)
+    return "".join(received)
+
+
+def test_body_is_decoded_whole():
+    raw = json.dumps(DRAFT)
+    assert _stream([raw]) == DRAFT["body"]
+
+
+def test_escapes_split_across_chunks_are_decoded_once_complete():
+    #ASCII-escaped JSON: the emoji becomes a surrogate pair of \u escapes, which these cuts split
+    raw = json.dumps(DRAFT)
+    assert "\\ud83d\\ude80" in raw
+    for size in (1, 2, 3, 5, 7):
+        assert _stream([raw[i:i + size] for i in range(0, len(raw), size)]) == DRAFT["body"]
+
+
+def test_text_after_the_body_is_ignored():
+    raw = json.dumps({"body": "Short", "subject": "After"})
+    received = []
+    stream = BodyStream(received.append)
+    stream.feed(raw)
+    stream.feed('{"body": "again"}')
+    assert "".join(received) == "Short" and stream.finished
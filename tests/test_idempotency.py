@@ -0,0 +1,48 @@
+#A retry that lands on another worker process waits for the first run instead of starting its own
+
+import asyncio
+from idempotency import IdempotentRunner, IdempotencyStore
+from models import OutreachRequest, OutreachResponse
+
+
+class _Orchestrator:
+    def __init__(self):
+        self.runs = 0
+
+    async def run(self, request: OutreachRequest) -> OutreachResponse:
+        self.runs += 1
+        await asyncio.sleep(0.3)
+        return OutreachResponse(status="queued", sent_to="team@example.com",
+                                contact_name=f"{request.first_name} {request.last_name}",
+                                email_preview=f"draft {self.runs}")
+
+
+def test_retry_on_another_worker_waits_for_the_running_key(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+    orchestrator = _Orchestrator()
+    #Two runners on one database stand in for two worker processes
+    first = IdempotentRunner(orchestrator, IdempotencyStore(path))
+    second = IdempotentRunner(orchestrator, IdempotencyStore(path))
+    request = OutreachRequest(first_name="Ana", last_name="Ruiz", company="Acme", team_member="Nico")
+
+    async def run():
+        started = asyncio.ensure_future(first.run(request, "key-1"))
+        await asyncio.sleep(0.05)
+        retried = await second.run(request, "key-1")
+        return await started, retried
+
+    (result, replayed_first), (retry, replayed_retry) = asyncio.run(run())
+    assert orchestrator.runs == 1
+    assert retry == result
+    assert not replayed_first and replayed_retry
+
+
+def test_key_is_run_again_after_a_failed_run_on_another_worker(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+    first, second = IdempotencyStore(path), IdempotencyStore(path)
+    assert first.claim("key-1", "fp", "worker-a") == ("claimed", None)
+    assert second.claim("key-1", "fp", "worker-b") == ("running", "fp")
+    #The failed run stores nothing and gives the key up
+    first.release("key-1", "worker-a")
+    assert second.claim("key-1", "fp", "worker-b") == ("claimed", None)
+    assert not first.renew("key-1", "worker-a")
@@ -0,0 +1,53 @@
+#Outbox messages and jobs claimed by a live worker are not taken over by another one until the lease runs out
+
+import asyncio
+import services.outbox as outbox_module
+import jobs as jobs_module
+from services.outbox import Outbox
+from jobs import JobStore
+from models import OutreachRequest
+
+
+def test_outbox_leaves_a_live_senders_batch_alone(tmp_path, monkeypatch):
+    path = str(tmp_path / "outbox.db")
+    first, second = Outbox(gmail=None, path=path), Outbox(gmail=None, path=path)
+    first.enqueue("a@example.com", "Hi", "Body")
+    claimed = first._claim()
+    assert len(claimed) == 1
+
+    #A worker starting up must not send the batch again
+    async def start_and_claim():
+        second.start()
+        rows = second._claim()
+        second._task.cancel()
+        return rows
+    assert asyncio.run(start_and_claim()) == []
+
+    #Once the lease has run out the message is taken over
+    monkeypatch.setattr(outbox_module, "OUTBOX_LEASE", 0.0)
+    first._renew(claimed)
+    assert [row[0] for row in second._claim()] == [claimed[0][0]]
+    #The first sender's late outcome no longer applies
+    first._record(claimed[0], RuntimeError("late failure"))
+    assert second.status(claimed[0][0])["status"] == "sending"
+
+
+def test_job_store_takes_over_expired_leases_only(tmp_path, monkeypatch):
+    path = str(tmp_path / "jobs.db")
+    first, second = JobStore(path), JobStore(path)
+    job_id = first.create(OutreachRequest(first_name="A", last_name="B", company="C", team_member="D"))
+    assert first.claim_next()[0] == job_id
+    assert second.claim_next() is None
+
+    monkeypatch.setattr(jobs_module, "JOB_LEASE", 0.0)
+    first.renew(job_id)
+    assert second.claim_next()[0] == job_id
+    assert not first.renew(job_id)
+    first.finish(job_id, error="late")
+    assert second.get(job_id).status == "running"
+
+    #A job released on shutdown is resumed straight away
+    monkeypatch.setattr(jobs_module, "JOB_LEASE", 60.0)
+    second.renew(job_id)
+    second.release(job_id)
+    assert first.claim_next()[0] == job_id
@@ -0,0 +1,119 @@
+#Deduplication only holds while a message is queued or recently sent, old messages are purged
+
+import asyncio
+import sqlite3
+import time
+from services.outbox import Outbox, OUTBOX_RETENTION
+
+
+def _age(outbox: Outbox, outbox_id: int, status: str, seconds: float):
+    with outbox._lock:
+        outbox._conn.execute(
+            "UPDATE outbox SET status = ?, updated_at = ? WHERE id = ?", (status, time.time() - seconds, outbox_id)
+        )
+
+
+def test_identical_message_is_held_back_while_queued_or_recently_sent(tmp_path):
+    outbox = Outbox(gmail=None, path=str(tmp_path / "outbox.db"))
+    first = outbox.enqueue("a@example.com", "Hi", "Body")
+    assert outbox.enqueue("a@example.com", "Hi", "Body") == first
+    _age(outbox, first["outbox_id"], "sent", 60)
+    assert outbox.enqueue("a@example.com", "Hi", "Body") == {"outbox_id": first["outbox_id"], "status": "sent"}
+    #Sent longer ago than the retention window: a new message
+    _age(outbox, first["outbox_id"], "sent", OUTBOX_RETENTION + 60)
+    assert outbox.enqueue("a@example.com", "Hi", "Body")["outbox_id"] != first["outbox_id"]
+
+
+def test_failed_message_can_be_queued_again(tmp_path):
+    outbox = Outbox(gmail=None, path=str(tmp_path / "outbox.db"))
+    first = outbox.enqueue("a@example.com", "Hi", "Body")
+    _age(outbox, first["outbox_id"], "failed", 0)
+    again = outbox.enqueue("a@example.com", "Hi", "Body")
+    assert again["status"] == "queued" and again["outbox_id"] != first["outbox_id"]
+
+
+def test_purge_removes_only_old_finished_messages(tmp_path):
+    outbox = Outbox(gmail=None, path=str(tmp_path / "outbox.db"))
+    old = outbox.enqueue("a@example.com", "Old", "Body")["outbox_id"]
+    recent = outbox.enqueue("a@example.com", "Recent", "Body")["outbox_id"]
+    queued = outbox.enqueue("a@example.com", "Queued", "Body")["outbox_id"]
+    _age(outbox, old, "sent", OUTBOX_RETENTION + 60)
+    _age(outbox, recent, "failed", 60)
+    assert outbox.purge() == 1
+    assert outbox.status(old) is None
+    assert outbox.status(recent)["status"] == "failed"
+    assert outbox.status(queued)["status"] == "pending"
+
+
+def test_outbox_with_unique_hashes_is_migrated(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    hash TEXT NOT NULL UNIQUE,
+                    to_email TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    message_id TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+    )
+    conn.execute(
+        "INSERT INTO outbox (hash, to_email, subject, body, status, next_attempt_at, created_at, updated_at) "
+        "VALUES ('h', 'a@example.com', 'Hi', 'Body', 'failed', 0, 0, 0)"
+    )
+    conn.commit()
+    conn.close()
+
+    outbox = Outbox(gmail=None, path=path)
+    assert outbox.status(1)["status"] == "failed"
+    #Two rows with one hash are allowed now
+    with outbox._lock:
+        outbox._conn.execute(
+            "INSERT INTO outbox (hash, to_email, subject, body, status, next_attempt_at, created_at, updated_at) "
+            "VALUES ('h', 'a@example.com', 'Hi', 'Body', 'pending', 0, 0, 0)"
+        )
+    assert outbox.status(2)["status"] == "pending"
+    assert outbox._conn.execute("SELECT owner, lease_until FROM outbox WHERE id = 1").fetchone() == (None, None)
+
+
+class _SlowGmail:
+    #Records how many batches are in flight at once, a shared Gmail client can only take one
+    def __init__(self):
+        self.sent = []
+        self.active = 0
+        self.overlapped = False
+
+    def send_batch(self, messages: list) -> list:
+        self.active += 1
+        self.overlapped |= self.active > 1
+        time.sleep(0.2)
+        self.sent.extend(message["subject"] for message in messages)
+        self.active -= 1
+        return [{"message_id": message["subject"], "status": "delivered"} for message in messages]
+
+
+def test_flush_waits_for_the_background_senders_batch(tmp_path):
+    gmail = _SlowGmail()
+    outbox = Outbox(gmail=gmail, path=str(tmp_path / "outbox.db"))
+
+    async def run():
+        outbox.start()
+        ids = [outbox.enqueue("a@example.com", f"Hi {i}", "Body")["outbox_id"] for i in range(3)]
+        #The sender has claimed the batch and is sending it when flush starts
+        await asyncio.sleep(0.05)
+        flushed = await outbox.flush()
+        statuses = [outbox.status(outbox_id)["status"] for outbox_id in ids]
+        await outbox.stop()
+        return flushed, statuses
+
+    flushed, statuses = asyncio.run(run())
+    assert flushed and statuses == ["sent"] * 3
+    assert sorted(gmail.sent) == ["Hi 0", "Hi 1", "Hi 2"]
+    assert not gmail.overlapped
@@ -0,0 +1,118 @@
+#Stages run in dependency order, optional stages fail soft and bad graphs are rejected up front
+
+import asyncio
+import pytest
+from pipeline import Pipeline, Stage
+
+
+def _run(pipeline: Pipeline, results: dict, **kwargs) -> dict:
+    return asyncio.run(pipeline.run(results, **kwargs))
+
+
+def test_stages_start_after_their_dependencies_and_overlap_otherwise():
+    events = []
+
+    def step(name: str, delay: float):
+        async def func(**inputs):
+            events.append(f"{name} start")
+            await asyncio.sleep(delay)
+            events.append(f"{name} end")
+            return name
+        return func
+
+    pipeline = Pipeline(
+        [
+            Stage("join", step("join", 0), deps=("slow", "fast")),
+            Stage("slow", step("slow", 0.05), deps=("seed",)),
+            Stage("fast", step("fast", 0.01), deps=("seed",)),
+        ],
+        inputs=("seed",)
+    )
+    assert [stage.name for stage in pipeline.order] == ["slow", "fast", "join"]
+    results = _run(pipeline, {"seed": 1})
+    assert results["join"] == "join"
+    #Independent stages both start before either ends, the join waits for both
+    assert events[:2] == ["slow start", "fast start"]
+    assert events.index("join start") > events.index("slow end")
+
+
+def test_failed_optional_stage_skips_its_optional_dependents():
+    statuses = []
+
+    async def broken(seed):
+        raise RuntimeError("no strategy today")
+
+    async def unused(broken):
+        raise AssertionError("must not run")
+
+    async def required(seed):
+        return "email"
+
+    pipeline = Pipeline(
+        [
+            Stage("broken", broken, deps=("seed",), optional=True),
+            Stage("dependent", unused, deps=("broken",), optional=True),
+            Stage("required", required, deps=("seed",)),
+        ],
+        inputs=("seed",)
+    )
+    results = _run(pipeline, {"seed": 1}, listener=lambda name, status, payload: statuses.append((name, status)))
+    assert results["broken"] is None and results["dependent"] is None
+    assert results["required"] == "email"
+    assert ("dependent", "skipped") in statuses
+
+
+def test_completed_stages_and_stages_outside_the_targets_are_not_run():
+    calls = []
+
+    def stage(name: str):
+        async def func(**inputs):
+            calls.append(name)
+            return name
+        return func
+
+    pipeline = Pipeline(
+        [
+            Stage("research", stage("research"), deps=("seed",)),
+            Stage("draft", stage("draft"), deps=("research",)),
+            Stage("other", stage("other"), deps=("seed",)),
+        ],
+        inputs=("seed",)
+    )
+    results = _run(pipeline, {"seed": 1, "research": "cached"}, targets=("draft",))
+    assert calls == ["draft"]
+    assert results["research"] == "cached" and "other" not in results
+
+
+def test_required_stage_failure_cancels_the_rest():
+    cancelled = []
+
+    async def failing(seed):
+        raise ValueError("contact not found")
+
+    async def slow(seed):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    pipeline = Pipeline([Stage("failing", failing, deps=("seed",)), Stage("slow", slow, deps=("seed",))],
+                        inputs=("seed",))
+    with pytest.raises(ValueError):
+        _run(pipeline, {"seed": 1})
+    assert cancelled == ["slow"]
+
+
+def test_invalid_graphs_are_rejected():
+    async def noop(**inputs):
+        return None
+
+    with pytest.raises(ValueError, match="cycle"):
+        Pipeline([Stage("a", noop, deps=("b",)), Stage("b", noop, deps=("a",))])
+    with pytest.raises(ValueError, match="unknown stage"):
+        Pipeline([Stage("a", noop, deps=("missing",))])
+    with pytest.raises(ValueError, match="optional stage"):
+        Pipeline([Stage("a", noop, optional=True), Stage("b", noop, deps=("a",))])
+    with pytest.raises(ValueError, match="Duplicate"):
+        Pipeline([Stage("a", noop), Stage("a", noop)])
@@ -0,0 +1,83 @@
+#The circuit breaker's half-open trial must be given back when the trial never reaches the upstream.
+#Shared buckets wait for other processes' locks without blocking the event loop
+
+import time
+import sqlite3
+import asyncio
+import pytest
+from services.rate_limit import Upstream, CircuitOpenError, SharedTokenBucket
+from services.shared_state import SharedState
+from services.deadline import deadline, DeadlineExceeded
+
+
+async def _ok():
+    return "ok"
+
+
+def _half_open_without_tokens() -> Upstream:
+    upstream = Upstream("test", rate=1.0, burst=1.0)
+    upstream.breaker.opened_at = time.monotonic() - upstream.breaker.reset_timeout - 1
+    upstream.bucket.tokens = 0.0
+    return upstream
+
+
+def test_trial_cancelled_while_waiting_for_a_token():
+    upstream = _half_open_without_tokens()
+
+    async def scenario():
+        trial = asyncio.create_task(upstream.call(_ok))
+        await asyncio.sleep(0.05)
+        assert upstream.breaker.trial
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert not upstream.breaker.trial
+        #The next call becomes the trial instead of failing with CircuitOpenError
+        return await upstream.call(_ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert upstream.breaker.opened_at is None
+
+
+def test_trial_timed_out_waiting_for_a_token():
+    upstream = _half_open_without_tokens()
+
+    async def scenario():
+        with deadline(0.1):
+            with pytest.raises(DeadlineExceeded):
+                await upstream.call(_ok)
+        assert not upstream.breaker.trial
+        return await upstream.call(_ok)
+
+    assert asyncio.run(scenario()) == "ok"
+
+
+def test_open_circuit_still_fails_fast():
+    upstream = Upstream("test", rate=1.0, burst=1.0)
+    upstream.breaker.opened_at = time.monotonic()
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(upstream.call(_ok))
+
+
+def test_shared_bucket_waits_for_a_locked_database_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "shared_state.db")
+    bucket = SharedTokenBucket(SharedState(path), "test", rate=10.0, burst=10.0)
+    #Another worker holding the write lock
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+
+    async def scenario():
+        acquire = asyncio.create_task(bucket.acquire())
+        #The loop keeps running while acquire waits for the lock
+        gaps, last = [], time.monotonic()
+        for _ in range(10):
+            await asyncio.sleep(0.02)
+            gaps.append(time.monotonic() - last)
+            last = time.monotonic()
+        assert not acquire.done()
+        other.execute("COMMIT")
+        return max(gaps), await acquire
+
+    gap, waited = asyncio.run(scenario())
+    assert gap < 0.5 and waited == 0.0
+    assert asyncio.run(bucket.try_acquire_async(9.0))
@@ -0,0 +1,20 @@
+#Pages are split into passages that fit the budget, whatever their line breaks
+
+from services.research_ranker import rank_and_pack, _passages, PASSAGE_TARGET_CHARS
+
+
+def test_single_line_page_is_packed_within_budget():
+    sentence = "Acme Robotics announced a new warehouse robot at the Madrid expo this spring. "
+    text = (sentence * 40).strip()
+    assert "\n" not in text and len(text) > 3000
+    packed = rank_and_pack([{"url": "https://acme.example/news", "text": text}], "Ana Ruiz", "Acme Robotics", 2400)
+    assert packed and len(packed) <= 2400
+    assert "warehouse robot" in packed
+
+
+def test_long_sentences_are_split_at_word_boundaries():
+    text = " ".join(["word"] * 400)
+    passages = _passages(text)
+    assert len(passages) > 1
+    assert all(len(p) <= PASSAGE_TARGET_CHARS for p in passages)
+    assert " ".join(passages) == text
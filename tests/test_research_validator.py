@@ -0,0 +1,61 @@
+#Validated sections are memoized one by one, so changed research only re-validates its own section
+
+import asyncio
+from types import SimpleNamespace
+import services.research_validator as validator_module
+from services.research_validator import ResearchValidatorService, SECTIONS
+
+
+class FakeLLM:
+
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, label: str, **params):
+        self.calls.append(params)
+        if "tools" in params:
+            fields = params["tools"][0]["input_schema"]["required"]
+            return SimpleNamespace(content=[SimpleNamespace(type="tool_use", input={f: f"ok {f}" for f in fields})])
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text="ok section")])
+
+
+def _validator(tmp_path, monkeypatch):
+    monkeypatch.setattr(validator_module, "VALIDATION_CACHE_PATH", str(tmp_path / "validation.db"))
+    monkeypatch.setattr(validator_module, "shared", lambda: None)
+    llm = FakeLLM()
+    return ResearchValidatorService(llm, mode="combined"), llm
+
+
+def _research(activity: str) -> dict:
+    return {"person_context": "Ana founded Acme.", "activity_context": activity,
+            "company_context": "Acme raised a seed round."}
+
+
+def test_only_changed_sections_are_validated_again(tmp_path, monkeypatch):
+    validator, llm = _validator(tmp_path, monkeypatch)
+    run = lambda research: asyncio.run(validator.validate(research, "notes", "Ana Ruiz", "Acme"))
+
+    first = run(_research("Ana spoke at a summit."))
+    assert len(llm.calls) == 1 and "tools" in llm.calls[0]
+    assert first["validated_company"] == "ok validated_company"
+
+    #Unchanged research: nothing is sent
+    run(_research("Ana spoke at a summit."))
+    assert len(llm.calls) == 1
+
+    #Only the activity section changed: one call for that section alone
+    second = run(_research("Ana launched a product."))
+    assert len(llm.calls) == 2 and "tools" not in llm.calls[1]
+    assert second["validated_person"] == "ok validated_person"
+    assert second["validated_activity"] == "ok section"
+
+
+def test_combined_results_serve_per_section_lookups(tmp_path, monkeypatch):
+    validator, llm = _validator(tmp_path, monkeypatch)
+    research = _research("Ana spoke at a summit.")
+    asyncio.run(validator.validate(research, "notes", "Ana Ruiz", "Acme"))
+    requests = validator.section_requests(research, "notes", "Ana Ruiz", "Acme", tuple(SECTIONS))
+    #Bulk runs look sections up one by one
+    assert {field: validator.cached(params) for field, params in requests.items()} == {
+        field: f"ok {field}" for field in SECTIONS
+    }
@@ -0,0 +1,116 @@
+#Identical in-flight calls are made once, and hedged calls use whichever attempt answers first
+
+import asyncio
+import pytest
+import services.hedge as hedge_module
+from services.hedge import Hedger
+from services.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"results": [1]}
+
+    async def run():
+        return await asyncio.gather(*[flight.do("query", fetch) for _ in range(5)])
+
+    results = asyncio.run(run())
+    assert len(calls) == 1 and all(result == {"results": [1]} for result in results)
+    assert flight.stats() == {"calls": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_errors_reach_every_caller_and_the_next_call_runs_again():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        outcomes = await asyncio.gather(*[flight.do("query", failing) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+        with pytest.raises(RuntimeError):
+            await flight.do("query", failing)
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_call_for_others():
+    flight = SingleFlight("test")
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("query", fetch))
+        second = asyncio.ensure_future(flight.do("query", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "done"
+
+
+def _hedger(monkeypatch, admit=None) -> Hedger:
+    #Every call may be hedged, after 20ms
+    monkeypatch.setattr(hedge_module, "HEDGE_BUDGET", 1.0)
+    return Hedger("test", default_delay=0.02, admit=admit)
+
+
+def test_hedge_wins_when_the_first_attempt_is_slow(monkeypatch):
+    hedger = _hedger(monkeypatch)
+    delays = [1.0, 0.01]
+    cancelled = []
+
+    async def call():
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    assert asyncio.run(hedger.call(call)) == 0.01
+    assert hedger.hedges == 1
+    #The losing attempt is cancelled
+    assert cancelled == [1.0]
+
+
+def test_first_attempt_wins_when_the_hedge_is_slower(monkeypatch):
+    hedger = _hedger(monkeypatch)
+    delays = [0.05, 1.0]
+
+    async def call():
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        return delay
+
+    assert asyncio.run(hedger.call(call)) == 0.05
+    assert hedger.hedges == 1
+
+
+def test_no_hedge_without_admission_and_errors_propagate(monkeypatch):
+    async def refuse():
+        return False
+
+    hedger = _hedger(monkeypatch, admit=refuse)
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        await asyncio.sleep(0.05)
+        raise RuntimeError("bad gateway")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(hedger.call(call))
+    assert len(attempts) == 1 and hedger.hedges == 0